@@ -1,7 +1,8 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import json
+
+from data_layer import load_snapshot
 
 # Set page config
 st.set_page_config(
@@ -11,16 +12,21 @@ st.set_page_config(
 )
 
 @st.cache_data
-def process_metrics(filepath):
-    """Process metrics from aggregated dataset"""
+def load_months(_snapshot, version):
+    """Months of the aggregated dataset, as 'YYYY-MM'"""
+    dates = _snapshot.frame('monthly_summary')['date']
+    return sorted(dates.dt.strftime('%Y-%m').unique())
+
+
+@st.cache_data
+def process_metrics(_snapshot, version, target_month='2023-01'):
+    """Process metrics of `target_month` (vs the month before) from aggregated dataset"""
     try:
-        # Read the aggregated dataset
-        df = pd.read_csv(filepath)
-        df['date'] = pd.to_datetime(df['date'])
+        # The aggregated dataset (monthly_summary.csv, dates already parsed)
+        df = _snapshot.frame('monthly_summary')
         
-        # Set January 2023 as current month
-        target_date = pd.Timestamp('2023-01-01')  # January 2023
-        previous_date = pd.Timestamp('2022-12-01')  # December 2022
+        target_date = pd.Timestamp(f"{target_month}-01")
+        previous_date = target_date - pd.DateOffset(months=1)
         
         # Get data for current and previous months
         current_month_data = df[df['date'] == target_date].groupby('date').agg({
@@ -90,55 +96,56 @@ def process_metrics(filepath):
         return None
     
 @st.cache_data
-@st.cache_data
-def load_time_metrics(hourly_filepath='data/hourly_metrics.csv', 
-                      daily_filepath='data/daily_metrics.csv', 
-                      peaks_filepath='data/peak_hours.csv'):
-    """Calculate time metrics from CSV files."""
+def load_time_metrics(_snapshot, version):
+    """Time metrics (hourly_metrics.csv, daily_metrics.csv, peak_hours.csv) from the snapshot."""
     try:
-        # Load hourly metrics
-        hourly_metrics = pd.read_csv(hourly_filepath)
-        
-        # Ensure the hour column is numeric
-        hourly_metrics['hour'] = pd.to_numeric(hourly_metrics['hour'], errors='coerce').fillna(0).astype(int)
-        
-        # Load daily metrics
-        daily_metrics = pd.read_csv(daily_filepath)
-        
-        # Load peaks data
-        peaks = pd.read_csv(peaks_filepath)
-
-        # Ensure proper formatting for peaks data
-        peaks['peak_hour'] = peaks['peak_hour'].astype(int)
-        peaks['lowest_hour'] = peaks['lowest_hour'].astype(int)
-
         return {
-            'hourly': hourly_metrics,
-            'daily': daily_metrics,
-            'peaks': peaks
+            'hourly': _snapshot.frame('hourly_metrics'),
+            'daily': _snapshot.frame('daily_metrics'),
+            'peaks': _snapshot.frame('peak_hours')
         }
     except Exception as e:
         st.error(f"Error calculating time metrics: {str(e)}")
         return None
     
 
-@st.cache_data
-def load_topic_metrics():
-    """Load preprocessed topic metrics for dashboard"""
-    try:
-        with open('data/dashboard_topic_metrics.json', 'r') as f:
-            metrics = json.load(f)
-        return metrics
-    except Exception as e:
-        st.error(f"Error loading topic metrics: {str(e)}")
-        return None
+def load_topic_metrics(snapshot):
+    """Preprocessed topic metrics for dashboard, keyed by month ('YYYY-MM')"""
+    if snapshot.topic_metrics is None:
+        st.error("Error loading topic metrics: dashboard_topic_metrics.json is not in the dashboard snapshot.")
+    return snapshot.topic_metrics
+
+def topic_metric(label, data, help_text, **kwargs):
+    """Hot topic card; n/a when no topic qualifies in the selected month"""
+    if data is None:
+        st.metric(label=label, value="n/a")
+        return
+    st.metric(label=label, value=", ".join(data['topic'][:2]), delta=f"{data['change']:+.1f}%",
+              help=help_text(data), **kwargs)
+
+
+# All data comes from the dashboard snapshot (scripts/dashboard_snapshot.py), shared by all sessions
+snapshot = load_snapshot()
+
+# Month selection (January 2023 by default)
+months = load_months(snapshot, snapshot.version)
+selected_month = st.sidebar.selectbox(
+    "Month",
+    months,
+    index=months.index('2023-01') if '2023-01' in months else len(months) - 1,
+    format_func=lambda month: pd.Timestamp(f"{month}-01").strftime('%B %Y')
+)
 
 # Load and process data
-metrics = process_metrics('data/monthly_summary.csv')
-time_metrics = load_time_metrics()
-topic_metrics = load_topic_metrics()
+metrics = process_metrics(snapshot, snapshot.version, selected_month)
+time_metrics = load_time_metrics(snapshot, snapshot.version)
+all_topic_metrics = load_topic_metrics(snapshot)
+# Topic metrics are precomputed for every month by scripts/home_topic.py
+topic_metrics = all_topic_metrics.get(selected_month) if all_topic_metrics else None
 
 st.title("🔍 Reddit Toxicity Analysis Dashboard")
+if metrics is None:
+    st.stop()
 
 # Current month display
 st.subheader(f"Current Month: {metrics['dates']['current_month']}")
@@ -185,44 +192,40 @@ col1, col2, col3, col4 = st.columns(4)
 
 if topic_metrics:
     with col1:
-        st.metric(
-            label="🔥 Most Active Topic",
-            value=", ".join(topic_metrics['most_active']['topic'][:2]),
-            delta=f"{topic_metrics['most_active']['change']:+.1f}%",
-            help=(f"Current activity: {topic_metrics['most_active']['posts']:.0f} posts\n"
-                  f"Previous month: {topic_metrics['most_active']['previous_posts']:.0f} posts\n"
-                  f"Shows topic with highest current activity")
+        topic_metric(
+            "🔥 Most Active Topic",
+            topic_metrics['most_active'],
+            lambda data: (f"Current activity: {data['posts']:.0f} posts\n"
+                          f"Previous month: {data['previous_posts']:.0f} posts\n"
+                          f"Shows topic with highest current activity")
         )
 
     with col2:
-        st.metric(
-            label="⚠️ Highest Toxicity",
-            value=", ".join(topic_metrics['highest_toxicity']['topic'][:2]),
-            delta=f"{topic_metrics['highest_toxicity']['change']:+.1f}%",
-            delta_color="inverse",
-            help=(f"Current toxicity: {topic_metrics['highest_toxicity']['score']:.3f}\n"
-                  f"Previous month: {topic_metrics['highest_toxicity']['previous_score']:.3f}\n"
-                  f"Topics that might need attention")
+        topic_metric(
+            "⚠️ Highest Toxicity",
+            topic_metrics['highest_toxicity'],
+            lambda data: (f"Current toxicity: {data['score']:.3f}\n"
+                          f"Previous month: {data['previous_score']:.3f}\n"
+                          f"Topics that might need attention"),
+            delta_color="inverse"
         )
 
     with col3:
-        st.metric(
-            label="📈 Trending Topic",
-            value=", ".join(topic_metrics['trending']['topic'][:2]),
-            delta=f"{topic_metrics['trending']['change']:+.1f}%",
-            help=(f"Current posts: {topic_metrics['trending']['posts']:.0f}\n"
-                  f"Previous month: {topic_metrics['trending']['previous_posts']:.0f}\n"
-                  f"Topic with fastest growth")
+        topic_metric(
+            "📈 Trending Topic",
+            topic_metrics['trending'],
+            lambda data: (f"Current posts: {data['posts']:.0f}\n"
+                          f"Previous month: {data['previous_posts']:.0f}\n"
+                          f"Topic with fastest growth")
         )
 
     with col4:
-        st.metric(
-            label="👥 Most Engaged",
-            value=", ".join(topic_metrics['most_engaged']['topic'][:2]),
-            delta=f"{topic_metrics['most_engaged']['change']:+.1f}%",
-            help=(f"Current activity: {topic_metrics['most_engaged']['posts']:.0f} posts\n"
-                  f"Previous month: {topic_metrics['most_engaged']['previous_posts']:.0f} posts\n"
-                  f"Topic with highest sustained engagement")
+        topic_metric(
+            "👥 Most Engaged",
+            topic_metrics['most_engaged'],
+            lambda data: (f"Current activity: {data['posts']:.0f} posts\n"
+                          f"Previous month: {data['previous_posts']:.0f} posts\n"
+                          f"Topic with highest sustained engagement")
         )
 
     # Topic Deep Dive Section
@@ -335,7 +338,9 @@ if topic_metrics:
             st.warning("📅 **Most Active Day**\n\nData not available")
         with col3:
             st.success("⏰ **Activity Patterns**\n\nData not available")
-        
+else:
+    st.info("No topic metrics for this month (run scripts/home_topic.py)")
+
 # Navigation footer
 st.markdown("---")
 st.markdown("""
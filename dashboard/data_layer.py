@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+import threading
+
+import streamlit as st
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'scripts'))
+from dashboard_snapshot import SNAPSHOT_FILE, Snapshot, refresh_snapshot, source_stats
+from network_store import NetworkStore, network_version
+
+SNAPSHOT_PATH = os.path.join('data', SNAPSHOT_FILE)
+NETWORK_DIRECTORY = os.path.join('data', 'topic_network')
+
+# Sessions run in threads of one process: only one of them rebuilds a stale snapshot
+_refresh_lock = threading.Lock()
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _open_snapshot(path, version, sources):
+    """One snapshot per version, shared by all sessions (a new version replaces the old one)"""
+    if version is None:
+        # No snapshot written yet: parse the source files once per state of the sources
+        return Snapshot.from_sources(os.path.dirname(path))
+    return Snapshot(path)
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """
+    The dashboard snapshot (written by scripts/dashboard_snapshot.py).
+
+    The snapshot is rebuilt first if its source files changed since it was
+    written. Pass `snapshot.version` to `st.cache_data` functions so their
+    caches are only invalidated when the snapshot changes.
+    """
+    with _refresh_lock:
+        version = refresh_snapshot(os.path.dirname(path), path)
+    sources = json.dumps(source_stats(os.path.dirname(path))) if version is None else None
+    return _open_snapshot(path, version, sources)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _open_network(directory, version):
+    """One network store per version, shared by all sessions"""
+    return NetworkStore(directory) if version is not None else None
+
+
+def load_network(directory=NETWORK_DIRECTORY):
+    """The topic network store (written by topic_network.ipynb), None if it was not written"""
+    return _open_network(directory, network_version(directory))
@@ -3,34 +3,23 @@ import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
-import os
+from data_layer import load_snapshot
 # from datetime import datetime, timedelta
 
 # Define Handles
 @st.cache_data
-def load_monthly_summary():
+def load_monthly_summary(_snapshot, version):
     try:
-        file_path = 'data/monthly_scores_summary.csv'
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"{file_path} not found.")
-        
-        df = pd.read_csv(file_path)
-        df['yearmonth'] = pd.to_datetime(df['yearmonth'])
-        df['year'] = df['yearmonth'].dt.year
-        df['month'] = df['yearmonth'].dt.month
-        return df
+        # monthly_scores_summary.csv with yearmonth, year and month parsed
+        return _snapshot.frame('monthly_scores_summary')
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
         return None
 
 @st.cache_data
-def load_topic_clusters_data():
+def load_topic_clusters_data(_snapshot, version):
     try:
-        file_path = 'data/topic_clusters.csv'
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"{file_path} not found.")
-        
-        df = pd.read_csv(file_path)
+        df = _snapshot.frame('topic_clusters')
         df = df.sort_values(by='avg_toxicity', ascending=False) 
         return df
     except Exception as e:
@@ -38,22 +27,18 @@ def load_topic_clusters_data():
         return None
     
 @st.cache_data
-def load_top10_topics_data():
+def load_top10_topics_data(_snapshot, version):
     try:
-        file_path = 'data/top10_topics.csv'
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"{file_path} not found.")
-        
-        df = pd.read_csv(file_path)
-        return df
+        return _snapshot.frame('top10_topics')
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
         return None
 
-# Load data
-monthly_summary = load_monthly_summary()
-topic_clusters = load_topic_clusters_data()
-top10_topics = load_top10_topics_data()
+# Load data (from the dashboard snapshot, shared by all sessions)
+snapshot = load_snapshot()
+monthly_summary = load_monthly_summary(snapshot, snapshot.version)
+topic_clusters = load_topic_clusters_data(snapshot, snapshot.version)
+top10_topics = load_top10_topics_data(snapshot, snapshot.version)
 
 # Title
 st.title("Overall Analysis")
@@ -2,6 +2,120 @@ import streamlit as st
 import json
 from streamlit.components.v1 import html
 import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+
+from data_layer import load_network
+
+# Focus clusters of the curated topics
+FOCUS_CLUSTERS = {"Police": 99, "LGBTQ": 31}
+
+
+def format_topic_name(keywords_list, max_words=3):
+    """Format topic names in a business-friendly way showing up to max_words"""
+    return ', '.join(word.capitalize() for word in keywords_list[:max_words])
+
+
+def topic_hover(rows):
+    """Hover text of topic nodes"""
+    return [f"<b>Cluster {row.cluster_id}</b><br>{', '.join(row.keywords[:8])}<br>"
+            f"Toxicity: {row.toxicity:.3f}<br>Posts: {row.posts:,}<br>Period: {row.period}"
+            for row in rows.itertuples()]
+
+
+def tree_figure(network, focus):
+    """Topic relationship tree of `focus` from its precomputed layout (see scripts/network_store.py)"""
+    tree = network.tree(focus)
+    nodes = tree.drop_duplicates('cluster_id')
+    positions = dict(zip(nodes['cluster_id'], zip(nodes['x'], nodes['y'])))
+    fig = go.Figure()
+
+    # Connections, one line per (parent, topic) row
+    edges = tree.dropna(subset=['parent'])
+    edge_x, edge_y = [], []
+    for parent, node in zip(edges['parent'], edges['cluster_id']):
+        edge_x += [positions[parent][0], positions[node][0], None]
+        edge_y += [positions[parent][1], positions[node][1], None]
+    fig.add_trace(go.Scatter(x=edge_x, y=edge_y, mode='lines', line=dict(color='grey', width=1),
+                             opacity=0.5, hoverinfo='skip', showlegend=False))
+
+    # Activity overlap of the focus topic and its immediate connections
+    immediate = edges[edges['level'] == 1]
+    fig.add_trace(go.Scatter(
+        x=[(positions[focus][0] + x) / 2 for x in immediate['x']],
+        y=[(positions[focus][1] + y) / 2 + 0.02 for y in immediate['y']],
+        mode='text', text=[f"{value:.1%}" for value in immediate['temporal_sim']],
+        textfont=dict(size=10, color='grey'), hoverinfo='skip', showlegend=False
+    ))
+
+    via = {node: parent for node, parent in zip(edges['cluster_id'], edges['parent'])}
+    fig.add_trace(go.Scatter(
+        x=nodes['x'], y=nodes['y'], mode='markers+text',
+        text=[format_topic_name(keywords) for keywords in nodes['keywords']],
+        textposition='bottom center',
+        hovertext=[hover + (f"<br>via Cluster {via[node]}" if level == 2 else "")
+                   for hover, node, level in zip(topic_hover(nodes), nodes['cluster_id'], nodes['level'])],
+        hoverinfo='text',
+        marker=dict(size=np.where(nodes['level'] == 0, 28, 20), color=nodes['toxicity'], colorscale='YlOrRd',
+                    showscale=True, colorbar=dict(title='Average Toxicity'), line=dict(color='grey', width=1)),
+        showlegend=False
+    ))
+    fig.update_layout(title="Topic Relationship Analysis", height=600, margin=dict(l=10, r=10, t=40, b=10),
+                      xaxis=dict(visible=False, range=[0, 1]), yaxis=dict(visible=False, range=[-0.1, 1.1]))
+    return fig
+
+
+def network_figure(network, focus):
+    """Network of the topics within 2 hops of `focus`, at the precomputed spring layout coordinates"""
+    neighbourhood = network.neighbourhood(focus)
+    nodes = pd.concat([network.nodes.loc[[focus]].reset_index().assign(level=0), neighbourhood],
+                      ignore_index=True)
+    edges = network.subgraph_edges(nodes['cluster_id'])
+    positions = dict(zip(nodes['cluster_id'], zip(nodes['x'], nodes['y'])))
+    fig = go.Figure()
+
+    edge_x, edge_y = [], []
+    for source, target in zip(edges['source'], edges['target']):
+        edge_x += [positions[source][0], positions[target][0], None]
+        edge_y += [positions[source][1], positions[target][1], None]
+    fig.add_trace(go.Scatter(x=edge_x, y=edge_y, mode='lines', line=dict(color='lightgrey', width=0.5),
+                             hoverinfo='skip', showlegend=False))
+
+    for level, name, symbol in [(0, 'Selected topic', 'star'), (1, 'Direct connections', 'circle'),
+                                (2, 'Secondary connections', 'circle-open')]:
+        rows = nodes[nodes['level'] == level]
+        fig.add_trace(go.Scatter(
+            x=rows['x'], y=rows['y'], mode='markers', name=name, hovertext=topic_hover(rows), hoverinfo='text',
+            marker=dict(symbol=symbol, size=np.clip(np.sqrt(rows['posts'].astype(float)) / 4, 6, 30),
+                        color=rows['toxicity'], colorscale='YlOrRd', cmin=nodes['toxicity'].min(),
+                        cmax=nodes['toxicity'].max(), showscale=level == 0,
+                        colorbar=dict(title='Average Toxicity'))
+        ))
+    fig.update_layout(title="Topic Neighbourhood (2 hops)", height=600, margin=dict(l=10, r=10, t=40, b=10),
+                      xaxis=dict(visible=False), yaxis=dict(visible=False),
+                      legend=dict(orientation='h', y=-0.05))
+    return fig
+
+
+def show_topic_tree(network, focus, image_path=None):
+    """Interactive tree of `focus`, or the pre-rendered image when the network store was not written"""
+    if network is not None and focus in network.nodes.index:
+        st.plotly_chart(tree_figure(network, focus), use_container_width=True)
+    elif image_path:
+        st.image(image_path, use_column_width=True)  # Fallback to static image
+    else:
+        st.info("Topic network not available (run topic_network.ipynb to write data/topic_network)")
+
+
+def show_topic_network(network, focus):
+    if network is not None and focus in network.nodes.index:
+        st.plotly_chart(network_figure(network, focus), use_container_width=True)
+    else:
+        st.info("Topic network not available (run topic_network.ipynb to write data/topic_network)")
+
+
+# Precomputed topic network (nodes, edges, 2-hop neighbourhoods and layouts), shared by all sessions
+network = load_network()
 
 # Define custom CSS for the recommendation container
 st.markdown("""
@@ -21,7 +135,8 @@ st.title("Reddit Content Analysis: Topic Deep Dive")
 
 # Sidebar for Detailed Analysis options with "Police" as the default
 st.sidebar.header("Detailed Analysis")
-page_selection = st.sidebar.selectbox("Choose a topic for detailed analysis:", ["Police", "LGBTQ"], index=0)
+page_selection = st.sidebar.selectbox("Choose a topic for detailed analysis:", ["Police", "LGBTQ", "Any Cluster"],
+                                      index=0)
 
 # Layout setup based on selected topic
 if page_selection == "Police":
@@ -43,14 +158,18 @@ if page_selection == "Police":
     left_col, right_col = st.columns([3, 1])  # Left column wider than right column
 
     with left_col:
-        tab1, tab2 = st.tabs(["Topic Relationship Tree", "Topic Relationship Trends Over Time"])
+        tab1, tab2, tab3 = st.tabs(["Topic Relationship Tree", "Topic Relationship Trends Over Time",
+                                    "Topic Network"])
 
         with tab1:
-            st.image('dashboard/graphs/police_tree.png', use_column_width=True)  # Fallback to static image
+            show_topic_tree(network, FOCUS_CLUSTERS["Police"], 'dashboard/graphs/police_tree.png')
 
         with tab2:
             st.image('dashboard/graphs/police_temporal.png', use_column_width=True)
 
+        with tab3:
+            show_topic_network(network, FOCUS_CLUSTERS["Police"])
+
     with right_col:
     # Create tabs for insights and recommendations
         tab1, tab2 = st.tabs(["Insights", "Recommendations"])
@@ -90,14 +209,18 @@ elif page_selection == "LGBTQ":
 
     with left_col:
         # Create Tabs for the left column (graphs)
-        tab1, tab2 = st.tabs(["Topic Relationship Tree", "Topic Relationship Trends Over Time"])
+        tab1, tab2, tab3 = st.tabs(["Topic Relationship Tree", "Topic Relationship Trends Over Time",
+                                    "Topic Network"])
 
         with tab1:
-            st.image('dashboard/graphs/lgbtq_tree.png', use_column_width=True)
+            show_topic_tree(network, FOCUS_CLUSTERS["LGBTQ"], 'dashboard/graphs/lgbtq_tree.png')
 
         with tab2:
             st.image('dashboard/graphs/lgbtq_temporal.png', use_column_width=True)
 
+        with tab3:
+            show_topic_network(network, FOCUS_CLUSTERS["LGBTQ"])
+
     with right_col:
     # Create tabs for insights and recommendations
         tab1, tab2 = st.tabs(["Insights", "Recommendations"])
@@ -115,4 +238,46 @@ elif page_selection == "LGBTQ":
             **Recommendations for LGBTQ-related Discussions:**
             1. <strong>Monitor and moderate sensitive keywords</strong> related to LGBTQ topics (e.g., "homosexuality," "transgender," "gender rights") during high-intensity periods such as debates on LGBTQ rights.
             2. <strong>Promote respectful dialogue</strong> by providing factual information on LGBTQ issues like gender equality and transgender rights, and encourage community leaders to reduce harmful rhetoric.
-            """, unsafe_allow_html=True)
\ No newline at end of file
+            """, unsafe_allow_html=True)
+
+
+elif page_selection == "Any Cluster":
+    st.header("Detailed Analysis: Any Topic Cluster")
+    st.markdown("Relationships of any topic cluster with the topics around it.")
+
+    if network is None:
+        st.info("Topic network not available (run topic_network.ipynb to write data/topic_network)")
+        st.stop()
+
+    # Clusters, most toxic first
+    focus = st.sidebar.selectbox(
+        "Choose a cluster:",
+        network.clusters(),
+        format_func=lambda cluster_id: f"Cluster {cluster_id}: "
+                                       f"{format_topic_name(network.nodes.at[cluster_id, 'keywords'])}"
+    )
+    focus_data = network.nodes.loc[focus]
+    neighbourhood = network.neighbourhood(focus)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Toxicity", f"{focus_data['toxicity']:.3f}")
+    col2.metric("Total Posts", f"{focus_data['posts']:,}")
+    col3.metric("Connected Topics", int((neighbourhood['level'] == 1).sum()))
+    col4.metric("Period", focus_data['period'])
+
+    tab1, tab2 = st.tabs(["Topic Relationship Tree", "Topic Network"])
+
+    with tab1:
+        show_topic_tree(network, focus)
+
+    with tab2:
+        show_topic_network(network, focus)
+
+    st.subheader("Direct Connections")
+    connections = network.connections(focus)
+    connections['topic'] = [format_topic_name(keywords, 5) for keywords in connections['keywords']]
+    st.dataframe(
+        connections[['cluster_id', 'topic', 'toxicity', 'posts', 'weight', 'semantic_sim', 'temporal_sim']]
+        .rename(columns={'weight': 'similarity'}),
+        hide_index=True, use_container_width=True
+    )
@@ -0,0 +1,197 @@
+import ast
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# One row per cluster (sample_topics and topic_indices are Parquet list columns)
+CLUSTER_COLUMNS = ['cluster_id', 'size', 'total_posts', 'topic_diversity', 'avg_toxicity', 'sample_topics',
+                   'topic_indices']
+# One row per (cluster, month) of temporal_evolution / toxicity_evolution. post_count is missing for
+# months not in temporal_evolution, avg_toxicity and toxicity_count for months not in toxicity_evolution
+# (toxicity_count is the `post_count` of toxicity_evolution)
+MONTH_COLUMNS = ['cluster_id', 'yearmonth', 'post_count', 'avg_toxicity', 'toxicity_count']
+# One row per keyword of a cluster, in the order of unique_keywords
+KEYWORD_COLUMNS = ['cluster_id', 'position', 'keyword']
+
+FILES = {'clusters': 'clusters.parquet', 'months': 'cluster_months.parquet', 'keywords': 'cluster_keywords.parquet'}
+
+
+def _literal(value):
+    """Parse a stringified list/dict of topic_clusters.csv (values already parsed are returned as is)"""
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+
+def month_table(cluster_df):
+    """Long (cluster_id, yearmonth, post_count, avg_toxicity, toxicity_count) table of the evolution dicts"""
+    rows = []
+    for cluster_id, temporal, toxicity in zip(cluster_df['cluster_id'], cluster_df['temporal_evolution'],
+                                              cluster_df['toxicity_evolution']):
+        posts = {month: data['post_count'] for year in _literal(temporal).values() for month, data in year.items()}
+        toxic = {month: data for year in _literal(toxicity).values() for month, data in year.items()}
+        for month in sorted(posts.keys() | toxic.keys()):
+            stats = toxic.get(month, {})
+            rows.append((cluster_id, month, posts.get(month), stats.get('avg_toxicity'), stats.get('post_count')))
+    months = pd.DataFrame(rows, columns=MONTH_COLUMNS)
+    return months.astype({'yearmonth': str, 'post_count': 'Int64', 'avg_toxicity': 'float64',
+                          'toxicity_count': 'Int64'})
+
+
+def keyword_table(cluster_df):
+    """Long (cluster_id, position, keyword) table of unique_keywords"""
+    keywords = [_literal(value) for value in cluster_df['unique_keywords']]
+    lengths = [len(words) for words in keywords]
+    return pd.DataFrame({
+        'cluster_id': np.repeat(cluster_df['cluster_id'].to_numpy(), lengths),
+        'position': np.concatenate([np.arange(n) for n in lengths]) if lengths else [],
+        'keyword': [str(word) for words in keywords for word in words]
+    }, columns=KEYWORD_COLUMNS)
+
+
+def cluster_tables(cluster_df):
+    """The clusters, months and keywords tables of a cluster frame (see the *_COLUMNS above)"""
+    if cluster_df.empty:
+        # An analysis without clusters has no columns either
+        cluster_df = pd.DataFrame(columns=CLUSTER_COLUMNS + ['unique_keywords', 'temporal_evolution',
+                                                             'toxicity_evolution'])
+    clusters = cluster_df.reindex(columns=CLUSTER_COLUMNS).copy()
+    for column in ['sample_topics', 'topic_indices']:
+        clusters[column] = [_literal(value) if isinstance(value, (str, list)) else [] for value in clusters[column]]
+    return {'clusters': clusters, 'months': month_table(cluster_df), 'keywords': keyword_table(cluster_df)}
+
+
+def write_cluster_store(cluster_df, directory='data/cluster_store'):
+    """
+    Write the clusters of `analyze_semantic_clusters` (or topic_clusters.csv) as Parquet tables.
+
+    The nested columns become long tables (see MONTH_COLUMNS and KEYWORD_COLUMNS),
+    so readers look metrics up by index instead of parsing Python literals.
+    Every file is written to a temporary name and renamed into place.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tables = cluster_tables(cluster_df)
+    for name, table in tables.items():
+        path = os.path.join(directory, FILES[name])
+        table.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    print(f"Cluster store written to {directory} ({len(tables['clusters'])} clusters, "
+          f"{len(tables['months'])} cluster months, {len(tables['keywords'])} keywords)")
+
+
+def convert_csv(csv_path='data/topic_clusters.csv', directory='data/cluster_store'):
+    """Convert an existing topic_clusters.csv (the only place the literals are parsed)"""
+    write_cluster_store(pd.read_csv(csv_path), directory)
+
+
+class ClusterStore:
+    """
+    Read side of the cluster store.
+
+    - `clusters`: one row per cluster, indexed by cluster_id.
+    - `months`: cluster month metrics indexed by (yearmonth, cluster_id), sorted,
+      so a month (`month`) or a single value is an index lookup.
+    - `keywords`: the keyword table, sorted by cluster and position.
+
+    Parameters:
+    - directory: Directory written by `write_cluster_store`.
+    """
+
+    def __init__(self, directory='data/cluster_store'):
+        self.directory = directory
+        self._set_tables({name: pd.read_parquet(os.path.join(directory, file)) for name, file in FILES.items()})
+
+    @classmethod
+    def from_frame(cls, cluster_df):
+        """A store over the tables of a cluster frame, built in memory (e.g. from topic_clusters.csv)"""
+        store = cls.__new__(cls)
+        store.directory = None
+        store._set_tables(cluster_tables(cluster_df))
+        return store
+
+    def _set_tables(self, tables):
+        self.clusters = tables['clusters'].set_index('cluster_id')
+        self.months = tables['months'].set_index(['yearmonth', 'cluster_id']).sort_index()
+        self.keywords = tables['keywords'].sort_values(['cluster_id', 'position'], kind='stable').reset_index(drop=True)
+
+    def yearmonths(self):
+        """Sorted months with any cluster data"""
+        return list(self.months.index.get_level_values('yearmonth').unique())
+
+    def month(self, yearmonth):
+        """post_count, avg_toxicity and toxicity_count of every cluster with data in `yearmonth`, indexed by cluster_id"""
+        if yearmonth not in self.months.index.levels[0]:
+            return self.months.iloc[:0].droplevel('yearmonth')
+        return self.months.loc[yearmonth]
+
+    def history(self, cluster_id):
+        """Month metrics of one cluster, indexed by yearmonth"""
+        return self.months.xs(cluster_id, level='cluster_id')
+
+    def pivot(self, column):
+        """Clusters x months frame of one metric (missing where a cluster has no entry)"""
+        return self.months[column].unstack('yearmonth')
+
+    def cluster_keywords(self, cluster_id=None):
+        """Keyword list of one cluster, or a Series of keyword lists of all clusters"""
+        if cluster_id is not None:
+            return self.keywords.loc[self.keywords['cluster_id'] == cluster_id, 'keyword'].tolist()
+        return (self.keywords.groupby('cluster_id', sort=False)['keyword'].agg(list)
+                .reindex(self.clusters.index, fill_value=[]))
+
+    def to_frame(self):
+        """
+        The topic_clusters.csv schema with lists and dicts (for code written against the parsed CSV),
+        rebuilt from the tables without parsing.
+        """
+        frame = self.clusters.copy()
+        # Parquet list columns are read as arrays
+        for column in ['sample_topics', 'topic_indices']:
+            frame[column] = [list(value) for value in frame[column]]
+        frame['unique_keywords'] = self.cluster_keywords()
+        temporal = {cluster_id: {} for cluster_id in frame.index}
+        toxicity = {cluster_id: {} for cluster_id in frame.index}
+        months = self.months.reset_index().sort_values(['cluster_id', 'yearmonth'])
+        for cluster_id, yearmonth, post_count, avg_toxicity, toxicity_count in months[MONTH_COLUMNS].itertuples(index=False):
+            year = yearmonth[:4]
+            if not pd.isna(post_count):
+                temporal[cluster_id].setdefault(year, {})[yearmonth] = {'post_count': int(post_count)}
+            if not pd.isna(avg_toxicity):
+                toxicity[cluster_id].setdefault(year, {})[yearmonth] = {
+                    'avg_toxicity': float(avg_toxicity),
+                    'post_count': int(toxicity_count) if not pd.isna(toxicity_count) else 0
+                }
+        frame['temporal_evolution'] = pd.Series(temporal)
+        frame['toxicity_evolution'] = pd.Series(toxicity)
+        return frame.reset_index()[['cluster_id', 'size', 'total_posts', 'unique_keywords', 'topic_diversity',
+                                    'temporal_evolution', 'toxicity_evolution', 'avg_toxicity', 'sample_topics',
+                                    'topic_indices']]
+
+
+def benchmark_cluster_store(csv_path='data/topic_clusters.csv', directory='data/cluster_store',
+                            yearmonth='2023-01'):
+    """Time one month's cluster metrics: parsing topic_clusters.csv against a cluster store lookup"""
+    t0 = time.time()
+    cluster_df = pd.read_csv(csv_path)
+    posts = {}
+    for cluster_id, temporal in zip(cluster_df['cluster_id'], cluster_df['temporal_evolution']):
+        month = ast.literal_eval(temporal).get(yearmonth[:4], {}).get(yearmonth)
+        if month:
+            posts[cluster_id] = month['post_count']
+    csv_seconds = time.time() - t0
+
+    t0 = time.time()
+    store = ClusterStore(directory)
+    store_posts = store.month(yearmonth)['post_count'].dropna()
+    store_seconds = time.time() - t0
+
+    same = pd.Series(posts, dtype='int64').sort_index().equals(store_posts.astype('int64').sort_index())
+    print(f"{yearmonth} post counts of {len(cluster_df)} clusters: CSV + literal_eval {csv_seconds * 1000:.1f} ms, "
+          f"cluster store {store_seconds * 1000:.1f} ms (same: {same})")
+    return csv_seconds, store_seconds
+
+
+if __name__ == "__main__":
+    # Convert the existing topic_clusters.csv once
+    convert_csv('data/topic_clusters.csv', 'data/cluster_store')
+    benchmark_cluster_store()
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+
+def _read_monthly_summary(path):
+    df = pd.read_csv(path)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def _read_hourly_metrics(path):
+    df = pd.read_csv(path)
+    # Ensure the hour column is numeric
+    df['hour'] = pd.to_numeric(df['hour'], errors='coerce').fillna(0).astype(int)
+    return df
+
+
+def _read_peak_hours(path):
+    df = pd.read_csv(path)
+    df['peak_hour'] = df['peak_hour'].astype(int)
+    df['lowest_hour'] = df['lowest_hour'].astype(int)
+    return df
+
+
+def _read_monthly_scores_summary(path):
+    df = pd.read_csv(path)
+    df['yearmonth'] = pd.to_datetime(df['yearmonth'])
+    df['year'] = df['yearmonth'].dt.year
+    df['month'] = df['yearmonth'].dt.month
+    return df
+
+
+# Dashboard tables: source file (relative to the data directory) and the parsing the pages used to do on
+# every cold start
+TABLES = {
+    'monthly_summary': ('monthly_summary.csv', _read_monthly_summary),
+    'hourly_metrics': ('hourly_metrics.csv', _read_hourly_metrics),
+    'daily_metrics': ('daily_metrics.csv', pd.read_csv),
+    'peak_hours': ('peak_hours.csv', _read_peak_hours),
+    'monthly_scores_summary': ('monthly_scores_summary.csv', _read_monthly_scores_summary),
+    'topic_clusters': ('topic_clusters.csv', pd.read_csv),
+    'top10_topics': ('top10_topics.csv', pd.read_csv),
+}
+# Stored in the schema metadata of the snapshot
+TOPIC_METRICS = 'dashboard_topic_metrics.json'
+
+SNAPSHOT_FILE = 'dashboard_snapshot.arrow'
+
+
+def source_version(data_dir='data'):
+    """Hash of the contents of the source files (the snapshot version)"""
+    digest = hashlib.sha1()
+    for file in sorted([file for file, _ in TABLES.values()] + [TOPIC_METRICS]):
+        path = os.path.join(data_dir, file)
+        if os.path.exists(path):
+            digest.update(file.encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def source_stats(data_dir='data'):
+    """Modification time and size of the source files that exist (a stat each, no reading)"""
+    stats = {}
+    for file in sorted([file for file, _ in TABLES.values()] + [TOPIC_METRICS]):
+        path = os.path.join(data_dir, file)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stats[file] = [stat.st_mtime_ns, stat.st_size]
+    return stats
+
+
+def read_sources(data_dir='data'):
+    """Parse the source files that exist: ({name: frame}, topic metrics or None)"""
+    frames = {}
+    for name, (file, reader) in TABLES.items():
+        path = os.path.join(data_dir, file)
+        if os.path.exists(path):
+            frames[name] = reader(path)
+    topic_metrics = None
+    if os.path.exists(os.path.join(data_dir, TOPIC_METRICS)):
+        with open(os.path.join(data_dir, TOPIC_METRICS)) as f:
+            topic_metrics = json.load(f)
+    return frames, topic_metrics
+
+
+def _packed(frame):
+    """One-row list<struct> array of a frame, so tables of any shape share the snapshot's single record batch"""
+    table = pa.Table.from_pandas(frame, preserve_index=False).combine_chunks()
+    rows = pa.StructArray.from_arrays([column.chunk(0) if column.num_chunks else pa.array([], column.type)
+                                       for column in table.columns], fields=list(table.schema))
+    return pa.ListArray.from_arrays(pa.array([0, len(rows)], pa.int32()), rows)
+
+
+def write_snapshot(data_dir='data', path=None):
+    """
+    Pack the dashboard tables and topic metrics into one Arrow IPC file.
+
+    Every table is one column of a single-row record batch (a list of structs),
+    the topic metrics JSON, the version (hash of the sources) and the
+    modification time and size of every source file are schema metadata.
+    Readers memory-map the file, so opening it does not copy the tables.
+    Missing source files are skipped. The file is written to a temporary name
+    and renamed into place.
+
+    Parameters:
+    - data_dir: Directory of the source files.
+    - path: Snapshot file (default: `<data_dir>/dashboard_snapshot.arrow`).
+    """
+    t0 = time.time()
+    path = path or os.path.join(data_dir, SNAPSHOT_FILE)
+    # Stat before reading, so a source rewritten while the snapshot is built makes it stale
+    stats = source_stats(data_dir)
+    version = source_version(data_dir)
+    frames, topic_metrics = read_sources(data_dir)
+    missing = [file for name, (file, _) in TABLES.items() if name not in frames]
+
+    metadata = {'version': version, 'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'sources': json.dumps(stats)}
+    if topic_metrics is not None:
+        metadata['topic_metrics'] = json.dumps(topic_metrics)
+    batch = pa.RecordBatch.from_arrays([_packed(frame) for frame in frames.values()], names=list(frames))
+    batch = batch.replace_schema_metadata(metadata)
+
+    with pa.OSFile(f"{path}.tmp", 'wb') as sink:
+        with pa.ipc.new_file(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+    os.replace(f"{path}.tmp", path)
+    print(f"Dashboard snapshot {version} with {len(frames)} tables written to {path} in {time.time() - t0:.2f}s"
+          + (f" (missing: {', '.join(missing)})" if missing else ""))
+    return version
+
+
+def snapshot_version(path):
+    """Version of a snapshot file (reads the schema only), None if there is no snapshot"""
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema.metadata[b'version'].decode()
+
+
+def snapshot_sources(path):
+    """Source file stats recorded in a snapshot (reads the schema only), None if there is no snapshot"""
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata
+    return json.loads(metadata[b'sources']) if b'sources' in metadata else {}
+
+
+def refresh_snapshot(data_dir='data', path=None):
+    """
+    Rewrite the snapshot if any source file was added, removed or modified since it was written.
+
+    Only the source files are stat-ed, so this is cheap enough to run on every
+    page load. Returns the current snapshot version, None if no snapshot was
+    written (it is not created here).
+    """
+    path = path or os.path.join(data_dir, SNAPSHOT_FILE)
+    recorded = snapshot_sources(path)
+    if recorded is None:
+        return None
+    if recorded != source_stats(data_dir):
+        print(f"Sources of {path} changed, rebuilding it")
+        return write_snapshot(data_dir, path)
+    return snapshot_version(path)
+
+
+class Snapshot:
+    """
+    Read side of the dashboard snapshot.
+
+    The file is memory-mapped; a table is converted to pandas the first time it is
+    requested and kept, so a snapshot object can be shared by all sessions.
+
+    Parameters:
+    - path: File written by `write_snapshot`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.batch = pa.ipc.open_file(pa.memory_map(path)).get_batch(0)
+        metadata = self.batch.schema.metadata
+        self.version = metadata[b'version'].decode()
+        self.topic_metrics = json.loads(metadata[b'topic_metrics']) if b'topic_metrics' in metadata else None
+        self._frames = {}
+
+    @classmethod
+    def from_sources(cls, data_dir='data'):
+        """A snapshot over the parsed source files, built in memory (when no snapshot file was written)"""
+        snapshot = cls.__new__(cls)
+        snapshot.path = None
+        snapshot.version = source_version(data_dir)
+        snapshot._frames, snapshot.topic_metrics = read_sources(data_dir)
+        snapshot.batch = None
+        return snapshot
+
+    def names(self):
+        """Tables in the snapshot"""
+        return list(self._frames) if self.batch is None else self.batch.schema.names
+
+    def table(self, name):
+        """Arrow table of `name` (zero-copy view of the mapped file)"""
+        rows = self.batch.column(name).values
+        return pa.Table.from_arrays(rows.flatten(), names=[field.name for field in rows.type])
+
+    def frame(self, name):
+        """pandas frame of `name`, as the source file's reader returns it"""
+        if name not in self._frames:
+            if name not in self.names():
+                raise FileNotFoundError(f"{TABLES[name][0]} is not in the dashboard snapshot.")
+            self._frames[name] = self.table(name).to_pandas(split_blocks=True)
+        return self._frames[name]
+
+
+def legacy_home_load(data_dir='data'):
+    """What Home.py read on a cold start: the CSVs and the topic metrics JSON, each parsed separately"""
+    monthly = pd.read_csv(os.path.join(data_dir, 'monthly_summary.csv'))
+    monthly['date'] = pd.to_datetime(monthly['date'])
+    months = sorted(monthly['date'].dt.strftime('%Y-%m').unique())
+    frames = {name: TABLES[name][1](os.path.join(data_dir, TABLES[name][0]))
+              for name in ['hourly_metrics', 'daily_metrics', 'peak_hours']}
+    with open(os.path.join(data_dir, TOPIC_METRICS)) as f:
+        topic_metrics = json.load(f)
+    return months, frames, topic_metrics
+
+
+def snapshot_home_load(path):
+    """The same data from the snapshot"""
+    snapshot = Snapshot(path)
+    months = sorted(snapshot.frame('monthly_summary')['date'].dt.strftime('%Y-%m').unique())
+    frames = {name: snapshot.frame(name) for name in ['hourly_metrics', 'daily_metrics', 'peak_hours']}
+    return months, frames, snapshot.topic_metrics
+
+
+def benchmark_startup(data_dir='data', path=None, repeat=5):
+    """
+    Time the data loading of a Home and an Overview cold start: the source files against the snapshot.
+
+    The plotly import is reported separately: Overview needs it, Home no longer
+    pays for it.
+    """
+    path = path or os.path.join(data_dir, SNAPSHOT_FILE)
+    if snapshot_version(path) != source_version(data_dir):
+        write_snapshot(data_dir, path)
+    overview = ['monthly_scores_summary', 'topic_clusters', 'top10_topics']
+
+    def best(load):
+        seconds = []
+        for _ in range(repeat):
+            t0 = time.time()
+            load()
+            seconds.append(time.time() - t0)
+        return min(seconds)
+
+    results = []
+    if os.path.exists(os.path.join(data_dir, TOPIC_METRICS)):
+        results.append(('Home', best(lambda: legacy_home_load(data_dir)), best(lambda: snapshot_home_load(path))))
+    available = [name for name in overview if os.path.exists(os.path.join(data_dir, TABLES[name][0]))]
+    results.append(('Overview', best(lambda: [TABLES[name][1](os.path.join(data_dir, TABLES[name][0]))
+                                              for name in available]),
+                    best(lambda: [Snapshot(path).frame(name) for name in available])))
+    for page, source_seconds, snapshot_seconds in results:
+        print(f"{page} data load: source files {source_seconds * 1000:.1f} ms, "
+              f"snapshot {snapshot_seconds * 1000:.1f} ms")
+
+    t0 = time.time()
+    try:
+        import plotly.graph_objects  # noqa: F401
+        import plotly.express  # noqa: F401
+        print(f"import plotly: {(time.time() - t0) * 1000:.1f} ms (Overview only)")
+    except ImportError:
+        pass
+    return results
+
+
+if __name__ == "__main__":
+    # Rebuild the snapshot after the preprocessing scripts and notebooks have written their outputs
+    write_snapshot('data')
+    benchmark_startup('data')
@@ -1,183 +1,170 @@
 import pandas as pd
+import numpy as np
 import json
-from pathlib import Path
+import os
+import time
 import ast
-from datetime import datetime
-
-def get_month_metrics(temporal_dict, toxicity_dict, target_date, previous_date):
-    """Get metrics for specific month from temporal and toxicity evolution data"""
-    try:
-        if isinstance(temporal_dict, str):
-            temporal_dict = ast.literal_eval(temporal_dict)
-        if isinstance(toxicity_dict, str):
-            toxicity_dict = ast.literal_eval(toxicity_dict)
-            
-        target_year = str(target_date.year)
-        target_month = target_date.strftime('%Y-%m')
-        prev_month = previous_date.strftime('%Y-%m')
-        
-        # Get posts from temporal_evolution for both months
-        current_year_posts = temporal_dict.get(target_year, 0)
-        prev_year_posts = temporal_dict.get(str(previous_date.year), 0)
-        
-        # Get toxicity and post metrics from toxicity_evolution
-        current_metrics = toxicity_dict.get(target_year, {}).get(target_month, {})
-        prev_metrics = toxicity_dict.get(str(previous_date.year), {}).get(prev_month, {})
-        
-        # Extract values with defaults
-        current_stats = {
-            'post_count': float(current_metrics.get('post_count', current_year_posts/12)),
-            'avg_toxicity': float(current_metrics.get('avg_toxicity', 0))
-        }
-        
-        prev_stats = {
-            'post_count': float(prev_metrics.get('post_count', prev_year_posts/12)),
-            'avg_toxicity': float(prev_metrics.get('avg_toxicity', 0))
-        }
-        
-        # Calculate changes
-        post_change = ((current_stats['post_count'] - prev_stats['post_count']) / 
-                      prev_stats['post_count'] * 100) if prev_stats['post_count'] else 0
-        toxicity_change = ((current_stats['avg_toxicity'] - prev_stats['avg_toxicity']) / 
-                          prev_stats['avg_toxicity'] * 100) if prev_stats['avg_toxicity'] else 0
-            
-        return (current_stats['post_count'], prev_stats['post_count'], post_change,
-                current_stats['avg_toxicity'], prev_stats['avg_toxicity'], toxicity_change)
-        
-    except Exception as e:
-        print(f"Error processing data for {target_month}: {e}")
-        return 0, 0, 0, 0, 0, 0
 
+from cluster_store import ClusterStore
+from dashboard_snapshot import write_snapshot
 
+# Per-cluster metric matrices of `metric_matrices`
+METRICS = ['current_posts', 'previous_posts', 'post_change', 'current_toxicity', 'previous_toxicity',
+           'toxicity_change', 'engagement_score', 'yearly_posts']
 
-def calculate_topic_metrics(topics_df, target_date='2023-01-01'):
-    """Calculate topic metrics with improved handling of small numbers"""
-    target_date = pd.Timestamp(target_date)
-    previous_date = target_date - pd.DateOffset(months=1)
-    
-    print(f"\nCalculating metrics for {target_date.strftime('%B %Y')} vs {previous_date.strftime('%B %Y')}")
-    
-    topic_metrics = []
-    for idx, row in topics_df.iterrows():
-        toxicity_dict = ast.literal_eval(row['toxicity_evolution']) if isinstance(row['toxicity_evolution'], str) else row['toxicity_evolution']
-        temporal_dict = ast.literal_eval(row['temporal_evolution']) if isinstance(row['temporal_evolution'], str) else row['temporal_evolution']
-        
-        # Get yearly totals for context
-        current_year_total = float(temporal_dict.get(str(target_date.year), 0))
-        prev_year_total = float(temporal_dict.get(str(previous_date.year), 0))
-        
-        # Get monthly metrics
-        current_month = target_date.strftime('%Y-%m')
-        current_year = str(target_date.year)
-        current_metrics = toxicity_dict.get(current_year, {}).get(current_month, {})
-        
-        prev_month = previous_date.strftime('%Y-%m')
-        prev_year = str(previous_date.year)
-        prev_metrics = toxicity_dict.get(prev_year, {}).get(prev_month, {})
-        
-        # Use yearly average when monthly data is too small
-        current_posts = max(float(current_metrics.get('post_count', 0)), current_year_total/12)
-        prev_posts = max(float(prev_metrics.get('post_count', 0)), prev_year_total/12)
-        
-        current_toxicity = float(current_metrics.get('avg_toxicity', row['avg_toxicity']))
-        prev_toxicity = float(prev_metrics.get('avg_toxicity', row['avg_toxicity']))
-        
-        # Calculate changes with minimum threshold
-        if prev_posts >= 1:  # Only calculate change if there were at least some posts
-            post_change = ((current_posts - prev_posts) / prev_posts * 100)
-        else:
-            post_change = 0
-            
-        if prev_toxicity > 0:
-            toxicity_change = ((current_toxicity - prev_toxicity) / prev_toxicity * 100)
-        else:
-            toxicity_change = 0
-        
-        # Calculate engagement using overall metrics
-        total_posts = float(row['total_posts'])
-        size = float(row['size'])
-        topic_diversity = float(row['topic_diversity'])
-        engagement_score = (size * topic_diversity * current_posts) if current_posts > 0 else 0
-        
-        keywords = ast.literal_eval(row['unique_keywords']) if isinstance(row['unique_keywords'], str) else row['unique_keywords']
-        
-        topic_metrics.append({
-            'cluster_id': row['cluster_id'],
-            'keywords': keywords,
-            'current_posts': current_posts,
-            'previous_posts': prev_posts,
-            'post_change': post_change,
-            'current_toxicity': current_toxicity,
-            'previous_toxicity': prev_toxicity,
-            'toxicity_change': toxicity_change,
-            'engagement_score': engagement_score,
-            'total_posts': total_posts,
-            'yearly_posts': current_year_total
-        })
-        
-    metrics_df = pd.DataFrame(topic_metrics)
-    
-    dashboard_metrics = {
-        'most_active': {
-            'topic': metrics_df[metrics_df['current_posts'] >= 1].nlargest(1, 'current_posts').iloc[0]['keywords'][:3],
-            'posts': float(metrics_df[metrics_df['current_posts'] >= 1].nlargest(1, 'current_posts').iloc[0]['current_posts']),
-            'previous_posts': float(metrics_df[metrics_df['current_posts'] >= 1].nlargest(1, 'current_posts').iloc[0]['previous_posts']),
-            'change': float(metrics_df[metrics_df['current_posts'] >= 1].nlargest(1, 'current_posts').iloc[0]['post_change'])
-        },
-        'highest_toxicity': {
-            'topic': metrics_df[metrics_df['current_toxicity'] > 0].nlargest(1, 'current_toxicity').iloc[0]['keywords'][:3],
-            'score': float(metrics_df[metrics_df['current_toxicity'] > 0].nlargest(1, 'current_toxicity').iloc[0]['current_toxicity']),
-            'previous_score': float(metrics_df[metrics_df['current_toxicity'] > 0].nlargest(1, 'current_toxicity').iloc[0]['previous_toxicity']),
-            'change': float(metrics_df[metrics_df['current_toxicity'] > 0].nlargest(1, 'current_toxicity').iloc[0]['toxicity_change'])
-        },
-        'trending': {
-            'topic': metrics_df[
-                (metrics_df['previous_posts'] >= 1) & 
-                (metrics_df['current_posts'] >= 1)
-            ].nlargest(1, 'post_change').iloc[0]['keywords'][:3],
-            'posts': float(metrics_df[metrics_df['previous_posts'] >= 1].nlargest(1, 'post_change').iloc[0]['current_posts']),
-            'previous_posts': float(metrics_df[metrics_df['previous_posts'] >= 1].nlargest(1, 'post_change').iloc[0]['previous_posts']),
-            'change': float(metrics_df[metrics_df['previous_posts'] >= 1].nlargest(1, 'post_change').iloc[0]['post_change'])
-        },
-        'most_engaged': {
-            'topic': metrics_df[metrics_df['engagement_score'] > 0].nlargest(1, 'yearly_posts').iloc[0]['keywords'][:3],
-            'posts': float(metrics_df[metrics_df['engagement_score'] > 0].nlargest(1, 'yearly_posts').iloc[0]['current_posts']),
-            'previous_posts': float(metrics_df[metrics_df['engagement_score'] > 0].nlargest(1, 'yearly_posts').iloc[0]['previous_posts']),
-            'change': float(metrics_df[metrics_df['engagement_score'] > 0].nlargest(1, 'yearly_posts').iloc[0]['post_change'])
-        }
+
+def month_axis(yearmonths):
+    """Every calendar month from the month before the first of `yearmonths` to the last one"""
+    periods = pd.period_range(pd.Period(min(yearmonths), freq='M') - 1, pd.Period(max(yearmonths), freq='M'), freq='M')
+    return [str(period) for period in periods]
+
+
+def metric_matrices(store):
+    """
+    Topic metrics of every cluster and month as clusters x months arrays.
+
+    Same definitions as the previous per-row loop: the posts of a month are its
+    toxicity_evolution post count, or the yearly average of temporal_evolution when
+    that is larger; a month without toxicity data falls back to the cluster's
+    average toxicity; changes are relative to the calendar month before.
+
+    Returns the months (columns) and a dict of the METRICS arrays; rows follow `store.clusters`.
+    """
+    months = month_axis(store.yearmonths())
+    clusters = store.clusters.index
+
+    def matrix(column):
+        return store.pivot(column).reindex(index=clusters, columns=months).to_numpy(dtype='float64', na_value=np.nan)
+
+    post_counts = np.nan_to_num(matrix('post_count'))
+    toxicity_counts = np.nan_to_num(matrix('toxicity_count'))
+    toxicity = matrix('avg_toxicity')
+
+    # Posts of every cluster in the year of each month (the yearly totals for context)
+    year_codes = np.unique([month[:4] for month in months], return_inverse=True)[1]
+    month_years = np.eye(year_codes.max() + 1)[year_codes]
+    yearly_posts = (post_counts @ month_years)[:, year_codes]
+
+    # Use yearly average when monthly data is too small
+    posts = np.maximum(toxicity_counts, yearly_posts / 12)
+    toxicity = np.where(np.isnan(toxicity), store.clusters['avg_toxicity'].to_numpy(dtype='float64')[:, None], toxicity)
+
+    current_posts, previous_posts = posts[:, 1:], posts[:, :-1]
+    current_toxicity, previous_toxicity = toxicity[:, 1:], toxicity[:, :-1]
+    # Only calculate change if there were at least some posts
+    has_previous_posts = previous_posts >= 1
+    post_change = np.where(has_previous_posts,
+                           (current_posts - previous_posts) / np.where(has_previous_posts, previous_posts, 1) * 100, 0)
+    has_previous_toxicity = previous_toxicity > 0
+    toxicity_change = np.where(has_previous_toxicity,
+                               (current_toxicity - previous_toxicity)
+                               / np.where(has_previous_toxicity, previous_toxicity, 1) * 100, 0)
+    # Calculate engagement using overall metrics
+    size = store.clusters['size'].to_numpy(dtype='float64')[:, None]
+    topic_diversity = store.clusters['topic_diversity'].to_numpy(dtype='float64')[:, None]
+    engagement_score = np.where(current_posts > 0, size * topic_diversity * current_posts, 0)
+
+    return months[1:], {
+        'current_posts': current_posts,
+        'previous_posts': previous_posts,
+        'post_change': post_change,
+        'current_toxicity': current_toxicity,
+        'previous_toxicity': previous_toxicity,
+        'toxicity_change': toxicity_change,
+        'engagement_score': engagement_score,
+        'yearly_posts': yearly_posts[:, 1:]
     }
 
-    # Add high risk topics
-    high_risk = metrics_df[metrics_df['current_toxicity'] > 0].nlargest(3, 'current_toxicity')
-    dashboard_metrics['high_risk_topics'] = [
-        {
-            'keywords': row['keywords'][:3],
-            'current_toxicity': float(row['current_toxicity']),
-            'previous_toxicity': float(row['previous_toxicity']),
-            'current_posts': float(row['current_posts']),
-            'toxicity_change': float(row['toxicity_change'])
-        }
-        for _, row in high_risk.iterrows()
-    ]
-
-    # Add active discussions
-    active_discussions = metrics_df[metrics_df['current_posts'] >= 1].nlargest(3, 'current_posts')
-    dashboard_metrics['active_discussions'] = [
-        {
-            'keywords': row['keywords'][:3],
-            'current_posts': float(row['current_posts']),
-            'previous_posts': float(row['previous_posts']),
-            'post_change': float(row['post_change']),
-            'current_toxicity': float(row['current_toxicity'])
+
+def top_rows(values, mask, k=1):
+    """
+    Rows of the `k` largest values in every column among the masked rows (ties keep
+    the first row, like `nlargest`), and whether each of them is a masked row.
+    """
+    order = np.argsort(-np.where(mask, values, -np.inf), axis=0, kind='stable')[:k]
+    return order, np.take_along_axis(mask, order, axis=0)
+
+
+def calculate_all_topic_metrics(store):
+    """
+    The dashboard topic metrics of every month, keyed by 'YYYY-MM'.
+
+    Every headline category and list is selected for all months at once from the
+    metric matrices; a category without any qualifying topic in a month is None
+    (or an empty list).
+    """
+    months, m = metric_matrices(store)
+    keywords = [list(words[:3]) for words in store.cluster_keywords()]
+
+    # (category, ranked value, qualifying rows, number of rows)
+    selections = {
+        'most_active': (m['current_posts'], m['current_posts'] >= 1, 1),
+        'highest_toxicity': (m['current_toxicity'], m['current_toxicity'] > 0, 1),
+        'trending': (m['post_change'], (m['previous_posts'] >= 1) & (m['current_posts'] >= 1), 1),
+        'most_engaged': (m['yearly_posts'], m['engagement_score'] > 0, 1),
+        'high_risk_topics': (m['current_toxicity'], m['current_toxicity'] > 0, 3),
+        'active_discussions': (m['current_posts'], m['current_posts'] >= 1, 3),
+    }
+    selected = {name: top_rows(values, mask, k) for name, (values, mask, k) in selections.items()}
+
+    def value(metric, row, column):
+        return float(m[metric][row, column])
+
+    all_metrics = {}
+    for column, month in enumerate(months):
+        rows = {}
+        for name, (order, valid) in selected.items():
+            rows[name] = [row for row, ok in zip(order[:, column], valid[:, column]) if ok]
+
+        def headline(name, fields):
+            if not rows[name]:
+                return None
+            row = rows[name][0]
+            return {'topic': keywords[row], **{key: value(metric, row, column) for key, metric in fields.items()}}
+
+        all_metrics[month] = {
+            'most_active': headline('most_active', {'posts': 'current_posts', 'previous_posts': 'previous_posts',
+                                                    'change': 'post_change'}),
+            'highest_toxicity': headline('highest_toxicity', {'score': 'current_toxicity',
+                                                              'previous_score': 'previous_toxicity',
+                                                              'change': 'toxicity_change'}),
+            'trending': headline('trending', {'posts': 'current_posts', 'previous_posts': 'previous_posts',
+                                              'change': 'post_change'}),
+            'most_engaged': headline('most_engaged', {'posts': 'current_posts', 'previous_posts': 'previous_posts',
+                                                      'change': 'post_change'}),
+            'high_risk_topics': [
+                {
+                    'keywords': keywords[row],
+                    'current_toxicity': value('current_toxicity', row, column),
+                    'previous_toxicity': value('previous_toxicity', row, column),
+                    'current_posts': value('current_posts', row, column),
+                    'toxicity_change': value('toxicity_change', row, column)
+                }
+                for row in rows['high_risk_topics']
+            ],
+            'active_discussions': [
+                {
+                    'keywords': keywords[row],
+                    'current_posts': value('current_posts', row, column),
+                    'previous_posts': value('previous_posts', row, column),
+                    'post_change': value('post_change', row, column),
+                    'current_toxicity': value('current_toxicity', row, column)
+                }
+                for row in rows['active_discussions']
+            ]
         }
-        for _, row in active_discussions.iterrows()
-    ]
+    return all_metrics
+
 
-    # Print debug information
+def print_topic_metrics(dashboard_metrics):
+    """Print the metrics of one month"""
     print("\nFinal Metrics:")
     for category in ['MOST_ACTIVE', 'HIGHEST_TOXICITY', 'TRENDING', 'MOST_ENGAGED']:
         print(f"\n{category}:")
         data = dashboard_metrics[category.lower()]
+        if data is None:
+            print("No topic qualifies")
+            continue
         print(f"Topic: {', '.join(data['topic'][:2])}")
         if 'score' in data:
             print(f"Current Score: {data['score']:.3f}")
@@ -202,16 +189,101 @@ def calculate_topic_metrics(topics_df, target_date='2023-01-01'):
         print(f"Previous Posts: {topic['previous_posts']:.1f}")
         print(f"Change: {topic['post_change']:+.1f}%")
         print("---")
-    
-    # Save processed metrics
-    with open('data/dashboard_topic_metrics.json', 'w') as f:
-        json.dump(dashboard_metrics, f)
+
+
+def write_topic_metrics(store, output_path='data/dashboard_topic_metrics.json'):
+    """Compute the topic metrics of every month and save them as one JSON object keyed by month"""
+    t0 = time.time()
+    all_metrics = calculate_all_topic_metrics(store)
+    with open(f"{output_path}.tmp", 'w') as f:
+        json.dump(all_metrics, f)
+    os.replace(f"{output_path}.tmp", output_path)
+    print(f"Topic metrics of {len(all_metrics)} months ({min(all_metrics)} to {max(all_metrics)}) "
+          f"written to {output_path} in {time.time() - t0:.2f}s")
+    return all_metrics
+
+
+def calculate_topic_metrics(topics_df, target_date='2023-01-01'):
+    """Calculate the topic metrics of one month (a topic_clusters frame; see `calculate_all_topic_metrics`)"""
+    target_date = pd.Timestamp(target_date)
+    print(f"\nCalculating metrics for {target_date.strftime('%B %Y')} vs "
+          f"{(target_date - pd.DateOffset(months=1)).strftime('%B %Y')}")
+    dashboard_metrics = calculate_all_topic_metrics(ClusterStore.from_frame(topics_df))[target_date.strftime('%Y-%m')]
+    print_topic_metrics(dashboard_metrics)
+    return dashboard_metrics
+
+
+def legacy_topic_metrics(topics_df, target_date='2023-01-01'):
+    """
+    The previous per-row metrics of one month (kept for benchmarking). The yearly totals
+    are summed over the months of temporal_evolution (`float()` of the year's dict raised).
+    """
+    target_date = pd.Timestamp(target_date)
+    previous_date = target_date - pd.DateOffset(months=1)
+    topic_metrics = []
+    for idx, row in topics_df.iterrows():
+        toxicity_dict = ast.literal_eval(row['toxicity_evolution']) if isinstance(row['toxicity_evolution'], str) else row['toxicity_evolution']
+        temporal_dict = ast.literal_eval(row['temporal_evolution']) if isinstance(row['temporal_evolution'], str) else row['temporal_evolution']
+
+        current_year_total = float(sum(month['post_count'] for month in temporal_dict.get(str(target_date.year), {}).values()))
+        prev_year_total = float(sum(month['post_count'] for month in temporal_dict.get(str(previous_date.year), {}).values()))
+
+        current_metrics = toxicity_dict.get(str(target_date.year), {}).get(target_date.strftime('%Y-%m'), {})
+        prev_metrics = toxicity_dict.get(str(previous_date.year), {}).get(previous_date.strftime('%Y-%m'), {})
+
+        current_posts = max(float(current_metrics.get('post_count', 0)), current_year_total/12)
+        prev_posts = max(float(prev_metrics.get('post_count', 0)), prev_year_total/12)
+        current_toxicity = float(current_metrics.get('avg_toxicity', row['avg_toxicity']))
+        prev_toxicity = float(prev_metrics.get('avg_toxicity', row['avg_toxicity']))
+        post_change = ((current_posts - prev_posts) / prev_posts * 100) if prev_posts >= 1 else 0
+        toxicity_change = ((current_toxicity - prev_toxicity) / prev_toxicity * 100) if prev_toxicity > 0 else 0
+        engagement_score = (float(row['size']) * float(row['topic_diversity']) * current_posts) if current_posts > 0 else 0
+
+        topic_metrics.append({
+            'cluster_id': row['cluster_id'],
+            'current_posts': current_posts,
+            'previous_posts': prev_posts,
+            'post_change': post_change,
+            'current_toxicity': current_toxicity,
+            'previous_toxicity': prev_toxicity,
+            'toxicity_change': toxicity_change,
+            'engagement_score': engagement_score,
+            'yearly_posts': current_year_total
+        })
+    return pd.DataFrame(topic_metrics)
+
+
+def benchmark_topic_metrics(topics_df):
+    """Time the per-row metrics of every month against one batch over the metric matrices"""
+    store = ClusterStore.from_frame(topics_df)
+    t0 = time.time()
+    months, matrices = metric_matrices(store)
+    calculate_all_topic_metrics(store)
+    batch_seconds = time.time() - t0
+
+    t0 = time.time()
+    max_difference = 0.0
+    for column, month in enumerate(months):
+        legacy = legacy_topic_metrics(topics_df, f"{month}-01")
+        for metric in METRICS:
+            max_difference = max(max_difference, float(np.abs(legacy[metric].to_numpy() - matrices[metric][:, column]).max()))
+    legacy_seconds = time.time() - t0
+    print(f"Topic metrics of {len(topics_df)} clusters x {len(months)} months: per-row loop {legacy_seconds:.2f}s, "
+          f"batch {batch_seconds:.2f}s (max difference {max_difference:.2e})")
+    return legacy_seconds, batch_seconds
 
 
 if __name__ == "__main__":
-    # Read your topic modeling results
-    topics_df = pd.read_csv('data/topic_clusters.csv')
-    
-    # Process and save metrics for January 2023
-    calculate_topic_metrics(topics_df, target_date='2023-01-01')
-    print("Preprocessing completed successfully!")
\ No newline at end of file
+    # Read the topic modeling results (the cluster store, or topic_clusters.csv if it was not converted)
+    if os.path.exists('data/cluster_store'):
+        store = ClusterStore('data/cluster_store')
+    else:
+        store = ClusterStore.from_frame(pd.read_csv('data/topic_clusters.csv'))
+
+    # Process and save metrics for every month
+    all_metrics = write_topic_metrics(store)
+    if '2023-01' in all_metrics:
+        print_topic_metrics(all_metrics['2023-01'])
+    # Repack the dashboard snapshot with the new topic metrics
+    write_snapshot('data')
+    print("Preprocessing completed successfully!")
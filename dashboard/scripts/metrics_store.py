@@ -0,0 +1,351 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Score column of every model in combined_data_scores, keyed by the model name used in the store
+MODELS = {
+    'average': 'average_toxicity_score',
+    'hatebert': 'hatebert_toxicity_score',
+    'hateXplain': 'hateXplain_toxicity_score',
+    'toxicbert': 'toxicbert_toxicity_score'
+}
+
+KEYS = ['yearmonth', 'hour', 'weekday', 'model']
+
+STORE_COLUMNS = KEYS + ['count', 'mean', 'm2', 'first_timestamp', 'last_timestamp']
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def time_codes(timestamps):
+    """
+    Integer month, hour and weekday codes of a timestamp column, derived once.
+
+    Months are counted from 1970-01 and weekdays run from 0 (Monday) to 6 (Sunday),
+    as in `Series.dt.dayofweek`. Also returns the timestamps as int64 nanoseconds.
+    """
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_localize(None)
+    nanoseconds = timestamps.values.astype('datetime64[ns]').view('int64')
+    days = nanoseconds // 86_400_000_000_000
+    hours = (nanoseconds // 3_600_000_000_000) % 24
+    # 1970-01-01 was a Thursday
+    weekdays = (days + 3) % 7
+    # Calendar months are looked up per distinct day rather than converted per row
+    first_day = days.min()
+    day_months = (np.arange(first_day, days.max() + 1).astype('datetime64[D]')
+                  .astype('datetime64[M]').astype('int64'))
+    months = day_months[days - first_day]
+    return months, hours, weekdays, nanoseconds
+
+
+def cell_stats(df):
+    """
+    Sufficient statistics of a frame of scored comments per (yearmonth, hour, weekday, model).
+
+    Every cell holds the comment count, the mean score and M2 (the sum of squared
+    deviations from the mean, Welford's state), plus the first and last timestamp.
+    Rows are mapped once to an integer cell code and every statistic is a single
+    `np.bincount` over that code, instead of a groupby on per-row strings.
+
+    Missing or non-finite scores are left out of their model's count, mean and
+    M2 (see `invalid_scores`), so they do not poison the whole cell; an empty
+    frame gives an empty store.
+    """
+    if not len(df):
+        return pd.DataFrame(columns=STORE_COLUMNS)
+    months, hours, weekdays, nanoseconds = time_codes(df['timestamp'])
+    first_month = months.min()
+    codes = ((months - first_month) * 24 + hours) * 7 + weekdays
+    n_cells = (months.max() - first_month + 1) * 24 * 7
+
+    counts = np.bincount(codes, minlength=n_cells)
+    cells = np.flatnonzero(counts)
+    first = np.full(n_cells, np.iinfo('int64').max)
+    last = np.full(n_cells, np.iinfo('int64').min)
+    np.minimum.at(first, codes, nanoseconds)
+    np.maximum.at(last, codes, nanoseconds)
+
+    month_of_cell = first_month + cells // (24 * 7)
+    keys = pd.DataFrame({
+        'yearmonth': [f"{1970 + month // 12}-{month % 12 + 1:02d}" for month in month_of_cell],
+        'hour': cells // 7 % 24,
+        'weekday': cells % 7
+    })
+
+    parts = []
+    for model, column in MODELS.items():
+        scores = df[column].to_numpy(dtype='float64')
+        valid = np.isfinite(scores)
+        model_codes, scores = codes[valid], scores[valid]
+        model_counts = np.bincount(model_codes, minlength=n_cells)
+        mean = np.bincount(model_codes, weights=scores, minlength=n_cells) / np.maximum(model_counts, 1)
+        deviations = scores - mean[model_codes]
+        m2 = np.bincount(model_codes, weights=deviations * deviations, minlength=n_cells)
+        # Cells whose scores of this model are all missing have no statistics for it
+        has_scores = model_counts[cells] > 0
+        parts.append(keys[has_scores].assign(
+            model=model,
+            count=model_counts[cells][has_scores],
+            mean=mean[cells][has_scores],
+            m2=m2[cells][has_scores],
+            first_timestamp=pd.to_datetime(first[cells][has_scores]),
+            last_timestamp=pd.to_datetime(last[cells][has_scores])))
+    return pd.concat(parts, ignore_index=True)[STORE_COLUMNS]
+
+
+def invalid_scores(df):
+    """Number of missing or non-finite scores per score column (left out by `cell_stats`)"""
+    return {column: int((~np.isfinite(df[column].to_numpy(dtype='float64'))).sum()) for column in MODELS.values()}
+
+
+def _report_invalid(invalid):
+    if any(invalid.values()):
+        print("Left out missing or non-finite scores: "
+              + ', '.join(f"{column} {count}" for column, count in invalid.items() if count))
+
+
+def merge_stats(stats, keys):
+    """
+    Merge cells into one per `keys` with the parallel variance formula (Chan et al.).
+
+    For cells i with counts n_i, means m_i and M2_i, the merged cell has
+    n = sum(n_i), mean = sum(n_i * m_i) / n and M2 = sum(M2_i + n_i * (m_i - mean)^2),
+    so merging gives the same count, mean and variance as a full recomputation.
+    """
+    stats = stats.assign(weighted=stats['count'] * stats['mean'])
+    grouped = stats.groupby(keys, sort=True)
+    count = grouped['count'].transform('sum')
+    mean = grouped['weighted'].transform('sum') / count
+    stats = stats.assign(m2=stats['m2'] + stats['count'] * (stats['mean'] - mean) ** 2)
+
+    merged = stats.groupby(keys, sort=True).agg(
+        count=('count', 'sum'),
+        weighted=('weighted', 'sum'),
+        m2=('m2', 'sum'),
+        first_timestamp=('first_timestamp', 'min'),
+        last_timestamp=('last_timestamp', 'max'))
+    merged['mean'] = merged['weighted'] / merged['count']
+    merged['std'] = np.sqrt(merged['m2'] / (merged['count'] - 1))
+    return merged.drop(columns='weighted').reset_index()
+
+
+def load_store(store_path):
+    """Load the aggregation store (empty if it does not exist yet)"""
+    if not os.path.exists(store_path):
+        return pd.DataFrame(columns=STORE_COLUMNS)
+    return pd.read_csv(store_path, dtype={'yearmonth': str},
+                       parse_dates=['first_timestamp', 'last_timestamp'])
+
+
+def save_store(stats, store_path):
+    """Write the aggregation store to a temporary file and rename it into place"""
+    tmp_path = f"{store_path}.tmp"
+    stats.sort_values(KEYS).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, store_path)
+
+
+def input_months(input_file, chunk_size=500000):
+    """Months present in the scored comments"""
+    if os.path.isdir(input_file):
+        prefix = 'yearmonth='
+        return sorted(name[len(prefix):] for name in os.listdir(input_file) if name.startswith(prefix))
+    months = set()
+    with pd.read_csv(input_file, usecols=['yearmonth'], dtype=str, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            months.update(chunk['yearmonth'].unique())
+    return sorted(months)
+
+
+def scan_months(input_file, months, chunk_size=500000):
+    """
+    Compute the cell statistics of the comments of the given months.
+
+    From the Parquet dataset (data/combined_data_scores/) only the partitions of
+    these months and only the timestamp and score columns are read. From the CSV,
+    the file is streamed in chunks and rows of other months are skipped; the
+    statistics of every chunk are merged into the running cells.
+    """
+    columns = ['timestamp'] + list(MODELS.values())
+    months = list(months)
+    if not months:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+    if os.path.isdir(input_file):
+        df = pd.read_parquet(input_file, columns=columns, filters=[('yearmonth', 'in', months)])
+        _report_invalid(invalid_scores(df))
+        return cell_stats(df)
+
+    stats = []
+    invalid = dict.fromkeys(MODELS.values(), 0)
+    with pd.read_csv(input_file, usecols=columns + ['yearmonth'], dtype={'yearmonth': str},
+                     chunksize=chunk_size) as reader:
+        for chunk in reader:
+            chunk = chunk[chunk['yearmonth'].isin(months)]
+            if len(chunk):
+                chunk = chunk.assign(timestamp=pd.to_datetime(chunk['timestamp']))
+                for column, count in invalid_scores(chunk).items():
+                    invalid[column] += count
+                stats.append(cell_stats(chunk[columns]))
+    _report_invalid(invalid)
+    if not stats:
+        return pd.DataFrame(columns=STORE_COLUMNS)
+    return merge_stats(pd.concat(stats), KEYS)[STORE_COLUMNS]
+
+
+def update_store(input_file, store_path='data/metrics_store.csv', months=None):
+    """
+    Add the statistics of new months to the aggregation store.
+
+    Parameters:
+    - input_file: Parquet dataset data/combined_data_scores/ or combined_data_scores.csv.
+    - store_path: The aggregation store (CSV of per-cell count, mean and M2).
+    - months: Months to (re)ingest, e.g. ['2024-01']; their existing cells are
+      replaced. By default, every month of the input that is not in the store yet,
+      plus the latest stored month (it may have been ingested from a partial dump).
+    """
+    store = load_store(store_path)
+    if months is None:
+        known = set(store['yearmonth'])
+        latest = max(known) if known else None
+        months = [month for month in input_months(input_file) if month not in known or month == latest]
+    if not months:
+        print("Aggregation store is up to date.")
+        return store
+
+    print(f"Ingesting {len(months)} month(s): {', '.join(months)}")
+    new_stats = scan_months(input_file, months)
+    store = store[~store['yearmonth'].isin(months)]
+    store = pd.concat([store, new_stats]) if len(store) else new_stats
+    save_store(store, store_path)
+    return store
+
+
+def _relative_metrics(metrics):
+    """Share of posts and toxicity relative to the mean, as in the original time metrics"""
+    metrics['post_percent'] = (metrics['post_count'] /
+                               metrics['post_count'].sum() * 100)
+    metrics['toxicity_vs_mean'] = ((metrics['avg_toxicity'] -
+                                    metrics['avg_toxicity'].mean()) /
+                                   metrics['avg_toxicity'].mean() * 100)
+    return metrics
+
+
+def _per_model(merged, key, value='mean'):
+    """Pivot merged cells to one row per `key` with one column per model"""
+    return merged.pivot(index=key, columns='model', values=value)
+
+
+def hourly_metrics(store):
+    """hourly_metrics.csv: post count and mean scores per hour of day"""
+    merged = merge_stats(store, ['hour', 'model'])
+    means = _per_model(merged, 'hour')
+    metrics = pd.DataFrame({
+        'hour': means.index,
+        'post_count': _per_model(merged, 'hour', 'count')['average'].values,
+        'avg_toxicity': means['average'].values,
+        'hatebert_score': means['hatebert'].values,
+        'hatexplain_score': means['hateXplain'].values,
+        'toxicbert_score': means['toxicbert'].values
+    })
+    return _relative_metrics(metrics)
+
+
+def daily_metrics(store):
+    """daily_metrics.csv: post count and mean scores per day of week (ordered by day name)"""
+    merged = merge_stats(store, ['weekday', 'model'])
+    merged['day'] = [DAY_NAMES[day] for day in merged['weekday']]
+    means = _per_model(merged, 'day')
+    metrics = pd.DataFrame({
+        'day': means.index,
+        'post_count': _per_model(merged, 'day', 'count')['average'].values,
+        'avg_toxicity': means['average'].values,
+        'hatebert_score': means['hatebert'].values,
+        'hatexplain_score': means['hateXplain'].values,
+        'toxicbert_score': means['toxicbert'].values
+    })
+    return _relative_metrics(metrics)
+
+
+def monthly_metrics(store):
+    """monthly_metrics.csv: post count and mean/std of every score per month"""
+    merged = merge_stats(store, ['yearmonth', 'model'])
+    means = _per_model(merged, 'yearmonth')
+    stds = _per_model(merged, 'yearmonth', 'std')
+    metrics = pd.DataFrame({'post_count': _per_model(merged, 'yearmonth', 'count')['average'].values})
+    for model, prefix in [('average', 'avg_toxicity'), ('hatebert', 'hatebert'),
+                          ('hateXplain', 'hatexplain'), ('toxicbert', 'toxicbert')]:
+        metrics[f'{prefix}_mean'] = means[model].values
+        metrics[f'{prefix}_std'] = stds[model].values
+    metrics['year'] = [int(month[:4]) for month in means.index]
+    metrics['month'] = [int(month[5:]) for month in means.index]
+    return metrics
+
+
+def monthly_scores_summary(store):
+    """monthly_scores_summary.csv (trend_analysis.ipynb): mean/std of every score per month"""
+    merged = merge_stats(store, ['yearmonth', 'model'])
+    means = _per_model(merged, 'yearmonth')
+    stds = _per_model(merged, 'yearmonth', 'std')
+    summary = pd.DataFrame({'yearmonth': means.index})
+    for model in ['hatebert', 'hateXplain', 'toxicbert', 'average']:
+        column = MODELS[model]
+        summary[f'{column}_mean'] = means[model].values
+        summary[f'{column}_std'] = stds[model].values
+        if model == 'hatebert':
+            summary['post_count'] = _per_model(merged, 'yearmonth', 'count')[model].values
+    return summary
+
+
+def peak_hours(hourly):
+    """peak_hours.csv: busiest/most toxic and quietest/least toxic hours"""
+    return pd.DataFrame({
+        'metric': ['posts', 'toxicity'],
+        'peak_hour': [
+            hourly.loc[hourly['post_count'].idxmax(), 'hour'],
+            hourly.loc[hourly['avg_toxicity'].idxmax(), 'hour']
+        ],
+        'peak_value': [
+            hourly['post_count'].max(),
+            hourly['avg_toxicity'].max()
+        ],
+        'lowest_hour': [
+            hourly.loc[hourly['post_count'].idxmin(), 'hour'],
+            hourly.loc[hourly['avg_toxicity'].idxmin(), 'hour']
+        ],
+        'lowest_value': [
+            hourly['post_count'].min(),
+            hourly['avg_toxicity'].min()
+        ]
+    })
+
+
+def write_metrics(store, output_dir='data'):
+    """
+    Derive every time/trend metric file from the aggregation store.
+
+    `post_count` is the number of comments with a finite score (`average` for the
+    time metrics, `hatebert` for monthly_scores_summary.csv), not the number of
+    `text` rows the original notebooks counted; see `cell_stats`.
+
+    Returns the timing in milliseconds, the total number of posts and the date range.
+    """
+    t0 = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    hourly = hourly_metrics(store)
+    hourly.to_csv(f"{output_dir}/hourly_metrics.csv", index=False)
+    daily_metrics(store).to_csv(f"{output_dir}/daily_metrics.csv", index=False)
+    monthly_metrics(store).to_csv(f"{output_dir}/monthly_metrics.csv", index=False)
+    peak_hours(hourly).to_csv(f"{output_dir}/peak_hours.csv", index=False)
+    # trend_analysis.ipynb saved the summary ordered by average toxicity
+    (monthly_scores_summary(store)
+     .sort_values(by='average_toxicity_score_mean', ascending=False)
+     .to_csv(f"{output_dir}/monthly_scores_summary.csv", index=False))
+
+    posts = store[store['model'] == 'average']
+    return {
+        'milliseconds': round((time.time() - t0) * 1000, 1),
+        'total_posts': int(posts['count'].sum()),
+        'date_range': f"{posts['first_timestamp'].min()} to {posts['last_timestamp'].max()}"
+    }
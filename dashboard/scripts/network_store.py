@@ -0,0 +1,271 @@
+import os
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+# One row per cluster of the network (x, y: spring layout of the whole network)
+NODE_COLUMNS = ['cluster_id', 'keywords', 'posts', 'toxicity', 'domain', 'period', 'x', 'y']
+# One row per edge, source < target
+EDGE_COLUMNS = ['source', 'target', 'weight', 'semantic_sim', 'temporal_sim']
+# One row per (focus, cluster within 2 hops); via is the strongest intermediate of a level 2 cluster
+NEIGHBOURHOOD_COLUMNS = ['focus', 'cluster_id', 'level', 'via']
+# Tree of every focus as drawn on the Detailed Analysis page: one row per (focus, cluster, parent),
+# a cluster reached from several parents is drawn once and gets one row per parent
+LAYOUT_COLUMNS = ['focus', 'cluster_id', 'level', 'parent', 'x', 'y']
+
+FILES = {'nodes': 'nodes.parquet', 'edges': 'edges.parquet', 'neighbourhoods': 'neighbourhoods.parquet',
+         'layouts': 'layouts.parquet'}
+
+# Tree layout of create_tree_visualization in topic_network.ipynb
+SPACING = {
+    'x_main': 0.15,             # Main topic
+    'x_immediate': 0.45,        # First level
+    'x_secondary_left': 0.70,   # Secondary level left stagger
+    'x_secondary_right': 0.80,  # Secondary level right stagger
+    'y_spacing': 0.20,          # Vertical space between first level topics
+}
+
+
+def time_period(temporal):
+    """First and last month of a temporal_evolution dict"""
+    months = [month for year in temporal.values() for month in year]
+    return f"{min(months)} to {max(months)}" if months else "N/A"
+
+
+def node_table(G, seed=42):
+    """Node attributes of a network of `EnhancedTopicNetworkBuilder.create_network`, with spring layout coordinates"""
+    positions = nx.spring_layout(G, weight='weight', seed=seed) if len(G) else {}
+    return pd.DataFrame([(node, [str(word) for word in data['keywords']], data['posts'], data['toxicity'],
+                          data.get('domain'), time_period(data.get('temporal', {})), *positions[node])
+                         for node, data in G.nodes(data=True)], columns=NODE_COLUMNS)
+
+
+def edge_table(G):
+    """Edge weights of the network, one row per edge"""
+    rows = [(min(u, v), max(u, v), data['weight'], data.get('semantic_sim'), data.get('temporal_sim'))
+            for u, v, data in G.edges(data=True)]
+    return pd.DataFrame(rows, columns=EDGE_COLUMNS).sort_values(['source', 'target'], ignore_index=True)
+
+
+def neighbourhood_table(G):
+    """
+    Clusters within 2 hops of every cluster.
+
+    A level 2 cluster is reached through the common neighbour with the highest
+    mean weight of the two edges, as in analyze_topic_connections.
+    """
+    nodes = list(G.nodes)
+    weights = nx.to_scipy_sparse_array(G, nodelist=nodes, weight='weight', format='csr')
+    ids = np.array(nodes)
+    frames = []
+    for focus in range(len(nodes)):
+        first = weights.indices[weights.indptr[focus]:weights.indptr[focus + 1]]
+        first_weight = weights.data[weights.indptr[focus]:weights.indptr[focus + 1]]
+        second = weights[first].tocoo()
+        # Mean weight of focus -> intermediate -> cluster for every path of length 2
+        score = (first_weight[second.row] + second.data) / 2
+        keep = ~np.isin(second.col, first) & (second.col != focus)
+        via, cluster, score = first[second.row[keep]], second.col[keep], score[keep]
+        # Best intermediate of every level 2 cluster (first of the highest scores)
+        order = np.lexsort((-score, cluster))
+        best = order[np.r_[True, cluster[order][1:] != cluster[order][:-1]]] if len(order) else order
+        frames.append(pd.DataFrame({
+            'focus': ids[focus],
+            'cluster_id': np.concatenate([ids[first], ids[cluster[best]]]),
+            'level': np.repeat([1, 2], [len(first), len(best)]),
+            'via': pd.array([pd.NA] * len(first) + ids[via[best]].tolist(), dtype='Int64')
+        }))
+    if not frames:
+        return pd.DataFrame(columns=NEIGHBOURHOOD_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def tree_layout(G, focus_node, n_immediate=5, n_secondary=2):
+    """
+    Tree of `focus_node` with the positions of create_tree_visualization.
+
+    The `n_immediate` neighbours with the highest mean semantic and temporal
+    similarity (the order of analyze_topic_narrative) are the first level; each
+    of them shows its `n_secondary` most toxic other neighbours. Returns
+    (cluster_id, level, parent, x, y) rows.
+    """
+    rows = [(focus_node, 0, None, SPACING['x_main'], 0.5)]
+    neighbours = list(G.neighbors(focus_node))
+    scores = [(G.edges[focus_node, node]['semantic_sim'] + G.edges[focus_node, node]['temporal_sim']) / 2
+              for node in neighbours]
+    immediate = [neighbours[i] for i in sorted(range(len(neighbours)), key=lambda i: -scores[i])[:n_immediate]]
+    positions = {}
+    for i, node in enumerate(immediate):
+        positions[node] = (SPACING['x_immediate'], 0.9 - i * SPACING['y_spacing'])
+        rows.append((node, 1, focus_node, *positions[node]))
+
+    for node in immediate:
+        secondary = [neighbor for neighbor in G.neighbors(node) if neighbor != focus_node and neighbor not in immediate]
+        secondary.sort(key=lambda neighbor: G.nodes[neighbor]['toxicity'], reverse=True)
+        for j, neighbor in enumerate(secondary[:n_secondary]):
+            if neighbor not in positions:
+                # Stagger the secondary topics left/right and above/below their parent
+                positions[neighbor] = (SPACING['x_secondary_left'] if j % 2 == 0 else SPACING['x_secondary_right'],
+                                       positions[node][1] + SPACING['y_spacing'] * (0.3 if j % 2 == 0 else -0.15))
+            rows.append((neighbor, 2, node, *positions[neighbor]))
+    return rows
+
+
+def layout_table(G, n_immediate=5, n_secondary=2):
+    """Tree layouts of every cluster"""
+    rows = [(focus, *row) for focus in G.nodes for row in tree_layout(G, focus, n_immediate, n_secondary)]
+    return pd.DataFrame(rows, columns=LAYOUT_COLUMNS).astype({'parent': 'Int64'})
+
+
+def write_network_store(G, directory='data/topic_network', seed=42):
+    """
+    Write a topic network as the Parquet tables of the Detailed Analysis page.
+
+    Node attributes, edge weights, 2-hop neighbourhoods and the layouts (spring
+    layout of the network, tree of every cluster) are computed here once, so the
+    page only looks them up. Every file is written to a temporary name and
+    renamed into place.
+
+    Parameters:
+    - G: Network of `EnhancedTopicNetworkBuilder.create_network` (cluster ids as nodes).
+    - directory: Output directory.
+    - seed: Seed of the spring layout.
+    """
+    t0 = time.time()
+    os.makedirs(directory, exist_ok=True)
+    tables = {'nodes': node_table(G, seed), 'edges': edge_table(G), 'neighbourhoods': neighbourhood_table(G),
+              'layouts': layout_table(G)}
+    for name, table in tables.items():
+        path = os.path.join(directory, FILES[name])
+        table.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    print(f"Network store written to {directory} ({len(tables['nodes'])} clusters, {len(tables['edges'])} edges, "
+          f"{len(tables['neighbourhoods'])} neighbourhood rows) in {time.time() - t0:.2f}s")
+
+
+def network_version(directory='data/topic_network'):
+    """Modification time of the store's files (changes when it is rewritten), None if there is no store"""
+    paths = [os.path.join(directory, file) for file in FILES.values()]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return max(os.stat(path).st_mtime_ns for path in paths)
+
+
+class NetworkStore:
+    """
+    Read side of the network store.
+
+    - `nodes`: node attributes and spring layout coordinates, indexed by cluster_id.
+    - `edges`: edge weights, one row per edge. Every edge is also kept once per
+      endpoint, sorted by endpoint, so the edges of a set of clusters are found by
+      binary search and a lookup does not scan the whole edge table.
+    - `neighbourhoods` and `layouts`: indexed by focus cluster, so the
+      neighbourhood or tree of a cluster is an index lookup.
+
+    Parameters:
+    - directory: Directory written by `write_network_store`.
+    """
+
+    def __init__(self, directory='data/topic_network'):
+        self.directory = directory
+        tables = {name: pd.read_parquet(os.path.join(directory, file)) for name, file in FILES.items()}
+        self.nodes = tables['nodes'].set_index('cluster_id')
+        self.edges = tables['edges']
+        # Both directions of every edge (endpoint, other, row of `edges`), sorted by endpoint
+        source, target = self.edges['source'].to_numpy(), self.edges['target'].to_numpy()
+        endpoints, others = np.concatenate([source, target]), np.concatenate([target, source])
+        order = np.lexsort((others, endpoints))
+        self._endpoints, self._others = endpoints[order], others[order]
+        self._edge_rows = np.tile(np.arange(len(self.edges)), 2)[order]
+        self.neighbourhoods = tables['neighbourhoods'].set_index('focus').sort_index(kind='stable')
+        self.layouts = tables['layouts'].set_index('focus').sort_index(kind='stable')
+
+    def clusters(self):
+        """Cluster ids, most toxic first"""
+        return list(self.nodes['toxicity'].sort_values(ascending=False, kind='stable').index)
+
+    def neighbourhood(self, focus):
+        """Clusters within 2 hops of `focus` (level, via) with their node attributes"""
+        rows = self.neighbourhoods.loc[[focus]] if focus in self.neighbourhoods.index else self.neighbourhoods.iloc[:0]
+        return rows.reset_index(drop=True).join(self.nodes, on='cluster_id')
+
+    def _incident(self, clusters):
+        """Positions (in the endpoint-sorted arrays) of the edges with an endpoint in the sorted `clusters`"""
+        start = np.searchsorted(self._endpoints, clusters, 'left')
+        lengths = np.searchsorted(self._endpoints, clusters, 'right') - start
+        # Every cluster's run of edges, concatenated
+        return np.arange(lengths.sum()) + np.repeat(start - np.cumsum(lengths) + lengths, lengths)
+
+    def subgraph_edges(self, clusters):
+        """Edges between the given clusters"""
+        clusters = np.unique(np.asarray(list(clusters), dtype=self._endpoints.dtype))
+        positions = self._incident(clusters)
+        others = self._others[positions]
+        keep = (self._endpoints[positions] < others) & np.isin(others, clusters)
+        return self.edges.iloc[np.sort(self._edge_rows[positions[keep]])]
+
+    def connections(self, focus):
+        """Direct connections of `focus` with their edge weights and node attributes, strongest first"""
+        positions = self._incident(np.array([focus], dtype=self._endpoints.dtype))
+        edges = self.edges.iloc[self._edge_rows[positions]]
+        return (edges.drop(columns=['source', 'target']).assign(cluster_id=self._others[positions])
+                .join(self.nodes, on='cluster_id')
+                .sort_values('weight', ascending=False, kind='stable', ignore_index=True))
+
+    def tree(self, focus):
+        """Tree rows of `focus` (cluster_id, level, parent, x, y) with their node attributes and edge weights"""
+        rows = self.layouts.loc[[focus]].reset_index(drop=True)
+        rows = rows.join(self.nodes.drop(columns=['x', 'y']), on='cluster_id')
+        pairs = pd.DataFrame({'source': np.minimum(rows['cluster_id'], rows['parent'].fillna(-1)),
+                              'target': np.maximum(rows['cluster_id'], rows['parent'].fillna(-1))})
+        weights = pairs.merge(self.subgraph_edges(rows['cluster_id']), on=['source', 'target'], how='left')
+        return pd.concat([rows, weights[['weight', 'semantic_sim', 'temporal_sim']]], axis=1)
+
+
+def synthetic_network(n_clusters, n_edges=None, seed=0):
+    """Random network with the node and edge attributes of `create_network`"""
+    rng = np.random.default_rng(seed)
+    G = nx.gnm_random_graph(n_clusters, n_edges or 4 * n_clusters, seed=seed)
+    for node in G.nodes:
+        months = sorted(rng.choice([f"{year}-{month:02d}" for year in range(2020, 2024) for month in range(1, 13)],
+                                   rng.integers(1, 12), replace=False))
+        G.nodes[node].update(keywords=[f"w{word}" for word in rng.integers(0, 3000, 10)],
+                             posts=int(rng.integers(100, 5000)), toxicity=float(rng.uniform(0, 0.3)), domain=None,
+                             temporal={month[:4]: {} for month in months})
+        for month in months:
+            G.nodes[node]['temporal'][month[:4]][month] = {'post_count': int(rng.integers(1, 500))}
+    for u, v in G.edges:
+        semantic, temporal = rng.uniform(0.2, 1, 2)
+        G.edges[u, v].update(weight=0.8 * semantic + 0.2 * temporal, semantic_sim=semantic, temporal_sim=temporal)
+    return G
+
+
+def benchmark_network_store(G, directory='data/topic_network', n_focus=50):
+    """Time the tree and 2-hop neighbourhood of `n_focus` clusters: computed from the graph against store lookups"""
+    write_network_store(G, directory)
+    focus_nodes = list(G.nodes)[:n_focus]
+
+    t0 = time.time()
+    for focus in focus_nodes:
+        tree_layout(G, focus)
+        first = set(G.neighbors(focus))
+        {node for neighbor in first for node in G.neighbors(neighbor)} - first - {focus}
+    graph_seconds = time.time() - t0
+
+    t0 = time.time()
+    store = NetworkStore(directory)
+    load_seconds = time.time() - t0
+    t0 = time.time()
+    for focus in focus_nodes:
+        store.tree(focus)
+        store.subgraph_edges(store.neighbourhood(focus)['cluster_id'])
+    store_seconds = time.time() - t0
+    print(f"Tree + 2-hop neighbourhood of {len(focus_nodes)} clusters: from the graph {graph_seconds * 1000:.1f} ms, "
+          f"store lookups {store_seconds * 1000:.1f} ms (store loaded once in {load_seconds * 1000:.1f} ms)")
+    return graph_seconds, load_seconds, store_seconds
+
+
+if __name__ == "__main__":
+    benchmark_network_store(synthetic_network(2000), directory='data/topic_network_benchmark')
@@ -1,141 +1,157 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+import multiprocessing as mp
 import os
+import resource
+import time
 
-def preprocess_time_metrics(input_file, output_dir='data'):
+from dashboard_snapshot import write_snapshot
+from metrics_store import (MODELS, cell_stats, daily_metrics, hourly_metrics, monthly_metrics,
+                           peak_hours, update_store, write_metrics)
+
+def preprocess_time_metrics(input_file, output_dir='data', store_path=None, months=None):
+    """
+    Update the aggregation store with new months and derive the time metric files.
+
+    Only the comments of months that are not in the store yet and of the latest
+    stored month (or the given `months`) are scanned; hourly_metrics.csv, daily_metrics.csv,
+    monthly_metrics.csv, monthly_scores_summary.csv and peak_hours.csv are then
+    derived from the stored per-cell statistics. Their `post_count` counts the
+    comments with a finite score (see `write_metrics`).
+
+    Parameters:
+    - input_file: Parquet dataset data/combined_data_scores/ or combined_data_scores.csv.
+    - output_dir: Directory of the metric files.
+    - store_path: The aggregation store (default: `<output_dir>/metrics_store.csv`).
+    - months: Months to re-ingest, e.g. ['2024-01'] when a month was still incomplete.
+    """
+    store_path = store_path or f"{output_dir}/metrics_store.csv"
 
-    print("Loading raw data...")
-    df = pd.read_csv(input_file)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
-    
-    # 1. Hourly Summary
-    print("Processing hourly metrics...")
-    hourly_metrics = df.groupby(df['timestamp'].dt.hour).agg({
-        'text': 'count',  # post count
-        'average_toxicity_score': 'mean',
-        'hatebert_toxicity_score': 'mean',
-        'hateXplain_toxicity_score': 'mean',
-        'toxicbert_toxicity_score': 'mean'
-    }).reset_index()
-    hourly_metrics.columns = ['hour', 'post_count', 'avg_toxicity', 
-                            'hatebert_score', 'hatexplain_score', 'toxicbert_score']
-    
-    # Add relative metrics
-    hourly_metrics['post_percent'] = (hourly_metrics['post_count'] / 
-                                    hourly_metrics['post_count'].sum() * 100)
-    hourly_metrics['toxicity_vs_mean'] = ((hourly_metrics['avg_toxicity'] - 
-                                         hourly_metrics['avg_toxicity'].mean()) / 
-                                         hourly_metrics['avg_toxicity'].mean() * 100)
-    
-    # 2. Daily Summary
-    print("Processing daily metrics...")
-    daily_metrics = df.groupby(df['timestamp'].dt.day_name()).agg({
-        'text': 'count',
-        'average_toxicity_score': 'mean',
-        'hatebert_toxicity_score': 'mean',
-        'hateXplain_toxicity_score': 'mean',
-        'toxicbert_toxicity_score': 'mean'
-    }).reset_index()
-    daily_metrics.columns = ['day', 'post_count', 'avg_toxicity',
-                           'hatebert_score', 'hatexplain_score', 'toxicbert_score']
-    
-    # Add relative metrics
-    daily_metrics['post_percent'] = (daily_metrics['post_count'] / 
-                                   daily_metrics['post_count'].sum() * 100)
-    daily_metrics['toxicity_vs_mean'] = ((daily_metrics['avg_toxicity'] - 
-                                        daily_metrics['avg_toxicity'].mean()) / 
-                                        daily_metrics['avg_toxicity'].mean() * 100)
-    
-    # 3. Monthly Summary
-    print("Processing monthly metrics...")
-    # First create a year-month column for proper grouping
-    df['year_month'] = df['timestamp'].dt.to_period('M')
-    monthly_agg = df.groupby('year_month').agg({
-        'text': 'count',
-        'average_toxicity_score': ['mean', 'std'],
-        'hatebert_toxicity_score': ['mean', 'std'],
-        'hateXplain_toxicity_score': ['mean', 'std'],
-        'toxicbert_toxicity_score': ['mean', 'std']
-    })
-    
-    # Flatten the multi-level columns
-    monthly_agg.columns = ['_'.join(col).strip() for col in monthly_agg.columns.values]
-    monthly_metrics = monthly_agg.reset_index()
-    # Extract year and month from period index
-    monthly_metrics['year'] = monthly_metrics['year_month'].dt.year
-    monthly_metrics['month'] = monthly_metrics['year_month'].dt.month
-    # Drop the period column and reorder
-    monthly_metrics = monthly_metrics.drop('year_month', axis=1)
-    
-    # Rename columns to be more intuitive
-    monthly_metrics = monthly_metrics.rename(columns={
-        'text_count': 'post_count',
-        'average_toxicity_score_mean': 'avg_toxicity_mean',
-        'average_toxicity_score_std': 'avg_toxicity_std',
-        'hatebert_toxicity_score_mean': 'hatebert_mean',
-        'hatebert_toxicity_score_std': 'hatebert_std',
-        'hateXplain_toxicity_score_mean': 'hatexplain_mean',
-        'hateXplain_toxicity_score_std': 'hatexplain_std',
-        'toxicbert_toxicity_score_mean': 'toxicbert_mean',
-        'toxicbert_toxicity_score_std': 'toxicbert_std'
-    })
-    
-    # 4. Peak Hours Analysis
-    print("Processing peak hours analysis...")
-    peak_hours = pd.DataFrame({
-        'metric': ['posts', 'toxicity'],
-        'peak_hour': [
-            hourly_metrics.loc[hourly_metrics['post_count'].idxmax(), 'hour'],
-            hourly_metrics.loc[hourly_metrics['avg_toxicity'].idxmax(), 'hour']
-        ],
-        'peak_value': [
-            hourly_metrics['post_count'].max(),
-            hourly_metrics['avg_toxicity'].max()
-        ],
-        'lowest_hour': [
-            hourly_metrics.loc[hourly_metrics['post_count'].idxmin(), 'hour'],
-            hourly_metrics.loc[hourly_metrics['avg_toxicity'].idxmin(), 'hour']
-        ],
-        'lowest_value': [
-            hourly_metrics['post_count'].min(),
-            hourly_metrics['avg_toxicity'].min()
-        ]
-    })
-    
-    # Save processed data
-    print("Saving processed data...")
-    hourly_metrics.to_csv(f"{output_dir}/hourly_metrics.csv", index=False)
-    daily_metrics.to_csv(f"{output_dir}/daily_metrics.csv", index=False)
-    monthly_metrics.to_csv(f"{output_dir}/monthly_metrics.csv", index=False)
-    peak_hours.to_csv(f"{output_dir}/peak_hours.csv", index=False)
-    
+
+    print("Updating aggregation store...")
+    store = update_store(input_file, store_path, months)
+
+    print("Deriving metrics from the store...")
+    summary = write_metrics(store, output_dir)
+    print(f"Metrics derived in {summary['milliseconds']} ms")
+
     # Generate metadata
     metadata = {
         'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'total_posts': len(df),
-        'date_range': f"{df['timestamp'].min()} to {df['timestamp'].max()}",
+        'total_posts': summary['total_posts'],
+        'date_range': summary['date_range'],
         'file_paths': {
             'hourly_metrics': 'hourly_metrics.csv',
             'daily_metrics': 'daily_metrics.csv',
             'monthly_metrics': 'monthly_metrics.csv',
+            'monthly_scores_summary': 'monthly_scores_summary.csv',
             'peak_hours': 'peak_hours.csv'
         }
     }
-    
+
     # Save metadata
     pd.DataFrame([metadata]).to_json(f"{output_dir}/metadata.json", orient='records')
-    
+
     print("Processing complete! Files saved in:", output_dir)
     return metadata
 
 
+def legacy_time_metrics(df):
+    """
+    The previous implementation: three pandas groupby passes over the full frame,
+    keyed by `.dt.hour`, `.dt.day_name()` and a `year_month` Period column.
+    Kept for benchmarking; returns the hourly, daily and monthly metrics.
+    """
+    scores = {column: 'mean' for column in ['average_toxicity_score', 'hatebert_toxicity_score',
+                                            'hateXplain_toxicity_score', 'toxicbert_toxicity_score']}
+    columns = ['post_count', 'avg_toxicity', 'hatebert_score', 'hatexplain_score', 'toxicbert_score']
+
+    hourly = df.groupby(df['timestamp'].dt.hour.rename('hour')).agg({'timestamp': 'count', **scores})
+    hourly = hourly.set_axis(columns, axis=1).reset_index()
+    daily = df.groupby(df['timestamp'].dt.day_name().rename('day')).agg({'timestamp': 'count', **scores})
+    daily = daily.set_axis(columns, axis=1).reset_index()
+    for metrics in (hourly, daily):
+        metrics['post_percent'] = metrics['post_count'] / metrics['post_count'].sum() * 100
+        metrics['toxicity_vs_mean'] = ((metrics['avg_toxicity'] - metrics['avg_toxicity'].mean()) /
+                                       metrics['avg_toxicity'].mean() * 100)
+
+    df['year_month'] = df['timestamp'].dt.to_period('M')
+    monthly = df.groupby('year_month').agg({'timestamp': 'count',
+                                            **{column: ['mean', 'std'] for column in scores}})
+    monthly.columns = ['post_count'] + [f'{prefix}_{stat}'
+                                        for prefix in ['avg_toxicity', 'hatebert', 'hatexplain', 'toxicbert']
+                                        for stat in ['mean', 'std']]
+    monthly = monthly.reset_index()
+    monthly['year'] = monthly['year_month'].dt.year
+    monthly['month'] = monthly['year_month'].dt.month
+    return hourly, daily, monthly.drop('year_month', axis=1)
+
+
+def synthetic_scores(n_rows, seed=0):
+    """Random timestamps over four years with four score columns"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2020-01-01').value
+    end = pd.Timestamp('2024-01-01').value
+    df = pd.DataFrame({'timestamp': pd.to_datetime(rng.integers(start, end, n_rows))})
+    for column in MODELS.values():
+        df[column] = rng.random(n_rows)
+    return df
+
+
+def _run_engine(engine, n_rows, queue):
+    """Compute the metrics of a synthetic input in a fresh process, reporting time and peak RSS"""
+    df = synthetic_scores(n_rows)
+    # Peak RSS of the input alone, so the engine's own overhead can be reported
+    input_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    t0 = time.time()
+    if engine == 'groupby':
+        hourly, daily, monthly = legacy_time_metrics(df)
+    else:
+        store = cell_stats(df)
+        hourly, daily, monthly = hourly_metrics(store), daily_metrics(store), monthly_metrics(store)
+    seconds = time.time() - t0
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((seconds, input_mb, peak_mb, (hourly, daily, monthly, peak_hours(hourly))))
+
+
+def benchmark_time_metrics(n_rows=50_000_000):
+    """
+    Compare the bincount engine with the previous groupby implementation.
+
+    Each engine runs in its own process on the same synthetic input, so peak RSS
+    (ru_maxrss) is measured separately; the derived metric tables are compared.
+    """
+    ctx = mp.get_context('spawn')
+    results, outputs = [], {}
+    for engine in ['groupby', 'bincount']:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_run_engine, args=(engine, n_rows, queue))
+        process.start()
+        seconds, input_mb, peak_mb, outputs[engine] = queue.get()
+        process.join()
+        results.append({'engine': engine, 'rows': n_rows, 'seconds': round(seconds, 2),
+                        'peak_rss_mb': round(peak_mb, 1), 'overhead_mb': round(peak_mb - input_mb, 1)})
+
+    same = all(np.allclose(old.select_dtypes('number'), new.select_dtypes('number'), rtol=1e-9)
+               and old.select_dtypes(exclude='number').equals(new.select_dtypes(exclude='number'))
+               and list(old.columns) == list(new.columns)
+               for old, new in zip(outputs['groupby'], outputs['bincount']))
+    results = pd.DataFrame(results)
+    print(f"\nTime metrics on {n_rows:,} synthetic rows (same output: {same}, "
+          f"speed-up {results['seconds'][0] / results['seconds'][1]:.1f}x):")
+    print(results.to_string(index=False))
+    return results
+
+
 if __name__ == "__main__":
-    input_file = "data/combined_data_scores.csv"
+    input_file = "data/combined_data_scores"  # or "data/combined_data_scores.csv"
     metadata = preprocess_time_metrics(input_file)
     print("\nProcessing Summary:")
     for key, value in metadata.items():
-        print(f"{key}: {value}")
\ No newline at end of file
+        print(f"{key}: {value}")
+
+    # Repack the dashboard snapshot with the new metric files
+    write_snapshot('data')
@@ -0,0 +1,243 @@
+import multiprocessing as mp
+import os
+import random
+import resource
+import shutil
+import string
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RAW_FILES = ['data/Reddit-Threads_2020-2021.csv', 'data/Reddit-Threads_2022-2023.csv']
+
+
+def clean_chunk(chunk):
+    """
+    Clean a chunk of the raw dump and derive `yearmonth` and `title`.
+
+    Same steps as the original notebook: drop rows with missing values, drop
+    deleted/removed comments, parse `timestamp`, derive `yearmonth` and take the
+    thread title from the 6th segment of `link`.
+    """
+    chunk = chunk.dropna()
+    chunk = chunk[~chunk['text'].isin(["[deleted]", "[removed]"])]
+    chunk = chunk.assign(timestamp=pd.to_datetime(chunk['timestamp']))
+    chunk['yearmonth'] = chunk['timestamp'].dt.to_period('M').astype(str)
+    chunk['title'] = chunk['link'].str.split('/').str[5].str.replace('_', ' ')
+    return chunk
+
+
+def write_sorted_runs(input_csvs, run_dir, chunk_size=500000):
+    """
+    First pass of the external sort: clean the raw dumps chunk by chunk and write
+    every chunk, sorted by timestamp, as its own run file.
+
+    Returns the run file paths and the number of raw and cleaned rows.
+    """
+    runs = []
+    raw_rows = clean_rows = 0
+    for input_csv in input_csvs:
+        with pd.read_csv(input_csv, chunksize=chunk_size) as reader:
+            for chunk in reader:
+                raw_rows += len(chunk)
+                chunk = clean_chunk(chunk).sort_values('timestamp', kind='stable')
+                clean_rows += len(chunk)
+                path = os.path.join(run_dir, f'run-{len(runs):05d}.parquet')
+                pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), path)
+                runs.append(path)
+                print(f'Run {len(runs)} written ({clean_rows} of {raw_rows} rows kept).')
+    return runs, raw_rows, clean_rows
+
+
+def iter_run(path, batch_size):
+    """Read a run file back in batches of `batch_size` rows"""
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield batch.to_pandas()
+
+
+def merge_runs(runs, batch_size=50000):
+    """
+    Second pass of the external sort: k-way merge of the sorted runs.
+
+    Holds one batch per run in memory. Every step emits all buffered rows up to the
+    smallest "last buffered timestamp" across runs: no run can still hold an earlier
+    row, so the emitted block is final once sorted. Yields timestamp-ordered frames.
+    """
+    readers = [iter_run(path, batch_size) for path in runs]
+    buffers = [next(reader, None) for reader in readers]
+
+    while True:
+        active = [i for i, buffer in enumerate(buffers) if buffer is not None]
+        if not active:
+            return
+        bound = min(buffers[i]['timestamp'].iloc[-1] for i in active)
+
+        parts = []
+        for i in active:
+            buffer = buffers[i]
+            cut = buffer['timestamp'].searchsorted(bound, side='right')
+            parts.append(buffer.iloc[:cut])
+            buffers[i] = buffer.iloc[cut:] if cut < len(buffer) else next(readers[i], None)
+
+        yield pd.concat(parts).sort_values('timestamp', kind='stable')
+
+
+def ingest(input_csvs, output_csv, chunk_size=500000, batch_size=50000, tmp_dir=None):
+    """
+    Build combined_data.csv from the raw dumps with bounded memory.
+
+    The raw dumps are streamed in chunks that are cleaned, sorted and spilled to
+    disk as runs; the runs are then merged in timestamp order and written out
+    chunk by chunk with a running `index`. Peak memory depends on `chunk_size`
+    and `batch_size` x number of runs, not on the size of the corpus.
+
+    Parameters:
+    - input_csvs: Raw Reddit-Threads CSV files with `timestamp`, `link` and `text`.
+    - output_csv: The output CSV file (combined_data.csv).
+    - chunk_size: Number of raw rows cleaned and sorted per run.
+    - batch_size: Number of rows read per run at a time while merging.
+    - tmp_dir: Directory for the run files (default: a temporary directory next to the output).
+    """
+    run_dir = tempfile.mkdtemp(prefix='ingestion-runs-', dir=tmp_dir or os.path.dirname(output_csv) or '.')
+    tmp_csv = f"{output_csv}.tmp"
+    try:
+        runs, raw_rows, clean_rows = write_sorted_runs(input_csvs, run_dir, chunk_size)
+
+        n_rows = 0
+        for block in merge_runs(runs, batch_size):
+            block['index'] = np.arange(n_rows, n_rows + len(block))
+            block.to_csv(tmp_csv, index=False, mode='w' if n_rows == 0 else 'a', header=n_rows == 0)
+            n_rows += len(block)
+        if n_rows == 0:
+            # No row survived the cleaning: write just the header of the cleaned schema
+            columns = clean_chunk(pd.read_csv(input_csvs[0], nrows=0)).columns
+            pd.DataFrame(columns=[*columns, 'index']).to_csv(tmp_csv, index=False)
+        os.replace(tmp_csv, output_csv)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    print(f"{n_rows} of {raw_rows} rows written to {output_csv} ({len(runs)} sorted runs merged)")
+    return n_rows
+
+
+def ingest_in_memory(input_csvs, output_csv, chunk_size=10000):
+    """The original notebook pipeline, which loads the whole corpus (kept for benchmarking)"""
+    combined_data = pd.concat([pd.concat(chunk for chunk in pd.read_csv(path, chunksize=chunk_size))
+                               for path in input_csvs]).reset_index(drop=True)
+    combined_data = combined_data.dropna()
+    combined_data = combined_data[~combined_data['text'].isin(["[deleted]", "[removed]"])]
+    combined_data['timestamp'] = pd.to_datetime(combined_data['timestamp'])
+    combined_data['yearmonth'] = combined_data['timestamp'].dt.to_period('M')
+    combined_data = combined_data.sort_values(by='timestamp').reset_index(drop=True)
+    combined_data['title'] = combined_data['link'].apply(lambda x: x.split('/')[5] if isinstance(x, str) else None)
+    combined_data['title'] = combined_data['title'].str.replace('_', ' ')
+    combined_data['index'] = combined_data.index
+    combined_data.to_csv(output_csv, index=False)
+    return len(combined_data)
+
+
+def write_synthetic_dump(path, n_rows, seed=0, chunk_size=200000):
+    """
+    Write a synthetic raw dump with the `timestamp`, `link` and `text` columns.
+
+    Timestamps are unordered, and about 2% of the comments are deleted/removed or
+    have a missing link, so every cleaning step has work to do.
+    """
+    rng = np.random.default_rng(seed)
+    words = [''.join(random.Random(i).choices(string.ascii_lowercase, k=random.Random(-i).randint(2, 9)))
+             for i in range(5000)]
+    start = pd.Timestamp('2020-01-01').value // 10**9
+    end = pd.Timestamp('2024-01-01').value // 10**9
+
+    for offset in range(0, n_rows, chunk_size):
+        n = min(chunk_size, n_rows - offset)
+        lengths = rng.integers(3, 60, n)
+        flat = rng.integers(0, len(words), lengths.sum())
+        cuts = np.cumsum(lengths)[:-1]
+        texts = [' '.join(words[w] for w in ids) for ids in np.split(flat, cuts)]
+        threads = rng.integers(0, 50000, n)
+        chunk = pd.DataFrame({
+            'timestamp': pd.to_datetime(rng.integers(start, end, n), unit='s').astype(str),
+            'link': [f'/r/singapore/comments/t{t}/thread_title_{t}/c{offset + i}/'
+                     for i, t in enumerate(threads)],
+            'text': texts
+        })
+        noise = rng.random(n)
+        chunk.loc[noise < 0.01, 'text'] = '[deleted]'
+        chunk.loc[(noise >= 0.01) & (noise < 0.015), 'text'] = '[removed]'
+        chunk.loc[(noise >= 0.015) & (noise < 0.02), 'link'] = None
+        chunk.to_csv(path, index=False, mode='w' if offset == 0 else 'a', header=offset == 0)
+
+
+def output_digest(path, chunk_size=500000):
+    """
+    Order-independent digest of the rows of an output file, used to check that two
+    pipelines produced the same rows (comments with equal timestamps may be ordered
+    differently, so `index` is left out).
+    """
+    n_rows, total = 0, np.uint64(0)
+    with pd.read_csv(path, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            row_hashes = pd.util.hash_pandas_object(chunk.drop(columns='index'), index=False)
+            total += row_hashes.values.sum(dtype=np.uint64)
+            n_rows += len(chunk)
+    return n_rows, int(total)
+
+
+def _measure(func, args, queue):
+    """Run a pipeline in a fresh process and report its wall time and peak RSS"""
+    t0 = time.time()
+    rows = func(*args)
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((rows, time.time() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def benchmark_ingestion(n_rows=10_000_000, tmp_dir=None, chunk_size=500000, batch_size=50000):
+    """
+    Compare peak memory (RSS) and wall time of the streaming and in-memory pipelines.
+
+    Writes a synthetic dump split over two files like the raw data (about 2.5 GB for
+    10M rows), then runs each pipeline in its own process so their peak RSS can be
+    measured separately, and checks that both produce the same rows.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='ingestion-benchmark-', dir=tmp_dir)
+    try:
+        inputs = [os.path.join(tmp_dir, 'dump-1.csv'), os.path.join(tmp_dir, 'dump-2.csv')]
+        print(f"Writing synthetic dump of {n_rows} rows...")
+        write_synthetic_dump(inputs[0], n_rows // 2, seed=1)
+        write_synthetic_dump(inputs[1], n_rows - n_rows // 2, seed=2)
+        dump_gb = sum(os.path.getsize(path) for path in inputs) / 1024**3
+
+        pipelines = {
+            'in_memory': (ingest_in_memory, (inputs, os.path.join(tmp_dir, 'in_memory.csv'))),
+            'streaming': (ingest, (inputs, os.path.join(tmp_dir, 'streaming.csv'), chunk_size, batch_size))
+        }
+        ctx = mp.get_context('spawn')
+        results = []
+        for name, (func, args) in pipelines.items():
+            queue = ctx.Queue()
+            process = ctx.Process(target=_measure, args=(func, args, queue))
+            process.start()
+            rows, seconds, peak_mb = queue.get()
+            process.join()
+            results.append({'pipeline': name, 'rows': rows, 'dump_gb': round(dump_gb, 2),
+                            'seconds': round(seconds, 1), 'peak_rss_mb': round(peak_mb, 1)})
+
+        same = (output_digest(os.path.join(tmp_dir, 'in_memory.csv'))
+                == output_digest(os.path.join(tmp_dir, 'streaming.csv')))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results = pd.DataFrame(results)
+    print(f"\nIngestion of a {dump_gb:.2f} GB synthetic dump (outputs identical: {same}):")
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == "__main__":
+    # Run from the project root directory
+    ingest(RAW_FILES, 'data/combined_data.csv')
@@ -0,0 +1,91 @@
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCORE_COLUMNS = [
+    'hatebert_toxicity_score',
+    'hateXplain_toxicity_score',
+    'toxicbert_toxicity_score',
+    'average_toxicity_score'
+]
+
+# Columns with few distinct values (one thread title per many comments) stored as categoricals
+CATEGORICAL_COLUMNS = ['title']
+
+PARTITION_COLUMN = 'yearmonth'
+
+
+def to_columnar(chunk):
+    """Convert a chunk of combined_data_scores.csv to typed columns"""
+    chunk = chunk.copy()
+    chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+    chunk['index'] = chunk['index'].astype('int64')
+    chunk[PARTITION_COLUMN] = chunk[PARTITION_COLUMN].astype(str)
+    for column in SCORE_COLUMNS:
+        if column in chunk:
+            chunk[column] = chunk[column].astype('float64')
+    for column in CATEGORICAL_COLUMNS:
+        if column in chunk:
+            chunk[column] = chunk[column].astype('category')
+    return chunk
+
+
+def write_scores_dataset(input_csv, dataset_dir, chunk_size=200000):
+    """
+    Convert combined_data_scores.csv to a Parquet dataset partitioned by `yearmonth`.
+
+    The CSV is streamed in chunks and every chunk is written to one file per month
+    (`<dataset_dir>/yearmonth=2023-10/part-00000-0.parquet`), with `timestamp` as a
+    datetime, scores as float64 and `title` as a categorical. The input is ordered
+    by timestamp, so reading the dataset back returns the rows in the same order.
+    The dataset is written next to the final location and swapped in once complete.
+
+    Parameters:
+    - input_csv: combined_data_scores.csv.
+    - dataset_dir: Directory of the Parquet dataset (e.g. data/combined_data_scores).
+    - chunk_size: Number of rows converted at a time.
+    """
+    tmp_dir = f"{dataset_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    n_rows = 0
+    with pd.read_csv(input_csv, chunksize=chunk_size) as reader:
+        for chunk_idx, chunk in enumerate(reader):
+            table = pa.Table.from_pandas(to_columnar(chunk), preserve_index=False)
+            pq.write_to_dataset(table, tmp_dir, partition_cols=[PARTITION_COLUMN],
+                                basename_template=f"part-{chunk_idx:05d}-{{i}}.parquet")
+            n_rows += len(chunk)
+            print(f'Batch {chunk_idx + 1} written.')
+
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    os.replace(tmp_dir, dataset_dir)
+    print(f"{n_rows} rows written to {dataset_dir} ({len(list_yearmonths(dataset_dir))} months)")
+    return n_rows
+
+
+def list_yearmonths(dataset_dir):
+    """Months present in the dataset, read from the partition directories only"""
+    prefix = f"{PARTITION_COLUMN}="
+    return sorted(name[len(prefix):] for name in os.listdir(dataset_dir) if name.startswith(prefix))
+
+
+def read_scores(dataset_dir, columns=None, yearmonths=None):
+    """
+    Read the scores dataset, loading only the requested columns and months.
+
+    Parameters:
+    - dataset_dir: Directory written by `write_scores_dataset`.
+    - columns: Columns to load (default: all).
+    - yearmonths: Months to load, e.g. ['2023-10'] (default: all). Other month
+      partitions are skipped without being read.
+
+    `yearmonth` is returned as a plain string column, as in the CSV.
+    """
+    filters = [(PARTITION_COLUMN, 'in', list(yearmonths))] if yearmonths is not None else None
+    df = pd.read_parquet(dataset_dir, columns=columns, filters=filters)
+    if PARTITION_COLUMN in df:
+        df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(str)
+    return df
@@ -0,0 +1,269 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Sliding window size of gensim's c_v
+WINDOW_SIZE = 110
+# Smoothing constant of gensim's direct confirmation measures
+EPSILON = 1e-12
+
+
+def offsets_of(lengths):
+    """Start offset of every document in the concatenated tokens"""
+    return np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype('int64')
+
+
+def window_matrix(doc_ids, window_size=WINDOW_SIZE):
+    """
+    Boolean windows x vocabulary matrix of the sliding windows of the documents.
+
+    Reproduces gensim's `WordOccurrenceAccumulator` exactly, including its quirks:
+    - a document shorter than the window (or empty) is a single window,
+      otherwise it has len - window_size + 1 windows;
+    - when the window slides, the token leaving it on the left is marked absent
+      even if it occurs again inside the window, and the token entering it on the
+      right is marked present (both are updated in this order).
+
+    A word is therefore present in window k if its last add/remove event up to k
+    is an add: occurrence p adds it at window max(0, p - window_size + 1) and
+    removes it at window p + 1. The events of all documents are resolved at once
+    with a sort instead of sliding over every window.
+
+    Parameters:
+    - doc_ids: List of integer arrays, the token ids of every document.
+    - window_size: Sliding window size.
+    """
+    lengths = np.array([len(ids) for ids in doc_ids], dtype='int64')
+    n_windows = np.maximum(1, lengths - window_size + 1)
+    offsets = np.concatenate([[0], np.cumsum(n_windows)])
+    n_rows = int(offsets[-1])
+    words = np.concatenate([np.asarray(ids, dtype='int64') for ids in doc_ids] + [np.empty(0, dtype='int64')])
+    vocab_size = int(words.max()) + 1 if len(words) else 0
+    docs = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(len(words)) - np.repeat(offsets_of(lengths), lengths)
+
+    add_time = np.maximum(0, positions - window_size + 1)
+    remove_time = positions + 1
+    has_remove = remove_time <= n_windows[docs] - 1
+
+    # Events: (document, word, window, type), type 0 = remove, 1 = add
+    key = np.concatenate([docs * vocab_size + words, (docs * vocab_size + words)[has_remove]])
+    times = np.concatenate([add_time, remove_time[has_remove]])
+    types = np.concatenate([np.ones(len(words), dtype='int8'), np.zeros(has_remove.sum(), dtype='int8')])
+    order = np.lexsort((types, times, key))
+    key, times, types = key[order], times[order], types[order]
+
+    # Within a window the remove comes first, so the last event of each window wins
+    last = np.ones(len(key), dtype=bool)
+    last[:-1] = (key[1:] != key[:-1]) | (times[1:] != times[:-1])
+    key, times, types = key[last], times[last], types[last]
+
+    # An add is present until the next event of the same word (or the end of the document)
+    event_docs = key // max(vocab_size, 1)
+    next_time = n_windows[event_docs].copy()
+    same_key = key[1:] == key[:-1]
+    next_time[:-1][same_key] = times[1:][same_key]
+    adds = types == 1
+    starts = offsets[event_docs[adds]] + times[adds]
+    spans = next_time[adds] - times[adds]
+    rows = np.repeat(starts - offsets_of(spans), spans) + np.arange(spans.sum())
+    cols = np.repeat(key[adds] % max(vocab_size, 1), spans)
+
+    return sparse.csc_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n_rows, vocab_size))
+
+
+class CoherenceIndex:
+    """
+    Sliding-window co-occurrence index of a tokenized corpus, for c_v and NPMI coherence.
+
+    The corpus is scanned once into a sparse boolean windows x vocabulary matrix
+    (see `window_matrix`). Coherence of any set of topics is then computed from
+    the (co-)occurrence counts of the topic words only, `X[:, words].T @ X[:, words]`,
+    vectorized across topics, and matches gensim's `CoherenceModel` on the same
+    tokens and window size.
+
+    Parameters:
+    - vocab: Words of the index, in column order.
+    - windows: The windows x vocabulary matrix.
+    - window_size: Sliding window size the matrix was built with.
+    """
+
+    def __init__(self, vocab, windows, window_size=WINDOW_SIZE):
+        self.vocab = list(vocab)
+        self.word2id = {word: idx for idx, word in enumerate(self.vocab)}
+        self.windows = windows.tocsc()
+        self.window_size = window_size
+
+    @classmethod
+    def build(cls, tokens, window_size=WINDOW_SIZE):
+        """Build the index from tokenized documents (lists of words)"""
+        lengths = np.array([len(doc) for doc in tokens], dtype='int64')
+        codes, vocab = pd.factorize(pd.Series([word for doc in tokens for word in doc], dtype=object))
+        doc_ids = np.split(codes.astype('int64'), np.cumsum(lengths)[:-1]) if len(lengths) else []
+        return cls(vocab, window_matrix(doc_ids, window_size), window_size)
+
+    @property
+    def num_windows(self):
+        return self.windows.shape[0]
+
+    def save(self, directory):
+        """Write the index to a directory (windows.npz and vocab.json)"""
+        os.makedirs(directory, exist_ok=True)
+        sparse.save_npz(os.path.join(directory, 'windows.tmp.npz'), self.windows)
+        os.replace(os.path.join(directory, 'windows.tmp.npz'), os.path.join(directory, 'windows.npz'))
+        with open(os.path.join(directory, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump({'window_size': self.window_size, 'vocab': self.vocab}, f)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'vocab.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['vocab'], sparse.load_npz(os.path.join(directory, 'windows.npz')), meta['window_size'])
+
+    @classmethod
+    def load_or_build(cls, directory, tokens, window_size=WINDOW_SIZE):
+        """Load the index of a corpus from disk, building and saving it first if needed"""
+        if os.path.exists(os.path.join(directory, 'windows.npz')):
+            index = cls.load(directory)
+            if index.window_size == window_size:
+                return index
+        index = cls.build(tokens, window_size)
+        index.save(directory)
+        return index
+
+    def topic_ids(self, topics, topn=20):
+        """
+        Column ids of the topic words; words missing from the corpus are dropped,
+        and like gensim all topics are cut to `topn` words if the first one is longer.
+        """
+        if topics and len(topics[0]) > topn:
+            topics = [topic[:topn] for topic in topics]
+        return [[self.word2id[word] for word in topic if word in self.word2id] for topic in topics]
+
+    def npmi_matrix(self, word_ids):
+        """NPMI between all pairs of the given words, as gensim's `log_ratio_measure(normalize=True)`"""
+        sub = self.windows[:, word_ids].astype('int64')
+        co_occurrences = (sub.T @ sub).toarray().astype('float64')
+        occurrences = np.diag(co_occurrences)
+        num_docs = float(self.num_windows)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            numerator = np.log(((co_occurrences / num_docs) + EPSILON) /
+                               np.outer(occurrences / num_docs, occurrences / num_docs))
+            return numerator / (-np.log(co_occurrences / num_docs + EPSILON))
+
+    def _topic_matrices(self, topics):
+        """Per-topic NPMI matrices, padded to the longest topic, and the mask of real words"""
+        ids = self.topic_ids(topics)
+        union = sorted({word for topic in ids for word in topic})
+        npmi = self.npmi_matrix(union)
+        column = {word: idx for idx, word in enumerate(union)}
+
+        width = max([len(topic) for topic in ids] + [1])
+        positions = np.zeros((len(ids), width), dtype='int64')
+        mask = np.zeros((len(ids), width), dtype=bool)
+        for t, topic in enumerate(ids):
+            positions[t, :len(topic)] = [column[word] for word in topic]
+            mask[t, :len(topic)] = True
+        matrices = npmi[positions[:, :, None], positions[:, None, :]] if union else np.zeros((len(ids), 1, 1))
+        pair_mask = mask[:, :, None] & mask[:, None, :]
+        return np.where(pair_mask, matrices, 0.0), mask
+
+    def c_v_per_topic(self, topics, gamma=1):
+        """
+        c_v coherence of every topic (lists of words).
+
+        Segmentation is one-set (every word against the whole topic), the context
+        vector of a word holds its NPMI**gamma with every topic word, and the
+        topic's score is the mean cosine between each word's vector and the sum
+        of all of them.
+        """
+        matrices, mask = self._topic_matrices(topics)
+        matrices = matrices ** gamma if gamma != 1 else matrices
+        topic_vector = matrices.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = (np.einsum('tij,tj->ti', matrices, topic_vector) /
+                      (np.linalg.norm(matrices, axis=2) * np.linalg.norm(topic_vector, axis=1)[:, None]))
+        return [float(cosine[t][mask[t]].mean()) if mask[t].any() else float('nan') for t in range(len(mask))]
+
+    def c_v(self, topics, gamma=1):
+        """c_v coherence of a set of topics: the mean of `c_v_per_topic`"""
+        return float(np.mean(self.c_v_per_topic(topics, gamma)))
+
+    def npmi_per_topic(self, topics):
+        """NPMI coherence of every topic: mean NPMI over all pairs of distinct topic words"""
+        matrices, mask = self._topic_matrices(topics)
+        pair_mask = mask[:, :, None] & mask[:, None, :] & ~np.eye(mask.shape[1], dtype=bool)
+        return [float(matrices[t][pair_mask[t]].mean()) if pair_mask[t].any() else float('nan')
+                for t in range(len(mask))]
+
+    def npmi(self, topics):
+        """NPMI coherence of a set of topics (gensim's c_npmi for the index's window size)"""
+        return float(np.mean(self.npmi_per_topic(topics)))
+
+
+def synthetic_corpus(n_docs=20000, vocab_size=5000, seed=0):
+    """Zipf-distributed tokenized documents of varying length, including empty and long ones"""
+    rng = np.random.default_rng(seed)
+    lengths = np.minimum(rng.geometric(1 / 40, n_docs) - 1, 600)
+    words = np.minimum(rng.zipf(1.2, lengths.sum()), vocab_size) - 1
+    vocab = np.array([f'w{i}' for i in range(vocab_size)], dtype=object)
+    return [list(vocab[ids]) for ids in np.split(words, np.cumsum(lengths)[:-1])]
+
+
+def random_topics(tokens, n_topics=50, topn=10, n_candidates=2000, seed=0):
+    """Random topics of `topn` distinct words drawn from the most frequent words of the corpus"""
+    rng = np.random.default_rng(seed)
+    candidates = pd.Series([word for doc in tokens for word in doc]).value_counts().index[:n_candidates]
+    return [list(rng.choice(candidates, topn, replace=False)) for _ in range(n_topics)]
+
+
+def benchmark_coherence(tokens=None, n_runs=20, n_topics=50, topn=10, window_size=WINDOW_SIZE):
+    """
+    Compare gensim's CoherenceModel with the co-occurrence index over many tuning runs.
+
+    Each run scores a different set of `n_topics` topics, as a tuning run with
+    different parameters would. gensim rescans the corpus for every run; the index
+    is built once and then only looks up the topic words. Scores are compared.
+    """
+    import gensim.corpora as corpora
+    from gensim.models.coherencemodel import CoherenceModel
+
+    tokens = tokens if tokens is not None else synthetic_corpus()
+    topic_sets = [random_topics(tokens, n_topics, topn, seed=run) for run in range(n_runs)]
+    dictionary = corpora.Dictionary(tokens)
+
+    t0 = time.time()
+    reference = []
+    for topics in topic_sets:
+        model = CoherenceModel(topics=topics, texts=tokens, dictionary=dictionary, coherence='c_v',
+                               window_size=window_size, processes=1)
+        reference.append(model.get_coherence_per_topic())
+    gensim_seconds = time.time() - t0
+
+    t0 = time.time()
+    index = CoherenceIndex.build(tokens, window_size)
+    build_seconds = time.time() - t0
+    t0 = time.time()
+    scores = [index.c_v_per_topic(topics) for topics in topic_sets]
+    lookup_seconds = time.time() - t0
+
+    max_diff = float(np.max(np.abs(np.array(reference) - np.array(scores))))
+    results = pd.DataFrame([
+        {'engine': 'gensim', 'runs': n_runs, 'topics_per_run': n_topics, 'seconds': round(gensim_seconds, 2)},
+        {'engine': 'index (build)', 'runs': 1, 'topics_per_run': None, 'seconds': round(build_seconds, 2)},
+        {'engine': 'index (lookup)', 'runs': n_runs, 'topics_per_run': n_topics, 'seconds': round(lookup_seconds, 2)},
+    ])
+    print(f"\nc_v of {n_runs} x {n_topics} topics on {len(tokens)} documents "
+          f"({index.num_windows} windows), max abs difference to gensim: {max_diff:.2e}, "
+          f"speed-up {gensim_seconds / (build_seconds + lookup_seconds):.1f}x")
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_coherence()
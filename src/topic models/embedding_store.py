@@ -0,0 +1,187 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scores_dataset import list_yearmonths, read_scores
+
+# BERTopic's default English embedding model
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+
+
+class EmbeddingStore:
+    """
+    Sentence embeddings of the corpus, encoded once and memory-mapped from disk.
+
+    Rows are keyed by the comment `index` of combined_data. BERTopic runs read
+    the rows of their documents with `get` and pass them as `embeddings=`, so
+    only UMAP/HDBSCAN are re-run, not the sentence-transformer.
+
+    Each text variant (e.g. 'raw' comments or the 'preprocessed' texts used in
+    parameter_tuning.ipynb) is stored separately, as `<variant>.embeddings.npy`
+    (float16 by default), `<variant>.index.npy` and `<variant>.json`. If the
+    preprocessing of a variant changes, use a new variant name.
+
+    Parameters:
+    - directory: Directory of the store (e.g. data/embeddings).
+    - variant: Name of the text variant.
+    - model_name: sentence-transformers model used to encode the texts.
+    - dtype: Storage dtype, 'float16' or 'float32'.
+    """
+
+    def __init__(self, directory, variant='raw', model_name=DEFAULT_MODEL, dtype='float16'):
+        self.directory = directory
+        self.variant = variant
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self._model = None
+        os.makedirs(directory, exist_ok=True)
+
+        self.embeddings_path = os.path.join(directory, f'{variant}.embeddings.npy')
+        self.index_path = os.path.join(directory, f'{variant}.index.npy')
+        self.meta_path = os.path.join(directory, f'{variant}.json')
+
+        self.index = np.empty(0, dtype='int64')
+        self.embeddings = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta['model_name'] != model_name:
+                raise ValueError(f"Store {self.meta_path} was encoded with {meta['model_name']}, "
+                                 f"not {model_name}")
+            self.dtype = np.dtype(meta['dtype'])
+            self.index = np.load(self.index_path)
+            self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        self._sort_index()
+
+    @property
+    def model(self):
+        """The sentence-transformer, loaded on first use (also pass it to BERTopic as `embedding_model`)"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def _sort_index(self):
+        self._order = np.argsort(self.index, kind='stable')
+        self._sorted_index = self.index[self._order]
+
+    def __len__(self):
+        return len(self.index)
+
+    def contains(self, indexes):
+        """Boolean mask of the indexes that are already stored"""
+        indexes = np.asarray(indexes, dtype='int64')
+        if len(self._sorted_index) == 0:
+            return np.zeros(len(indexes), dtype=bool)
+        pos = np.minimum(np.searchsorted(self._sorted_index, indexes), len(self._sorted_index) - 1)
+        return self._sorted_index[pos] == indexes
+
+    def get(self, indexes):
+        """Embeddings of the given comment indexes as a float32 array, in the given order"""
+        indexes = np.asarray(indexes, dtype='int64')
+        found = self.contains(indexes)
+        if not found.all():
+            raise KeyError(f"{(~found).sum()} indexes are not in the embedding store, "
+                           f"e.g. {indexes[~found][:5].tolist()}")
+        rows = self._order[np.searchsorted(self._sorted_index, indexes)]
+        # Read the rows in file order, then put them back in the requested order
+        order = np.argsort(rows, kind='stable')
+        result = np.empty((len(rows), self.embeddings.shape[1]), dtype='float32')
+        result[order] = self.embeddings[rows[order]]
+        return result
+
+    def encode(self, texts, batch_size=256):
+        """Encode texts with the sentence-transformer in batches"""
+        return self.model.encode(list(texts), batch_size=batch_size, show_progress_bar=False,
+                                 convert_to_numpy=True)
+
+    def _extend(self, new_index, text_batches, batch_size):
+        """
+        Append the embeddings of new rows to the store.
+
+        A new memory-mapped file of the final size is written next to the old one
+        (old rows are copied in blocks, new rows are encoded batch by batch) and
+        renamed into place once complete.
+        """
+        n_old, n_new = len(self.index), len(new_index)
+        tmp_path = f"{self.embeddings_path}.tmp.npy"
+        out = None
+        start = n_old
+        for texts in text_batches:
+            vectors = self.encode(texts, batch_size).astype(self.dtype)
+            if out is None:
+                out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype,
+                                                shape=(n_old + n_new, vectors.shape[1]))
+                for block in range(0, n_old, 100000):
+                    stop = min(block + 100000, n_old)
+                    out[block:stop] = self.embeddings[block:stop]
+            out[start:start + len(vectors)] = vectors
+            start += len(vectors)
+            print(f"Encoded {start - n_old} of {n_new} new texts")
+        out.flush()
+        del out
+
+        self.embeddings = None
+        os.replace(tmp_path, self.embeddings_path)
+        self.index = np.concatenate([self.index, np.asarray(new_index, dtype='int64')])
+        np.save(f"{self.index_path}.tmp.npy", self.index)
+        os.replace(f"{self.index_path}.tmp.npy", self.index_path)
+        with open(self.meta_path, 'w') as f:
+            json.dump({'model_name': self.model_name, 'dtype': self.dtype.name, 'rows': len(self.index)}, f)
+        self.embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        self._sort_index()
+
+    def add(self, indexes, texts, batch_size=256, chunk_size=50000):
+        """Encode and store the texts whose index is not stored yet"""
+        indexes = np.asarray(indexes, dtype='int64')
+        texts = list(texts)
+        _, first = np.unique(indexes, return_index=True)
+        keep = np.sort(first[~self.contains(indexes[first])])
+        if len(keep) == 0:
+            return 0
+        batches = ([texts[i] for i in keep[start:start + chunk_size]]
+                   for start in range(0, len(keep), chunk_size))
+        self._extend(indexes[keep], batches, batch_size)
+        return len(keep)
+
+    def update(self, dataset_dir, yearmonths=None, preprocess=None, batch_size=256, chunk_size=50000):
+        """
+        Encode the comments of the scores dataset that are not stored yet.
+
+        The dataset is read one month at a time (first only the `index` column to
+        find the missing rows, then the texts of months with missing rows), so the
+        corpus is never loaded at once.
+
+        Parameters:
+        - dataset_dir: The Parquet scores dataset (data/combined_data_scores).
+        - yearmonths: Months to cover (default: all).
+        - preprocess: Optional function applied to a list of texts before encoding
+          (e.g. `preprocess_text` for the 'preprocessed' variant).
+        """
+        yearmonths = yearmonths or list_yearmonths(dataset_dir)
+        missing = {}
+        for yearmonth in yearmonths:
+            index = read_scores(dataset_dir, columns=['index'], yearmonths=[yearmonth])['index'].values
+            index = index[~self.contains(index)]
+            if len(index):
+                missing[yearmonth] = index
+        n_new = sum(len(index) for index in missing.values())
+        if n_new == 0:
+            print(f"Embedding store '{self.variant}' is up to date ({len(self)} rows)")
+            return 0
+        print(f"Encoding {n_new} new texts from {len(missing)} month(s)...")
+
+        def text_batches():
+            for yearmonth, index in missing.items():
+                df = read_scores(dataset_dir, columns=['index', 'text'], yearmonths=[yearmonth])
+                texts = df.set_index('index').loc[index, 'text'].astype(str).tolist()
+                if preprocess is not None:
+                    texts = list(preprocess(texts))
+                for start in range(0, len(texts), chunk_size):
+                    yield texts[start:start + chunk_size]
+
+        self._extend(np.concatenate(list(missing.values())), text_batches(), batch_size)
+        return n_new
@@ -0,0 +1,240 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'dashboard', 'scripts'))
+from cluster_store import write_cluster_store
+from scores_dataset import list_yearmonths
+from topic_scheduler import combine_parts, fit_month
+
+# One row per (yearmonth, local topic) that was added to the registry
+REGISTRY_COLUMNS = ['yearmonth', 'local_topic', 'topic_id', 'similarity', 'keywords', 'count',
+                    'toxicity_sum', 'toxicity_docs']
+
+
+def load_registry(registry_dir):
+    """Load the topic registry: the per-month topic rows and the embeddings of the global topics"""
+    topics_path = os.path.join(registry_dir, 'topic_months.csv')
+    if not os.path.exists(topics_path):
+        return pd.DataFrame(columns=REGISTRY_COLUMNS), None
+    topic_months = pd.read_csv(topics_path, dtype={'yearmonth': str}, keep_default_na=False)
+    return topic_months, np.load(os.path.join(registry_dir, 'topic_embeddings.npy'))
+
+
+def save_registry(registry_dir, topic_months, embeddings):
+    """Write the registry files atomically"""
+    os.makedirs(registry_dir, exist_ok=True)
+    embeddings_path = os.path.join(registry_dir, 'topic_embeddings.npy')
+    np.save(f"{embeddings_path}.tmp.npy", embeddings)
+    os.replace(f"{embeddings_path}.tmp.npy", embeddings_path)
+    topics_path = os.path.join(registry_dir, 'topic_months.csv')
+    topic_months.to_csv(f"{topics_path}.tmp", index=False)
+    os.replace(f"{topics_path}.tmp", topics_path)
+
+
+def match_topics(topic_embeddings, registry_embeddings, min_similarity=0.7, active=None):
+    """
+    Map the topics of a month model onto the global topics.
+
+    Same rule as `BERTopic.merge_models`: a topic joins the most similar global
+    topic (cosine similarity of topic embeddings) if that similarity is at least
+    `min_similarity`, otherwise it becomes a new global topic. Global topics keep
+    the embedding they were first seen with, so their IDs never change. Only the
+    global topics in the `active` mask (default: all) can be joined.
+
+    Returns the global topic IDs, the similarities and the updated registry embeddings.
+    """
+    topic_embeddings = np.asarray(topic_embeddings, dtype='float32')
+    unit = topic_embeddings / np.linalg.norm(topic_embeddings, axis=1, keepdims=True)
+    if registry_embeddings is None or len(registry_embeddings) == 0:
+        registry_embeddings = np.empty((0, topic_embeddings.shape[1]), dtype='float32')
+        similarity = np.zeros(len(unit), dtype='float32')
+        best = np.zeros(len(unit), dtype='int64')
+    else:
+        registry_unit = registry_embeddings / np.linalg.norm(registry_embeddings, axis=1, keepdims=True)
+        sim_matrix = unit @ registry_unit.T
+        if active is not None:
+            sim_matrix[:, ~active] = -np.inf
+        best = sim_matrix.argmax(axis=1)
+        similarity = sim_matrix.max(axis=1)
+
+    is_new = similarity < min_similarity
+    topic_ids = best.copy()
+    topic_ids[is_new] = len(registry_embeddings) + np.arange(is_new.sum())
+    similarity[is_new] = 1.0
+    registry_embeddings = np.vstack([registry_embeddings, topic_embeddings[is_new]])
+    return topic_ids, similarity, registry_embeddings
+
+
+def month_topics(df_final, topic_model):
+    """Topic rows of a fitted month: local topic, keywords, count, toxicity and topic embedding"""
+    topic_info = topic_model.get_topic_info()
+    topic_info = topic_info[topic_info['Topic'] != -1]
+    # topic_embeddings_ rows follow the sorted topic IDs, including the outlier topic -1
+    rows = {topic: row for row, topic in enumerate(sorted(topic_model.get_topics()))}
+    embeddings = np.asarray(topic_model.topic_embeddings_)[[rows[topic] for topic in topic_info['Topic']]]
+
+    toxicity = df_final.groupby('Topic')['average_toxicity_score'].agg(['sum', 'count'])
+    topics = pd.DataFrame({
+        'local_topic': topic_info['Topic'].values,
+        'keywords': [' '.join(words) for words in topic_info['Representation']],
+        'count': topic_info['Count'].values,
+    })
+    topics['toxicity_sum'] = toxicity['sum'].reindex(topics['local_topic']).fillna(0).values
+    topics['toxicity_docs'] = toxicity['count'].reindex(topics['local_topic']).fillna(0).astype('int64').values
+    return topics, embeddings
+
+
+def add_month(topic_months, registry_embeddings, yearmonth, topics, embeddings, min_similarity=0.7):
+    """
+    Add (or replace) the topics of one month in the registry.
+
+    Global topics without members (left by a refitted month) are never matched
+    again, so later months cannot join a topic that no longer exists; their IDs
+    are not reused. A refitted month may reclaim the topics it created before,
+    which are then re-anchored on its new topic embeddings.
+
+    Returns the updated registry and a mapping from local to global topic IDs.
+    """
+    refit = topic_months['yearmonth'] == yearmonth
+    previous = set(topic_months.loc[refit, 'topic_id'].astype('int64'))
+    topic_months = topic_months[~refit]
+    n_before = 0 if registry_embeddings is None else len(registry_embeddings)
+    active = np.zeros(n_before, dtype=bool)
+    active[list(previous | set(topic_months['topic_id'].astype('int64')))] = True
+    topic_ids, similarity, registry_embeddings = match_topics(embeddings, registry_embeddings, min_similarity,
+                                                              active)
+
+    # Re-anchor the reclaimed topics whose only members were the month's old topics
+    orphans = previous - set(topic_months['topic_id'].astype('int64'))
+    for row in np.argsort(similarity):  # the most similar topic of the month is written last
+        if topic_ids[row] in orphans:
+            registry_embeddings[topic_ids[row]] = embeddings[row]
+    topics = topics.assign(yearmonth=yearmonth, topic_id=topic_ids, similarity=similarity.round(4))
+    if len(topic_months):
+        topic_months = pd.concat([topic_months, topics[REGISTRY_COLUMNS]], ignore_index=True)
+    else:
+        topic_months = topics[REGISTRY_COLUMNS].reset_index(drop=True)
+    mapping = dict(zip(topics['local_topic'], topic_ids))
+    n_new = len(registry_embeddings) - n_before
+    print(f"{yearmonth}: {len(topics)} topics, {len(topics) - n_new} matched to existing topics, "
+          f"{n_new} new ({len(registry_embeddings)} global topics)")
+    return topic_months, registry_embeddings, mapping
+
+
+def cluster_table(topic_months):
+    """
+    Derive topic_registry_clusters.csv from the registry, one row per global topic
+    seen in at least two month topics, with the columns of topic_clusters.csv.
+
+    These are not the semantic clusters of topic_clustering.ipynb: `cluster_id`
+    is a global topic ID, `topic_indices` are "yearmonth:topic" strings and the
+    keywords are the topics' Representation terms, without the min_count/top_n
+    filtering. They are written next to topic_clusters.csv, never over it.
+    """
+    clusters = []
+    for topic_id, members in topic_months.groupby('topic_id', sort=True):
+        if len(members) < 2:
+            continue
+        members = members.sort_values('yearmonth')
+        unique_keywords = set(' '.join(members['keywords']).split())
+        monthly_counts = members.groupby('yearmonth')['count'].sum()
+        monthly_toxicity = members.groupby('yearmonth')[['toxicity_sum', 'toxicity_docs']].sum()
+        years = sorted(members['yearmonth'].str[:4].unique())
+        clusters.append({
+            'cluster_id': topic_id,
+            'size': len(members),
+            'total_posts': members['count'].sum(),
+            'unique_keywords': list(unique_keywords),
+            'topic_diversity': len(unique_keywords) / len(members),
+            'temporal_evolution': {
+                year: {f"{year}-{month:02d}": {'post_count': monthly_counts.get(f"{year}-{month:02d}", 0)}
+                       for month in range(1, 13)}
+                for year in years
+            },
+            'toxicity_evolution': {
+                year: {yearmonth: {'avg_toxicity': round(stats['toxicity_sum'] / max(stats['toxicity_docs'], 1), 4),
+                                   'post_count': int(stats['toxicity_docs'])}
+                       for yearmonth, stats in monthly_toxicity[monthly_toxicity.index.str.startswith(year)].iterrows()}
+                for year in years
+            },
+            'avg_toxicity': members['toxicity_sum'].sum() / max(members['toxicity_docs'].sum(), 1),
+            'sample_topics': members.nlargest(3, 'count')['keywords'].tolist(),
+            'topic_indices': [f"{yearmonth}:{topic}" for yearmonth, topic in zip(members['yearmonth'],
+                                                                                  members['local_topic'])]
+        })
+    return pd.DataFrame(clusters)
+
+
+def update_topics(dataset_dir, registry_dir, output_dir, yearmonths=None, embedding_store=None,
+                  min_similarity=0.7, fit=fit_month):
+    """
+    Incrementally add new months to the topic registry.
+
+    Only the months that are not in the registry yet (or the given `yearmonths`)
+    are fitted, one BERTopic model per month, so the cost of a month depends only
+    on its own volume. Their topics are matched onto the persisted global topics
+    (see `match_topics`) and every comment gets a stable `topic_id` next to the
+    month's own `Topic`. The month is written to `<output_dir>/topic_registry_parts/`
+    (not `topic_parts/`, whose files have no `topic_id`), `topics_<year>.csv` of
+    the affected years is reassembled once all months of the year are in the
+    registry, and `topic_registry_clusters.csv` (and the Parquet
+    `topic_registry_cluster_store/`) is derived from the registry.
+
+    topic_clusters.csv and cluster_store/, read by the dashboard, home_topic.py and
+    topic_network.ipynb, are not updated: they still come from a full
+    topic_clustering.ipynb run over the new topics_<year>.csv files.
+
+    Parameters:
+    - dataset_dir: The Parquet dataset of scored comments, partitioned by yearmonth.
+    - registry_dir: Directory of the topic registry (e.g. data/topic_registry).
+    - output_dir: Directory of topics_<year>.csv, topic_registry_clusters.csv and topic_registry_cluster_store/.
+    - yearmonths: Months to (re)fit (default: the months missing from the registry).
+    - embedding_store: Optional `EmbeddingStore` with precomputed embeddings of the comments.
+    - min_similarity: Minimum topic similarity to join an existing global topic.
+    - fit: Function fitting one month, `fit(dataset_dir, yearmonth, embedding_store, return_model=True)`.
+    """
+    topic_months, registry_embeddings = load_registry(registry_dir)
+    all_months = list_yearmonths(dataset_dir)
+    if yearmonths is None:
+        done = set(topic_months['yearmonth'])
+        yearmonths = [yearmonth for yearmonth in all_months if yearmonth not in done]
+    # Months are added in time order, so global topics are numbered by first appearance
+    yearmonths = sorted(yearmonths)
+    print(f"{len(yearmonths)} month(s) to add to the topic registry")
+
+    parts_dir = os.path.join(output_dir, 'topic_registry_parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    for yearmonth in yearmonths:
+        df_final, topic_model = fit(dataset_dir, yearmonth, embedding_store, return_model=True)
+        topics, embeddings = month_topics(df_final, topic_model)
+        topic_months, registry_embeddings, mapping = add_month(topic_months, registry_embeddings, yearmonth,
+                                                               topics, embeddings, min_similarity)
+        df_final['topic_id'] = df_final['Topic'].map(mapping).fillna(-1).astype('int64')
+
+        part_path = os.path.join(parts_dir, f'{yearmonth}.csv')
+        df_final.to_csv(f"{part_path}.tmp", index=False)
+        os.replace(f"{part_path}.tmp", part_path)
+        # Save after every month, so an interrupted update resumes at the next month
+        save_registry(registry_dir, topic_months, registry_embeddings)
+
+    for year in sorted({yearmonth[:4] for yearmonth in yearmonths}):
+        year_months = [yearmonth for yearmonth in all_months if yearmonth.startswith(year)]
+        part_paths = [os.path.join(parts_dir, f'{yearmonth}.csv') for yearmonth in year_months]
+        if any(not os.path.exists(path) for path in part_paths):
+            # Keep the existing topics_<year>.csv rather than replacing it with part of the year
+            print(f"topics_{year}.csv not written: some months of {year} are not in the registry")
+            continue
+        combine_parts(part_paths, os.path.join(output_dir, f'topics_{year}.csv'))
+        print(f"topics_{year}.csv written ({len(year_months)} months)")
+
+    clusters = cluster_table(topic_months)
+    clusters_path = os.path.join(output_dir, 'topic_registry_clusters.csv')
+    clusters.to_csv(f"{clusters_path}.tmp", index=False)
+    os.replace(f"{clusters_path}.tmp", clusters_path)
+    print(f"topic_registry_clusters.csv written ({len(clusters)} clusters)")
+    write_cluster_store(clusters, os.path.join(output_dir, 'topic_registry_cluster_store'))
+    return clusters
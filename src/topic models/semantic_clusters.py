@@ -0,0 +1,156 @@
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.neighbors import NearestNeighbors
+
+
+def topic_vectors(keywords):
+    """TF-IDF vectors (L2-normalized rows) of the topic keyword strings, as in topic_clustering.ipynb"""
+    vectorizer = TfidfVectorizer(
+        stop_words='english',
+        ngram_range=(1, 2),  # Include bigrams
+        min_df=2,  # Minimum document frequency
+        max_df=0.9  # Maximum document frequency
+    )
+    vectors = vectorizer.fit_transform(keywords)
+    return vectors, vectorizer.get_feature_names_out()
+
+
+def knn_graph(vectors, n_neighbors=10, min_similarity=0.6, block_memory=10_000_000):
+    """
+    Thresholded cosine kNN graph of L2-normalized rows, as a symmetric scipy sparse matrix.
+
+    Every topic is linked to its `n_neighbors - 1` most similar other topics whose
+    similarity is above `min_similarity`. Similarities are sparse products of row
+    blocks with all rows (at most about `block_memory` similarities at a time);
+    only the entries above the threshold are ranked to select the neighbours.
+    """
+    vectors = sparse.csr_matrix(vectors)
+    n_topics = vectors.shape[0]
+    k = min(n_neighbors - 1, n_topics - 1)
+    if k <= 0:
+        return sparse.csr_matrix((n_topics, n_topics))
+    block_size = max(1, block_memory // max(n_topics, 1))
+    transposed = vectors.T.tocsc()
+
+    rows, cols, weights = [], [], []
+    for start in range(0, n_topics, block_size):
+        similarities = (vectors[start:start + block_size] @ transposed).tocoo()
+        row, col, weight = similarities.row + start, similarities.col, similarities.data
+        # Keep the similar pairs, excluding each topic itself
+        keep = (weight > min_similarity) & (row != col)
+        row, col, weight = row[keep], col[keep], weight[keep]
+        # Rank the neighbours of every topic by similarity and keep the k best
+        order = np.lexsort((-weight, row))
+        row, col, weight = row[order], col[order], weight[order]
+        rank = np.arange(len(row)) - np.searchsorted(row, row)
+        rows.append(row[rank < k])
+        cols.append(col[rank < k])
+        weights.append(weight[rank < k])
+
+    graph = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(n_topics, n_topics))
+    # An edge exists if either topic is among the other's neighbours
+    return graph.maximum(graph.T).tocsr()
+
+
+def find_semantic_clusters(topics_df, min_similarity=0.6, n_neighbors=10, resolution=1, seed=42):
+    """
+    Cluster topics by the similarity of their keywords.
+
+    Builds the thresholded kNN graph of the TF-IDF vectors of `clean_keywords`
+    directly as a sparse matrix and runs Louvain community detection on it.
+
+    Returns the communities (sets of row positions in `topics_df`, largest first),
+    the graph (with year, keywords and count node attributes) and the TF-IDF
+    feature names, like the notebook's original function.
+
+    Parameters:
+    - topics_df: Topics with `year`, `clean_keywords` and `count` columns.
+    - min_similarity: Minimum cosine similarity of an edge.
+    - n_neighbors: Neighbours per topic, including the topic itself.
+    - resolution: Louvain resolution (higher gives smaller communities).
+    - seed: Louvain random seed.
+    """
+    vectors, feature_names = topic_vectors(topics_df['clean_keywords'])
+    G = nx.from_scipy_sparse_array(knn_graph(vectors, n_neighbors, min_similarity))
+    nx.set_node_attributes(G, dict(enumerate(topics_df['year'])), 'year')
+    nx.set_node_attributes(G, dict(enumerate(topics_df['clean_keywords'])), 'keywords')
+    nx.set_node_attributes(G, dict(enumerate(topics_df['count'])), 'count')
+
+    communities = nx.community.louvain_communities(G, weight='weight', resolution=resolution, seed=seed)
+    communities = sorted(communities, key=len, reverse=True)
+    return communities, G, feature_names
+
+
+def legacy_find_semantic_clusters(topics_df, min_similarity=0.6):
+    """The previous implementation: brute-force kNN, per-node graph building and greedy modularity"""
+    vectors, feature_names = topic_vectors(topics_df['clean_keywords'])
+    nn = NearestNeighbors(n_neighbors=min(10, len(topics_df)), metric='cosine', algorithm='brute')
+    nn.fit(vectors)
+    distances, indices = nn.kneighbors(vectors)
+
+    G = nx.Graph()
+    for i in range(len(topics_df)):
+        G.add_node(i, year=topics_df.iloc[i]['year'], keywords=topics_df.iloc[i]['clean_keywords'],
+                   count=topics_df.iloc[i]['count'])
+    for i in range(len(indices)):
+        for j, dist in zip(indices[i][1:], distances[i][1:]):
+            similarity = 1 - dist
+            if similarity > min_similarity:
+                G.add_edge(i, j, weight=similarity)
+
+    communities = nx.community.greedy_modularity_communities(G)
+    return communities, G, feature_names
+
+
+def synthetic_topic_keywords(n_topics, n_themes=None, seed=0):
+    """Topics whose keywords mix the words of a main theme, a second theme and a random noise word"""
+    rng = np.random.default_rng(seed)
+    n_themes = n_themes or max(2, n_topics // 50)
+    themes = rng.integers(0, 3000, (n_themes, 7))
+    theme = rng.integers(0, n_themes, (n_topics, 2))
+    keywords = [' '.join(sorted({f'w{w}' for w in np.concatenate([rng.choice(themes[main], 4, replace=False),
+                                                                   rng.choice(themes[second], 2, replace=False),
+                                                                   rng.integers(0, 3000, 1)])}))
+                for main, second in theme]
+    return pd.DataFrame({'year': rng.choice(['2020', '2021', '2022', '2023'], n_topics),
+                         'clean_keywords': keywords, 'count': rng.integers(100, 5000, n_topics)})
+
+
+def benchmark_clustering(sizes=(800, 2000, 8000, 20000), min_similarity=0.3, legacy_max=8000):
+    """
+    Time the sparse kNN + Louvain clustering against the previous implementation.
+
+    The previous implementation is only run up to `legacy_max` topics. Modularity
+    of both partitions is reported on the same (new) graph. The default threshold
+    is lower than the notebook's so the synthetic graphs are dense.
+    """
+    results = []
+    for n_topics in sizes:
+        topics_df = synthetic_topic_keywords(n_topics)
+        t0 = time.time()
+        communities, G, _ = find_semantic_clusters(topics_df, min_similarity)
+        seconds = time.time() - t0
+        results.append({'implementation': 'sparse kNN + Louvain', 'topics': n_topics, 'edges': G.number_of_edges(),
+                        'communities': len(communities), 'seconds': round(seconds, 2),
+                        'modularity': round(nx.community.modularity(G, communities), 4)})
+        if n_topics <= legacy_max:
+            t0 = time.time()
+            legacy_communities, legacy_G, _ = legacy_find_semantic_clusters(topics_df, min_similarity)
+            seconds = time.time() - t0
+            results.append({'implementation': 'brute kNN + greedy modularity', 'topics': n_topics,
+                            'edges': legacy_G.number_of_edges(), 'communities': len(legacy_communities),
+                            'seconds': round(seconds, 2),
+                            'modularity': round(nx.community.modularity(G, legacy_communities), 4)})
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_clustering()
@@ -0,0 +1,600 @@
+import ast
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+
+from embedding_store import DEFAULT_MODEL
+
+
+def _literal(value):
+    """Parse a stringified list/dict of topic_clusters.csv (values already parsed are returned as is)"""
+    return ast.literal_eval(value) if isinstance(value, str) else value
+
+
+def evolution_arrays(evolutions, field):
+    """
+    Dense clusters x months arrays of nested `{year: {'YYYY-MM': {field: value}}}` evolutions
+    (the temporal_evolution and toxicity_evolution columns of topic_clusters.csv).
+
+    Returns the sorted months, the values (0 where a cluster has no entry for a
+    month) and the mask of the months each cluster has an entry for.
+    """
+    entries = [{month: data[field] for year in evolution.values() for month, data in year.items()}
+               for evolution in evolutions]
+    months = sorted(set().union(*entries))
+    columns = {month: column for column, month in enumerate(months)}
+    values = np.zeros((len(entries), len(months)))
+    present = np.zeros((len(entries), len(months)), dtype=bool)
+    for row, entry in enumerate(entries):
+        cols = [columns[month] for month in entry]
+        values[row, cols] = list(entry.values())
+        present[row, cols] = True
+    return np.array(months, dtype=object), values, present
+
+
+def temporal_similarity(post_counts, has_month, left, right, block_size=1_000):
+    """
+    Temporal similarity of the cluster pairs (left[k], right[k]), from the arrays of `evolution_arrays`.
+
+    Same measure as the pairwise version: over the months both clusters have,
+    each month with posts scores its volume ratio, activity overlap and (if the
+    previous shared month had posts) the similarity of the month-on-month
+    trends. The final score mixes the average monthly score (0.5), the
+    similarity of the total volumes (0.3) and the overlap of the active months
+    (0.2). Pairs are processed in blocks of `block_size`.
+    """
+    left, right = np.asarray(left, dtype='int64'), np.asarray(right, dtype='int64')
+    active = has_month & (post_counts > 0)
+    month_positions = np.arange(post_counts.shape[1])
+    similarity = np.zeros(len(left))
+
+    for start in range(0, len(left), block_size):
+        a, b = left[start:start + block_size], right[start:start + block_size]
+        shared = has_month[a] & has_month[b]
+        vol1 = np.where(shared, post_counts[a], 0)
+        vol2 = np.where(shared, post_counts[b], 0)
+
+        # Activity overlap over all months of the two clusters
+        activity_overlap = ((active[a] & active[b]).sum(axis=1)
+                            / np.maximum((active[a] | active[b]).sum(axis=1), 1))[:, None]
+
+        # Overall volume similarity
+        total1, total2 = vol1.sum(axis=1), vol2.sum(axis=1)
+        total_max = np.maximum(total1, total2)
+        volume_similarity = np.where(total_max > 0, np.minimum(total1, total2) / np.where(total_max > 0, total_max, 1), 0)
+
+        # Previous shared month of every month (-1 before the first one)
+        previous = np.maximum.accumulate(np.where(shared, month_positions, -1), axis=1)
+        previous = np.concatenate([np.full((len(a), 1), -1), previous[:, :-1]], axis=1)
+        prev1 = np.take_along_axis(vol1, np.maximum(previous, 0), axis=1)
+        prev2 = np.take_along_axis(vol2, np.maximum(previous, 0), axis=1)
+
+        high = np.maximum(vol1, vol2)
+        vol_ratio = np.minimum(vol1, vol2) / np.where(high > 0, high, 1)
+        trend_sim = 1 - np.minimum(np.abs((vol1 - prev1) / (prev1 + 1) - (vol2 - prev2) / (prev2 + 1)), 1)
+        has_trend = (previous >= 0) & ((prev1 > 0) | (prev2 > 0))
+        month_similarity = np.where(has_trend,
+                                    0.4 * vol_ratio + 0.4 * trend_sim + 0.2 * activity_overlap,
+                                    0.6 * vol_ratio + 0.4 * activity_overlap)
+
+        # Months where neither cluster has posts are skipped
+        scored = shared & (high > 0)
+        n_scored = scored.sum(axis=1)
+        mean_similarity = np.where(scored, month_similarity, 0).sum(axis=1) / np.maximum(n_scored, 1)
+        block_similarity = (0.5 * mean_similarity +   # Average monthly similarities
+                            0.3 * volume_similarity +  # Overall volume similarity
+                            0.2 * activity_overlap[:, 0])  # Activity period overlap
+        similarity[start:start + block_size] = np.where(n_scored > 0, block_similarity, 0)
+    return similarity
+
+
+def temporal_similarity_matrix(post_counts, has_month, block_size=1_000):
+    """Temporal similarity of every pair of clusters, as a symmetric matrix"""
+    n_clusters = len(post_counts)
+    left, right = np.triu_indices(n_clusters, k=1)
+    matrix = np.zeros((n_clusters, n_clusters))
+    matrix[left, right] = temporal_similarity(post_counts, has_month, left, right, block_size)
+    return matrix + matrix.T
+
+
+def co_toxic_months(toxicity, has_month, rows=None, threshold=0.1):
+    """
+    Months in which both clusters of a pair are above the toxicity `threshold`,
+    and months both clusters have, for the `rows` clusters (default: all) against all clusters.
+
+    Both counts are products of the clusters x months masks from `evolution_arrays`.
+    """
+    rows = np.arange(len(toxicity)) if rows is None else np.asarray(rows)
+    toxic = (has_month & (toxicity > threshold)).astype(float)
+    present = has_month.astype(float)
+    return toxic[rows] @ toxic.T, present[rows] @ present.T
+
+
+class EnhancedTopicNetworkBuilder:
+    """
+    Network of topic clusters linked by semantic and temporal similarity.
+
+    Semantic similarity mixes the keyword overlap of two clusters with the cosine
+    similarity of their (domain-enriched) keyword embeddings. Every distinct
+    keyword string is encoded once and cached by its content, and all pairs are
+    compared at once as matrices.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL):
+        """Initialize with transformer model and domain knowledge"""
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        # Keyword string -> embedding
+        self.embedding_cache = {}
+
+        # Domain-specific knowledge
+        self.domain_terms = {
+            'lgbtq': {
+                'identity': {'lgbt', 'lgbtq', 'feminist', 'queer', 'gay', 'lesbian', 'bisexual', 'trans'},
+                'rights': {'rights', 'equality', 'discrimination', 'advocacy', 'activist', 'representation'},
+                'policy': {'policy', 'legislation', 'law', 'repeal', 'reform', 'section', 'amendment'},
+                'social': {'community', 'support', 'acceptance', 'ethnicity', 'diversity', 'race'},
+                'issues': {'discrimination', 'prejudice', 'homophobia', 'transphobia', 'bias', 'stigma'}
+            },
+            'law_enforcement': {
+                'police': {'police', 'cop', 'officer', 'patrol', 'law', 'enforcement'},
+                'crime': {'crime', 'criminal', 'arrest', 'suspect', 'offense', 'violation'},
+                'legal': {'court', 'justice', 'prosecution', 'sentence', 'jail', 'prison'},
+                'safety': {'safety', 'security', 'protection', 'emergency', 'prevention'},
+                'investigation': {'investigation', 'evidence', 'report', 'witness', 'surveillance'}
+            }
+        }
+
+    def enrich_keywords(self, keywords, domain):
+        """Enrich keywords with domain-specific terms (sorted, so equal sets give the same string)"""
+        keywords_set = set(keywords)
+        enriched_terms = set()
+
+        if domain in self.domain_terms:
+            for category, terms in self.domain_terms[domain].items():
+                if keywords_set & terms:  # If there's any overlap
+                    enriched_terms.update(terms)
+
+        return sorted(keywords_set | enriched_terms)
+
+    def detect_domain(self, keywords):
+        """Domain of a cluster from its keywords (None if it has no identity or police terms)"""
+        if any(kw in self.domain_terms['lgbtq']['identity'] for kw in keywords):
+            return 'lgbtq'
+        if any(kw in self.domain_terms['law_enforcement']['police'] for kw in keywords):
+            return 'law_enforcement'
+        return None
+
+    def encode(self, texts):
+        """Embeddings of keyword strings; the strings not in the cache are encoded in one batch"""
+        missing = list(dict.fromkeys(text for text in texts if text not in self.embedding_cache))
+        if missing:
+            embeddings = self.model.encode(missing, show_progress_bar=len(missing) > 1000)
+            self.embedding_cache.update(zip(missing, embeddings))
+        return np.array([self.embedding_cache[text] for text in texts])
+
+    def semantic_similarity_matrix(self, keyword_lists, domains):
+        """
+        Semantic similarity of every pair of clusters.
+
+        Same measure as `calculate_semantic_similarity`: 0.3 * keyword overlap
+        + 0.7 * embedding cosine similarity, times 1.3 for clusters of the same
+        domain. The overlap is computed from a sparse cluster-by-keyword matrix.
+
+        Parameters:
+        - keyword_lists: Keywords of each cluster.
+        - domains: Domain of each cluster (or None).
+        """
+        keyword_lists = [self.enrich_keywords(keywords, domain) if domain else list(keywords)
+                         for keywords, domain in zip(keyword_lists, domains)]
+
+        embeddings = self.encode([' '.join(keywords) for keywords in keyword_lists])
+        embedding_sim = cosine_similarity(embeddings)
+
+        # Shared keywords of every pair / size of the larger keyword set
+        vocabulary = {}
+        rows, cols = [], []
+        for row, keywords in enumerate(keyword_lists):
+            for keyword in set(keywords):
+                rows.append(row)
+                cols.append(vocabulary.setdefault(keyword, len(vocabulary)))
+        incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                      shape=(len(keyword_lists), len(vocabulary)))
+        shared = (incidence @ incidence.T).toarray()
+        sizes = np.diff(incidence.indptr)
+        overlap = shared / np.maximum(np.maximum.outer(sizes, sizes), 1)
+
+        # Add more weight to domain-specific terms
+        domains = np.array(domains, dtype=object)
+        same_domain = (domains[:, None] == domains[None, :]) & (domains != None)[:, None]  # noqa: E711
+        domain_boost = np.where(same_domain, 1.3, 1.0)
+
+        return (0.3 * overlap + 0.7 * embedding_sim) * domain_boost
+
+    def calculate_semantic_similarity(self, kw1, kw2, domain1=None, domain2=None):
+        """Calculate semantic similarity of two clusters with improved domain awareness"""
+        return float(self.semantic_similarity_matrix([kw1, kw2], [domain1, domain2])[0, 1])
+
+    def calculate_temporal_similarity(self, temp1, temp2):
+        """Calculate temporal similarity with enhanced pattern matching (see `temporal_similarity`)"""
+        _, post_counts, has_month = evolution_arrays([temp1, temp2], 'post_count')
+        return float(temporal_similarity(post_counts, has_month, [0], [1])[0])
+
+    def create_network(self, cluster_df, min_semantic_sim=0.2, min_temporal_sim=0.2, min_combined_sim=0.25):
+        """
+        Create network with enhanced similarity measures.
+
+        The semantic similarity of all pairs comes from one batched encode and
+        matrix operations; the temporal similarity is computed from the clusters x
+        months post counts for the pairs that pass the semantic threshold.
+        """
+        G = nx.Graph()
+
+        nodes, keyword_lists, temporals, domains = [], [], [], []
+        for row in cluster_df.itertuples(index=False):
+            # Stringified columns of a topic_clusters.csv read with pd.read_csv are parsed as literals, never evaluated
+            keywords = _literal(row.unique_keywords)
+            temporal = _literal(row.temporal_evolution)
+            # Determine domain based on keywords
+            domain = self.detect_domain(keywords)
+
+            nodes.append(row.cluster_id)
+            keyword_lists.append(keywords)
+            temporals.append(temporal)
+            domains.append(domain)
+            G.add_node(row.cluster_id,
+                       keywords=keywords,
+                       posts=row.total_posts,
+                       temporal=temporal,
+                       toxicity=row.avg_toxicity,
+                       domain=domain)
+
+        print("Creating cluster embeddings...")
+        semantic = self.semantic_similarity_matrix(keyword_lists, domains)
+
+        # More strict semantic requirement for unrelated domains
+        domain_array = np.array(domains, dtype=object)
+        min_semantic = np.where(domain_array[:, None] == domain_array[None, :],
+                                min_semantic_sim, min_semantic_sim * 1.2)
+        candidates = np.argwhere(np.triu(semantic >= min_semantic, k=1))
+
+        print(f"Calculating temporal similarities of {len(candidates)} semantically similar pairs...")
+        _, post_counts, has_month = evolution_arrays(temporals, 'post_count')
+        left, right = candidates[:, 0], candidates[:, 1]
+        semantic_sim = semantic[left, right]
+        temporal_sim = temporal_similarity(post_counts, has_month, left, right)
+        # Use weighted average with stronger emphasis on semantic similarity
+        combined_sim = (0.8 * semantic_sim + 0.2 * temporal_sim)
+        keep = (temporal_sim >= min_temporal_sim) & (combined_sim >= min_combined_sim)
+        G.add_edges_from((nodes[i], nodes[j], {'weight': float(combined), 'semantic_sim': float(semantic_ij),
+                                               'temporal_sim': float(temporal_ij)})
+                         for i, j, combined, semantic_ij, temporal_ij
+                         in zip(left[keep], right[keep], combined_sim[keep], semantic_sim[keep], temporal_sim[keep]))
+
+        print(f"\nNetwork created with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
+        print(f"Network density: {nx.density(G):.3f}")
+
+        return G
+
+
+def create_and_analyze_network(cluster_df, builder=None):
+    """Create network and analyze specific topics"""
+    builder = builder or EnhancedTopicNetworkBuilder()
+    G = builder.create_network(
+        cluster_df,
+        min_semantic_sim=0.2,
+        min_temporal_sim=0.2,
+        min_combined_sim=0.25
+    )
+    return G
+
+
+def analyze_topic_narrative(G, focus_node, cluster_df, threshold=0.1):
+    """
+    Create a narrative analysis of topic relationships and toxicity patterns.
+
+    The months in which the focus topic and each connected topic are both above
+    the toxicity `threshold` come from the clusters x months toxicity arrays.
+    """
+    focus_data = G.nodes[focus_node]
+
+    print(f"\nTopic Impact Analysis: {', '.join(focus_data['keywords'][:3])}")
+    print("=" * 50)
+
+    # Overall statistics
+    print("\nKey Metrics:")
+    print(f"- Total Posts: {focus_data['posts']:,}")
+    print(f"- Overall Toxicity Level: {focus_data['toxicity']:.4f}")
+    print(f"- Connected Topics: {len(list(G.neighbors(focus_node)))}")
+
+    # Toxicity of every cluster and month; rows follow cluster_df
+    months, toxicity, has_month = evolution_arrays(cluster_df['toxicity_evolution'], 'avg_toxicity')
+    rows = {cluster_id: row for row, cluster_id in reversed(list(enumerate(cluster_df['cluster_id'])))}
+    focus_row = rows[focus_node]
+    high_toxicity_months, shared_months = co_toxic_months(toxicity, has_month, [focus_row], threshold)
+    both_toxic = has_month & (toxicity > threshold) & has_month[focus_row] & (toxicity[focus_row] > threshold)
+
+    # Get connected topics with their relationships
+    connections = []
+    for neighbor in G.neighbors(focus_node):
+        edge_data = G.get_edge_data(focus_node, neighbor)
+        neighbor_data = G.nodes[neighbor]
+        row = rows[neighbor]
+
+        # Periods in which both topics show elevated toxicity
+        toxic_periods = [{
+            'period': f"{months[column][:4]}-{months[column]}",
+            'main_toxicity': float(toxicity[focus_row, column]),
+            'related_toxicity': float(toxicity[row, column])
+        } for column in np.flatnonzero(both_toxic[row])]
+
+        connections.append({
+            'node_id': neighbor,
+            'keywords': neighbor_data['keywords'][:5],
+            'toxicity': neighbor_data['toxicity'],
+            'semantic_sim': edge_data['semantic_sim'],
+            'temporal_sim': edge_data['temporal_sim'],
+            'toxic_periods': toxic_periods,
+            'toxicity_overlap': float(high_toxicity_months[0, row] / max(shared_months[0, row], 1))
+        })
+
+    # Sort connections by combined score (semantic + temporal similarity)
+    for conn in connections:
+        conn['combined_score'] = (conn['semantic_sim'] + conn['temporal_sim']) / 2
+
+    connections.sort(key=lambda x: x['combined_score'], reverse=True)
+
+    print("\nMost Significant Topic Relationships:")
+    print("=" * 50)
+
+    for i, conn in enumerate(connections[:5], 1):
+        print(f"\n{i}. Related Topic: {', '.join(conn['keywords'][:3])}")
+        print(f"   Relationship Strength:")
+        print(f"   - Topic Similarity: {conn['semantic_sim']:.2%}")
+        print(f"   - Activity Overlap: {conn['temporal_sim']:.2%}")
+        print(f"   - Overall Toxicity: {conn['toxicity']:.4f}")
+
+        if conn['toxic_periods']:
+            print("\n   Key Periods of Interest:")
+            sorted_periods = sorted(conn['toxic_periods'],
+                                    key=lambda x: x['main_toxicity'] + x['related_toxicity'],
+                                    reverse=True)
+            for period in sorted_periods[:2]:
+                print(f"   - {period['period']}: Combined toxicity level {(period['main_toxicity'] + period['related_toxicity'])/2:.3f}")
+
+    # Executive Summary
+    print("\nExecutive Summary")
+    print("=" * 50)
+
+    # Top relationship by different metrics
+    if connections:
+        most_similar = max(connections, key=lambda x: x['semantic_sim'])
+        most_active = max(connections, key=lambda x: x['temporal_sim'])
+        most_toxic = max(connections, key=lambda x: x['toxicity'])
+
+        print("\nKey Insights:")
+        print(f"\n1. Most Related Topic: {', '.join(most_similar['keywords'][:3])}")
+        print(f"   - Topic Similarity: {most_similar['semantic_sim']:.1%}")
+
+        print(f"\n2. Most Interactive Topic: {', '.join(most_active['keywords'][:3])}")
+        print(f"   - Activity Overlap: {most_active['temporal_sim']:.1%}")
+
+        print(f"\n3. Highest Risk Topic: {', '.join(most_toxic['keywords'][:3])}")
+        print(f"   - Toxicity Level: {most_toxic['toxicity']:.4f}")
+
+        # Risk Assessment
+        high_risk_periods = []
+        for conn in connections:
+            for period in conn['toxic_periods']:
+                high_risk_periods.append({
+                    'period': period['period'],
+                    'risk_level': (period['main_toxicity'] + period['related_toxicity'])/2,
+                    'topic': conn['keywords'][0]
+                })
+
+        if high_risk_periods:
+            high_risk_periods.sort(key=lambda x: x['risk_level'], reverse=True)
+            print("\nPriority Monitoring Periods:")
+            for period in high_risk_periods[:3]:
+                print(f"- {period['period']}: Elevated risk with {period['topic']} (Risk Level: {period['risk_level']:.3f})")
+
+    return connections
+
+
+def legacy_semantic_similarity(builder, kw1, kw2, domain1=None, domain2=None):
+    """The previous pairwise similarity: two single-text encodes per pair (kept for benchmarking)"""
+    if domain1:
+        kw1 = builder.enrich_keywords(kw1, domain1)
+    if domain2:
+        kw2 = builder.enrich_keywords(kw2, domain2)
+    domain_boost = 1.3 if (domain1 == domain2 and domain1 is not None) else 1.0
+    overlap = len(set(kw1) & set(kw2)) / max(len(set(kw1)), len(set(kw2)))
+    emb1 = builder.model.encode([' '.join(kw1)])[0]
+    emb2 = builder.model.encode([' '.join(kw2)])[0]
+    embedding_sim = float(cosine_similarity([emb1], [emb2])[0][0])
+    return (0.3 * overlap + 0.7 * embedding_sim) * domain_boost
+
+
+def legacy_temporal_similarity(temp1, temp2):
+    """The previous pairwise temporal similarity over the nested dicts (kept for benchmarking)"""
+    months1 = {month for year in temp1.values() for month in year.keys()}
+    months2 = {month for year in temp2.values() for month in year.keys()}
+    shared_months = months1 & months2
+
+    if not shared_months:
+        return 0
+
+    # Get active months (months with non-zero posts)
+    active_months1 = {month for year in temp1.values() for month, data in year.items()
+                      if data['post_count'] > 0}
+    active_months2 = {month for year in temp2.values() for month, data in year.items()
+                      if data['post_count'] > 0}
+
+    # Calculate activity overlap
+    activity_overlap = len(active_months1 & active_months2) / max(len(active_months1 | active_months2), 1)
+
+    similarities = []
+    sorted_months = sorted(list(shared_months))
+
+    total_volume1 = sum(temp1[month.split('-')[0]][month]['post_count']
+                        for month in shared_months)
+    total_volume2 = sum(temp2[month.split('-')[0]][month]['post_count']
+                        for month in shared_months)
+
+    # Overall volume similarity
+    volume_similarity = min(total_volume1, total_volume2) / max(total_volume1, total_volume2) if max(total_volume1, total_volume2) > 0 else 0
+
+    for i, current_month in enumerate(sorted_months):
+        year = current_month.split('-')[0]
+
+        vol1 = temp1[year][current_month]['post_count']
+        vol2 = temp2[year][current_month]['post_count']
+
+        if vol1 == 0 and vol2 == 0:
+            continue
+
+        vol_ratio = min(vol1, vol2) / max(vol1, vol2) if max(vol1, vol2) > 0 else 0
+
+        if i > 0:
+            prev_month = sorted_months[i-1]
+            prev_year = prev_month.split('-')[0]
+
+            prev_vol1 = temp1[prev_year][prev_month]['post_count']
+            prev_vol2 = temp2[prev_year][prev_month]['post_count']
+
+            if prev_vol1 > 0 or prev_vol2 > 0:
+                trend1 = (vol1 - prev_vol1) / (prev_vol1 + 1)
+                trend2 = (vol2 - prev_vol2) / (prev_vol2 + 1)
+                trend_sim = 1 - min(abs(trend1 - trend2), 1)
+                similarities.append(0.4 * vol_ratio + 0.4 * trend_sim + 0.2 * activity_overlap)
+            else:
+                similarities.append(0.6 * vol_ratio + 0.4 * activity_overlap)
+        else:
+            similarities.append(0.6 * vol_ratio + 0.4 * activity_overlap)
+
+    if not similarities:
+        return 0.0
+
+    final_similarity = (
+        0.5 * (sum(similarities) / len(similarities)) +  # Average monthly similarities
+        0.3 * volume_similarity +                        # Overall volume similarity
+        0.2 * activity_overlap                          # Activity period overlap
+    )
+
+    return final_similarity
+
+
+def legacy_co_toxic_months(tox1, tox2, threshold=0.1):
+    """The previous per-pair walk over two toxicity_evolution dicts (kept for benchmarking)"""
+    shared_months = 0
+    high_toxicity_months = 0
+    for year in set(tox1.keys()) & set(tox2.keys()):
+        for month in set(tox1[year].keys()) & set(tox2[year].keys()):
+            shared_months += 1
+            if tox1[year][month]['avg_toxicity'] > threshold and tox2[year][month]['avg_toxicity'] > threshold:
+                high_toxicity_months += 1
+    return high_toxicity_months, shared_months
+
+
+def synthetic_evolutions(n_clusters, seed=0):
+    """temporal_evolution / toxicity_evolution dicts of clusters active in a random span of 2020-2023"""
+    rng = np.random.default_rng(seed)
+    temporal, toxicity = [], []
+    for _ in range(n_clusters):
+        first = rng.integers(2020, 2024)
+        years = [str(year) for year in range(first, rng.integers(first, 2024) + 1)]
+        counts = {year: {f"{year}-{month:02d}": int(rng.integers(1, 500)) * int(rng.random() < 0.6)
+                         for month in range(1, 13)} for year in years}
+        temporal.append({year: {month: {'post_count': count} for month, count in months.items()}
+                         for year, months in counts.items()})
+        toxicity.append({year: {month: {'avg_toxicity': round(rng.random() * 0.3, 4), 'post_count': count}
+                                for month, count in months.items() if count}
+                         for year, months in counts.items()})
+    return temporal, toxicity
+
+
+def benchmark_timelines(sizes=(200, 1000, 3000), legacy_max=1000):
+    """
+    Time the temporal similarity and co-toxic month counts of all cluster pairs:
+    the nested-dict walks per pair against the clusters x months arrays.
+    The previous implementation is only run up to `legacy_max` clusters.
+    """
+    results = []
+    for n_clusters in sizes:
+        temporal, toxicity = synthetic_evolutions(n_clusters)
+
+        t0 = time.time()
+        _, post_counts, has_month = evolution_arrays(temporal, 'post_count')
+        similarity = temporal_similarity_matrix(post_counts, has_month)
+        _, toxicity_values, has_toxicity = evolution_arrays(toxicity, 'avg_toxicity')
+        high, shared = co_toxic_months(toxicity_values, has_toxicity)
+        seconds = time.time() - t0
+        result = {'clusters': n_clusters, 'pairs': n_clusters * (n_clusters - 1) // 2,
+                  'array_seconds': round(seconds, 2)}
+
+        if n_clusters <= legacy_max:
+            t0 = time.time()
+            legacy_similarity = np.zeros((n_clusters, n_clusters))
+            legacy_counts = np.zeros((2, n_clusters, n_clusters))
+            for i in range(n_clusters):
+                for j in range(i + 1, n_clusters):
+                    legacy_similarity[i, j] = legacy_temporal_similarity(temporal[i], temporal[j])
+                    legacy_counts[:, i, j] = legacy_co_toxic_months(toxicity[i], toxicity[j])
+            result['pairwise_seconds'] = round(time.time() - t0, 2)
+            upper = np.triu_indices(n_clusters, k=1)
+            result['max_difference'] = float(np.abs(legacy_similarity[upper] - similarity[upper]).max())
+            result['same_counts'] = bool((legacy_counts[0][upper] == high[upper]).all()
+                                         and (legacy_counts[1][upper] == shared[upper]).all())
+        results.append(result)
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    return results
+
+
+def benchmark_semantic_similarity(cluster_df, sizes=(20, 50, 100), builder=None):
+    """
+    Time the semantic similarity of all cluster pairs: pairwise encodes against
+    one batched encode and matrix operations (with an empty cache).
+
+    Parameters:
+    - cluster_df: Preprocessed topic_clusters.csv (lists in `unique_keywords`).
+    - sizes: Numbers of clusters to compare.
+    - builder: An `EnhancedTopicNetworkBuilder` (loads the default model if None).
+    """
+    builder = builder or EnhancedTopicNetworkBuilder()
+    results = []
+    for n_clusters in sizes:
+        keyword_lists = list(cluster_df['unique_keywords'][:n_clusters])
+        domains = [builder.detect_domain(keywords) for keywords in keyword_lists]
+
+        t0 = time.time()
+        legacy = np.eye(len(keyword_lists))
+        for i in range(len(keyword_lists)):
+            for j in range(i + 1, len(keyword_lists)):
+                legacy[i, j] = legacy_semantic_similarity(builder, keyword_lists[i], keyword_lists[j],
+                                                          domains[i], domains[j])
+        legacy_seconds = time.time() - t0
+
+        builder.embedding_cache.clear()
+        t0 = time.time()
+        matrix = builder.semantic_similarity_matrix(keyword_lists, domains)
+        seconds = time.time() - t0
+
+        upper = np.triu_indices(len(keyword_lists), k=1)
+        results.append({'clusters': len(keyword_lists), 'pairwise_seconds': round(legacy_seconds, 2),
+                        'matrix_seconds': round(seconds, 3),
+                        'max_difference': float(np.abs(legacy[upper] - matrix[upper]).max())})
+    results = pd.DataFrame(results)
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_timelines()
+    clusters = pd.read_csv('../../data/topic_clusters.csv')
+    clusters['unique_keywords'] = clusters['unique_keywords'].apply(ast.literal_eval)
+    benchmark_semantic_similarity(clusters)
@@ -0,0 +1,228 @@
+import os
+import resource
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from scores_dataset import list_yearmonths, read_scores
+
+COLUMNS = ['text', 'yearmonth', 'title', 'index', 'average_toxicity_score']
+
+# Thread pools of numba (UMAP), OpenMP/BLAS (HDBSCAN, numpy) and torch (sentence-transformers)
+THREAD_ENV_VARS = ['NUMBA_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def fit_month(dataset_dir, yearmonth, embedding_store=None, columns=COLUMNS, return_model=False):
+    """
+    Fit BERTopic on the comments of one yearmonth.
+
+    Returns the comments with their `Topic` and the topic information (Count,
+    Name, Representation, Representative_Docs), as written to topics_<year>.csv.
+
+    Parameters:
+    - dataset_dir: The Parquet dataset of scored comments, partitioned by yearmonth.
+    - yearmonth: The month to fit (e.g. '2023-10').
+    - embedding_store: Optional `EmbeddingStore` with precomputed embeddings of the comments.
+    - return_model: Also return the fitted BERTopic model.
+    """
+    from bertopic import BERTopic
+    from bertopic.representation import KeyBERTInspired
+
+    # Read only the current year-month's partition
+    df_filtered = read_scores(dataset_dir, columns=columns, yearmonths=[yearmonth])
+
+    # Initialise representation model
+    representation_model = KeyBERTInspired()
+
+    # Initialize BERTopic model
+    if embedding_store is None:
+        topic_model = BERTopic(representation_model=representation_model, nr_topics="auto")
+        embeddings = None
+    else:
+        # Reuse the stored embeddings, so only UMAP and HDBSCAN are fitted
+        topic_model = BERTopic(embedding_model=embedding_store.model,
+                               representation_model=representation_model, nr_topics="auto")
+        embeddings = embedding_store.get(df_filtered['index'])
+
+    # Fit the model on the text data
+    topics, probabilities = topic_model.fit_transform(df_filtered['text'], embeddings=embeddings)
+
+    # Merge topics and topic information (such as topic words and frequencies) with the original data
+    df_topics = pd.DataFrame({'index': df_filtered['index'], 'Topic': topics})
+    df_combined = pd.merge(df_filtered, df_topics, on='index', how='left')
+    df_final = pd.merge(df_combined, topic_model.get_topic_info(), on='Topic', how='left')
+    if return_model:
+        return df_final, topic_model
+    return df_final
+
+
+def limit_threads(threads):
+    """Bound every thread pool of a worker process before numba, torch or tokenizers are imported"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _run_month(dataset_dir, yearmonth, part_path, embedding_dir, fit):
+    """Fit one month in a worker and write its part file; returns timing, peak memory and errors"""
+    t0 = time.time()
+    result = {'yearmonth': yearmonth, 'status': 'done', 'rows': 0, 'error': ''}
+    try:
+        embedding_store = None
+        if embedding_dir:
+            from embedding_store import EmbeddingStore
+            embedding_store = EmbeddingStore(embedding_dir, variant='raw')
+        df_final = fit(dataset_dir, yearmonth, embedding_store)
+        df_final.to_csv(f"{part_path}.tmp", index=False)
+        os.replace(f"{part_path}.tmp", part_path)
+        result['rows'] = len(df_final)
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc(limit=3)
+    result['seconds'] = round(time.time() - t0, 1)
+    # Every month runs in a fresh worker process, so this is the month's own peak
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def _fit_months(months, run_args, n_workers, threads_per_worker, ctx):
+    """
+    Run `_run_month` for every month, at most `n_workers` at a time, and yield the results as months finish.
+
+    Every month gets its own single-process pool, so a worker that dies (e.g.
+    killed by the OOM killer) breaks only its own pool: that month is reported
+    as failed and the other months carry on.
+    """
+    pending = list(months)
+    running = {}
+    while pending or running:
+        while pending and len(running) < n_workers:
+            month = pending.pop(0)
+            executor = ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=limit_threads,
+                                           initargs=(threads_per_worker,))
+            running[executor.submit(_run_month, *run_args(month))] = (month, executor, time.time())
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            month, executor, t0 = running.pop(future)
+            executor.shutdown(wait=True)
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                yield {'yearmonth': month, 'status': 'failed', 'rows': 0, 'seconds': round(time.time() - t0, 1),
+                       'peak_rss_mb': None, 'error': 'Worker process died (killed, e.g. out of memory)'}
+            except Exception:
+                yield {'yearmonth': month, 'status': 'failed', 'rows': 0, 'seconds': round(time.time() - t0, 1),
+                       'peak_rss_mb': None, 'error': traceback.format_exc(limit=3)}
+
+
+def combine_parts(part_paths, output_csv):
+    """
+    Concatenate month part files, in the given order, into one CSV with a single header.
+
+    All parts must have the same header; otherwise a ValueError is raised and
+    `output_csv` is left as it was.
+    """
+    tmp_csv = f"{output_csv}.tmp"
+    first_header = None
+    try:
+        with open(tmp_csv, 'w', encoding='utf-8', newline='') as out:
+            for path in part_paths:
+                with open(path, encoding='utf-8', newline='') as f:
+                    header = f.readline()
+                    if first_header is None:
+                        first_header = header
+                        out.write(header)
+                    elif header != first_header:
+                        raise ValueError(f"{path} has different columns than {part_paths[0]}: "
+                                         f"{header.strip()} != {first_header.strip()}")
+                    shutil.copyfileobj(f, out)
+    except BaseException:
+        os.remove(tmp_csv)
+        raise
+    os.replace(tmp_csv, output_csv)
+
+
+def schedule_topics(dataset_dir, output_dir, years=range(2020, 2024), n_workers=4, threads_per_worker=None,
+                    embedding_dir=None, retries=2, overwrite=False, fit=fit_month):
+    """
+    Fit the topic models of every month of the given years on a process pool.
+
+    Every month is fitted independently in its own worker process (with bounded
+    numba/OpenMP/BLAS/torch thread pools) and written to its own part file
+    (`<output_dir>/topic_parts/<yearmonth>.csv`). Months whose part file already
+    exists are skipped unless `overwrite`, and failed months are retried on their
+    own, including months whose worker process died (e.g. killed for memory),
+    which does not affect the other months. Once all months of a year are done,
+    their parts are concatenated in month order into `<output_dir>/topics_<year>.csv`.
+
+    Per-month status, rows, wall time and peak memory are printed as months finish
+    and saved to `<output_dir>/topic_parts/schedule_log.csv`.
+
+    Parameters:
+    - dataset_dir: The Parquet dataset of scored comments, partitioned by yearmonth.
+    - output_dir: Directory of the topics_<year>.csv files.
+    - years: Years to process.
+    - n_workers: Number of worker processes.
+    - threads_per_worker: Thread count per worker (default: cores / workers).
+    - embedding_dir: Optional `EmbeddingStore` directory with precomputed embeddings.
+    - retries: How many times a failed month is retried.
+    - overwrite: Refit months whose part file already exists.
+    - fit: Function fitting one month, `fit(dataset_dir, yearmonth, embedding_store)`.
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+    parts_dir = os.path.join(output_dir, 'topic_parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    years = [str(year) for year in years]
+    months = [month for month in list_yearmonths(dataset_dir) if month[:4] in years]
+    part_path = {month: os.path.join(parts_dir, f'{month}.csv') for month in months}
+
+    pending = [month for month in months if overwrite or not os.path.exists(part_path[month])]
+    print(f"{len(pending)} of {len(months)} months to fit with {n_workers} workers "
+          f"({threads_per_worker} threads each)")
+
+    log = []
+    ctx = mp.get_context('spawn')
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        # One month per worker process, so memory is released and peak RSS is per month
+        failed = []
+        for result in _fit_months(pending, lambda month: (dataset_dir, month, part_path[month], embedding_dir, fit),
+                                  n_workers, threads_per_worker, ctx):
+            result['attempt'] = attempt + 1
+            log.append(result)
+            print(f"{result['yearmonth']}: {result['status']} ({result['rows']} rows) "
+                  f"in {result['seconds']}s, peak {result['peak_rss_mb']} MB")
+            if result['status'] == 'failed':
+                print(result['error'])
+                failed.append(result['yearmonth'])
+        pending = sorted(failed)
+        if pending and attempt < retries:
+            print(f"Retrying {len(pending)} failed month(s): {', '.join(pending)}")
+
+    log = pd.DataFrame(log)
+    if len(log):
+        log.to_csv(os.path.join(parts_dir, 'schedule_log.csv'), index=False)
+
+    for year in years:
+        year_months = [month for month in months if month.startswith(year)]
+        if not year_months:
+            continue
+        if any(not os.path.exists(part_path[month]) for month in year_months):
+            print(f"topics_{year}.csv not written: some months of {year} failed")
+            continue
+        combine_parts([part_path[month] for month in year_months],
+                      os.path.join(output_dir, f'topics_{year}.csv'))
+        print(f"topics_{year}.csv written ({len(year_months)} months)")
+    if pending:
+        print(f"Months still failing after {retries} retries: {', '.join(pending)}")
+    return log
@@ -0,0 +1,248 @@
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+
+from coherence import CoherenceIndex
+from embedding_store import DEFAULT_MODEL
+from topic_scheduler import limit_threads
+
+# Parameters of the UMAP / CountVectorizer / BERTopic cell in parameter_tuning.ipynb
+PARAM_GRID = {
+    'n_neighbors': [10, 15, 30],
+    'n_components': [5, 10],
+    'min_dist': [0.0, 0.1],
+    'min_df': [2, 5],
+    'max_df': [0.9],
+    'ngram_range': [(1, 1), (1, 2)],
+    'nr_topics': [50, 'auto'],
+    'min_topic_size': [10, 20],
+}
+UMAP_PARAMS = ['n_neighbors', 'n_components', 'min_dist']
+RESULT_COLUMNS = ['coherence', 'n_topics', 'outlier_share', 'fit_seconds', 'coherence_seconds', 'error']
+
+# State of a worker process, set once by _init_worker
+_worker = {}
+
+
+def grid_configs(grid=PARAM_GRID):
+    """Every combination of the parameter grid"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def random_configs(grid=PARAM_GRID, n_iter=20, seed=42):
+    """`n_iter` distinct combinations of the parameter grid, drawn at random"""
+    configs = grid_configs(grid)
+    return random.Random(seed).sample(configs, min(n_iter, len(configs)))
+
+
+def build_coherence_index(texts, directory):
+    """
+    Tokenize the documents and build their co-occurrence index once, for all coherence evaluations.
+
+    The tokenizer is the one of BERTopic's CountVectorizer (`build_tokenizer` only
+    depends on the token pattern, not on min_df/max_df/ngram_range), so it is the
+    same for every configuration of the grid. The index is saved to `directory`.
+    """
+    tokenizer = CountVectorizer().build_tokenizer()
+    return CoherenceIndex.load_or_build(directory, [tokenizer(doc) for doc in texts])
+
+
+def coherence_index_dir(texts, cache_dir):
+    """Directory of the coherence index of a corpus, keyed by its texts (so changed texts get a new index)"""
+    corpus_key = hashlib.sha1('\0'.join(texts).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, 'coherence', corpus_key)
+
+
+def topic_coherence(topic_model, topics, index, top_n=10):
+    """C_v coherence of the topics of a fitted model, as `calculate_topic_coherence` in the notebook"""
+    topic_words = []
+    for topic_idx in sorted(set(topics) - {-1}):
+        topic = topic_model.get_topic(topic_idx)
+        if topic:
+            words = [word for word, _ in topic[:top_n] if word in index.word2id]
+            if words:
+                topic_words.append(words)
+    if not topic_words:
+        return None
+    return index.c_v(topic_words)
+
+
+def umap_key(config, fingerprint, random_state):
+    """Cache key of a UMAP reduction: the embeddings and the UMAP parameters"""
+    params = {name: config[name] for name in UMAP_PARAMS}
+    params.update(metric='cosine', random_state=random_state, embeddings=fingerprint)
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class CachedReduction:
+    """
+    UMAP stand-in for BERTopic that returns a cached reduction of the embeddings.
+
+    BERTopic gets the full sentence embeddings (so topic embeddings and topic
+    merging for `nr_topics` happen in that space, as with the notebook's UMAP
+    model) and only the UMAP fit is replaced by the reduction cached by `_reduce`.
+    """
+
+    def __init__(self, reduced):
+        self.reduced = reduced
+
+    def fit(self, X, y=None):
+        if len(X) != len(self.reduced):
+            raise ValueError(f"Cached reduction has {len(self.reduced)} rows, the embeddings {len(X)}")
+        return self
+
+    def transform(self, X):
+        return self.reduced
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X, y).transform(X)
+
+
+def embeddings_path(cache_dir, fingerprint):
+    """Cached embeddings file, named by their fingerprint so concurrent searches do not overwrite each other"""
+    return os.path.join(cache_dir, f'embeddings-{fingerprint[:16]}.npy')
+
+
+def _init_worker(threads, cache_dir, texts, embedding_model, index_dir, embeddings_file):
+    limit_threads(threads)
+    _worker.update(cache_dir=cache_dir, texts=texts, embedding_model=embedding_model,
+                   index=CoherenceIndex.load(index_dir), embeddings_file=embeddings_file)
+
+
+def _reduce(config, key, random_state):
+    """Fit UMAP with the parameters of `config` and cache the reduced embeddings"""
+    path = os.path.join(_worker['cache_dir'], 'umap', f'{key}.npy')
+    t0 = time.time()
+    try:
+        from umap import UMAP
+
+        embeddings = np.load(_worker['embeddings_file'], mmap_mode='r')
+        umap_model = UMAP(n_neighbors=config['n_neighbors'], n_components=config['n_components'],
+                          min_dist=config['min_dist'], metric='cosine', random_state=random_state)
+        reduced = umap_model.fit_transform(np.asarray(embeddings))
+        np.save(f"{path}.tmp.npy", reduced)
+        os.replace(f"{path}.tmp.npy", path)
+    except Exception:
+        # The configurations using this reduction report the error
+        return key, None, traceback.format_exc(limit=3)
+    return key, time.time() - t0, ''
+
+
+def _evaluate(config, key):
+    """Fit BERTopic on the embeddings with the cached UMAP reduction and compute its coherence"""
+    result = {**config, 'ngram_range': str(config['ngram_range'])}
+    try:
+        from bertopic import BERTopic
+        from bertopic.representation import KeyBERTInspired
+
+        embeddings = np.asarray(np.load(_worker['embeddings_file'], mmap_mode='r'))
+        reduced = np.load(os.path.join(_worker['cache_dir'], 'umap', f'{key}.npy'))
+        t0 = time.time()
+        topic_model = BERTopic(
+            embedding_model=_worker['embedding_model'],
+            vectorizer_model=CountVectorizer(min_df=config['min_df'], max_df=config['max_df'],
+                                             ngram_range=config['ngram_range'], stop_words="english"),
+            # UMAP is not refitted, its cached output is used
+            umap_model=CachedReduction(reduced),
+            representation_model=KeyBERTInspired(),
+            nr_topics=config['nr_topics'],
+            min_topic_size=config['min_topic_size']
+        )
+        topics, _ = topic_model.fit_transform(_worker['texts'], embeddings=embeddings)
+        result['fit_seconds'] = round(time.time() - t0, 1)
+
+        t0 = time.time()
+        result['coherence'] = topic_coherence(topic_model, topics, _worker['index'])
+        result['coherence_seconds'] = round(time.time() - t0, 1)
+        result['n_topics'] = len(set(topics) - {-1})
+        result['outlier_share'] = round(float(np.mean(np.asarray(topics) == -1)), 4)
+    except Exception:
+        result['error'] = traceback.format_exc(limit=3)
+    return result
+
+
+def search(texts, embeddings, output_csv, configs=None, n_workers=4, threads_per_worker=None,
+           cache_dir='../../data/tuning_cache', embedding_model=DEFAULT_MODEL, random_state=42):
+    """
+    Grid or random search over the UMAP / CountVectorizer / BERTopic parameters.
+
+    The search runs in two phases on a process pool: first every distinct UMAP
+    reduction of the configurations is computed once and cached on disk under a
+    key of its parameters and the embeddings (so later searches reuse it), then
+    every configuration fits BERTopic on the full embeddings with its cached
+    reduction in place of UMAP (`CachedReduction`). The co-occurrence
+    index of the corpus (see coherence.py) is built once and shared by all
+    coherence evaluations. Results are ranked by coherence and written to `output_csv`.
+
+    Parameters:
+    - texts: The (preprocessed) documents.
+    - embeddings: Their sentence embeddings, e.g. `EmbeddingStore.get(df['index'])`.
+    - output_csv: The ranked results table.
+    - configs: Configurations to evaluate, from `grid_configs` or `random_configs` (default: the full grid).
+    - n_workers: Number of worker processes.
+    - threads_per_worker: Thread count per worker (default: cores / workers).
+    - cache_dir: Directory of the cached embeddings, UMAP reductions and coherence indexes.
+    - embedding_model: sentence-transformers model of the embeddings (used by KeyBERTInspired).
+    - random_state: UMAP seed, so a cached reduction is reproducible.
+    """
+    configs = configs or grid_configs()
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+    texts = list(texts)
+    os.makedirs(os.path.join(cache_dir, 'umap'), exist_ok=True)
+
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    fingerprint = hashlib.sha1(embeddings.tobytes()).hexdigest()
+    embeddings_file = embeddings_path(cache_dir, fingerprint)
+    if not os.path.exists(embeddings_file):
+        np.save(f"{embeddings_file}.tmp.npy", embeddings)
+        os.replace(f"{embeddings_file}.tmp.npy", embeddings_file)
+
+    print("Building the coherence index...")
+    # One index per corpus, keyed by its texts
+    index_dir = coherence_index_dir(texts, cache_dir)
+    build_coherence_index(texts, index_dir)
+
+    keys = [umap_key(config, fingerprint, random_state) for config in configs]
+    reductions = {key: config for key, config in zip(keys, configs)}
+    missing = [key for key in reductions
+               if not os.path.exists(os.path.join(cache_dir, 'umap', f'{key}.npy'))]
+    print(f"{len(configs)} configurations, {len(reductions)} UMAP reductions "
+          f"({len(reductions) - len(missing)} cached)")
+
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(threads_per_worker, cache_dir, texts, embedding_model, index_dir,
+                                       embeddings_file)) as executor:
+        for key, seconds, error in executor.map(_reduce, [reductions[key] for key in missing], missing,
+                                                [random_state] * len(missing)):
+            if error:
+                print(f"UMAP {key} failed:\n{error}")
+            else:
+                print(f"UMAP {key} fitted in {seconds:.1f}s")
+
+        results = []
+        for result in executor.map(_evaluate, configs, keys):
+            results.append(result)
+            if 'error' in result:
+                print(f"[{len(results)}/{len(configs)}] failed:\n{result['error']}")
+            else:
+                print(f"[{len(results)}/{len(configs)}] coherence {result['coherence']}, "
+                      f"{result['n_topics']} topics, fit {result['fit_seconds']}s")
+
+    results = pd.DataFrame(results).reindex(columns=[*configs[0], *RESULT_COLUMNS])
+    results = results.sort_values('coherence', ascending=False, na_position='last')
+    results.insert(0, 'rank', np.arange(1, len(results) + 1))
+    results.to_csv(output_csv, index=False)
+    print(f"Results written to {output_csv}")
+    return results
@@ -0,0 +1,213 @@
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import Ridge
+
+from scoring import CASCADE_COLUMN, SCORE_COLUMNS, score_chunk_resumable
+
+MODEL_COLUMNS = list(SCORE_COLUMNS.values())
+
+
+class ScoringCascade:
+    """
+    Cheap first stage of the toxicity scoring.
+
+    A linear model on hashed word 1-2-grams predicts the score of each of the
+    three transformer models. Comments whose predicted `average_toxicity_score`
+    is below `threshold` are clearly benign and keep the predicted scores; only
+    the others are scored by HateBERT, HateXplain and ToxicBERT.
+
+    Parameters:
+    - threshold: Predicted average toxicity from which comments are sent to the transformers.
+    - n_features: Number of hashed features.
+    - alpha: Ridge regularization.
+    """
+
+    def __init__(self, threshold=0.05, n_features=2 ** 20, alpha=1.0):
+        self.threshold = threshold
+        self.vectorizer = HashingVectorizer(ngram_range=(1, 2), n_features=n_features, alternate_sign=False,
+                                            norm='l2')
+        self.model = Ridge(alpha=alpha, solver='sparse_cg')
+        self.reset()
+
+    def reset(self):
+        """Reset the counts of comments screened and sent on to the transformers by `score_chunk_resumable`"""
+        self.screened = 0
+        self.escalated = 0
+
+    def fit(self, texts, scores):
+        """Fit the first stage on comments and their transformer scores (the `SCORE_COLUMNS` of combined_data_scores)"""
+        t0 = time.time()
+        self.model.fit(self.vectorizer.transform(pd.Series(texts).astype(str)), scores[MODEL_COLUMNS].to_numpy())
+        print(f"Cascade fitted on {len(scores)} comments in {time.time() - t0:.1f}s")
+        return self
+
+    def predict(self, texts):
+        """Predicted scores of the three models (texts x models, clipped to [0, 1])"""
+        return np.clip(self.model.predict(self.vectorizer.transform(pd.Series(texts).astype(str))), 0, 1)
+
+    def escalate(self, predictions, threshold=None):
+        """Mask of the comments the transformers have to score"""
+        threshold = self.threshold if threshold is None else threshold
+        return predictions.mean(axis=1) >= threshold
+
+    def score_chunk_resumable(self, models, chunk, checkpoint=None, batch_size=32, max_tokens=8192, groups=None,
+                              cache=None):
+        """
+        `scoring.score_chunk_resumable` behind the first stage.
+
+        Only the escalated rows are scored (and checkpointed and cached) by the
+        transformers, so the checkpoint and score cache only ever hold transformer
+        scores; the other rows get the predicted scores and are marked in
+        `CASCADE_COLUMN`.
+        """
+        predictions = self.predict(chunk['text'])
+        escalate = self.escalate(predictions)
+        self.screened += len(chunk)
+        self.escalated += int(escalate.sum())
+
+        scores = {name: predictions[:, i].copy() for i, name in enumerate(SCORE_COLUMNS)}
+        if escalate.any():
+            fresh = score_chunk_resumable(models, chunk[escalate], checkpoint, batch_size, max_tokens, groups, cache)
+            for name, model_scores in fresh.items():
+                scores[name][escalate] = model_scores
+        scores = {name: model_scores.tolist() for name, model_scores in scores.items()}
+        scores[CASCADE_COLUMN] = (~escalate).tolist()
+        return scores
+
+    def report(self):
+        skipped = self.screened - self.escalated
+        print(f"Cascade: {skipped} of {self.screened} comments skipped the transformers "
+              f"({skipped / max(self.screened, 1):.1%}, threshold {self.threshold})")
+
+    def save(self, path):
+        with open(f"{path}.tmp", 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def read_scored_comments(path, sample_rows=None, seed=0):
+    """
+    Comments with their transformer scores and month, from combined_data_scores.csv or the
+    combined_data_scores/ Parquet dataset (optionally a random sample of `sample_rows`).
+
+    Comments a cascade skipped (`CASCADE_COLUMN`) only have predicted scores and
+    are left out, so the first stage is never trained or evaluated on its own output.
+    """
+    columns = ['index', 'text', 'yearmonth'] + MODEL_COLUMNS
+    if os.path.isdir(path):
+        names = ds.dataset(path, format='parquet', partitioning='hive').schema.names
+        df = pd.read_parquet(path, columns=columns + [CASCADE_COLUMN] * (CASCADE_COLUMN in names))
+    else:
+        df = pd.read_csv(path, usecols=lambda column: column in columns + [CASCADE_COLUMN])
+    if CASCADE_COLUMN in df:
+        skipped = df[CASCADE_COLUMN].fillna(False).astype(bool)
+        print(f"{int(skipped.sum())} comments with cascade-predicted scores left out")
+        df = df[~skipped].drop(columns=CASCADE_COLUMN)
+    df['yearmonth'] = df['yearmonth'].astype(str)
+    if sample_rows and len(df) > sample_rows:
+        df = df.sample(sample_rows, random_state=seed)
+    return df.reset_index(drop=True)
+
+
+def split_comments(df, test_fraction=0.2, seed=0):
+    """Train/test split of scored comments"""
+    test = np.random.default_rng(seed).random(len(df)) < test_fraction
+    return df[~test].reset_index(drop=True), df[test].reset_index(drop=True)
+
+
+def evaluate_cascade(cascade, test_df, thresholds=(0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2)):
+    """
+    Skipped fraction and error introduced by the cascade at several thresholds, on held-out scored comments.
+
+    For every threshold the skipped comments take their predicted scores and the
+    others their transformer scores, as `score_corpus` would write them. The error
+    is measured where the dashboard uses the scores: the monthly means of
+    `average_toxicity_score` (mean and largest absolute error over the months)
+    and of the three model scores (largest error over models and months).
+    `speedup` is the transformer work saved, 1 / (1 - skipped), before the
+    first stage's own (much smaller) cost, reported as `stage1_comments_per_sec`.
+    """
+    t0 = time.time()
+    predictions = cascade.predict(test_df['text'])
+    stage1_rate = len(test_df) / max(time.time() - t0, 1e-9)
+    truth = test_df[MODEL_COLUMNS].to_numpy()
+    months = test_df['yearmonth'].to_numpy()
+    true_monthly = pd.DataFrame(truth, columns=MODEL_COLUMNS).assign(
+        average_toxicity_score=truth.mean(axis=1)).groupby(months).mean()
+
+    results = []
+    for threshold in thresholds:
+        escalate = cascade.escalate(predictions, threshold)
+        scores = np.where(escalate[:, None], truth, predictions)
+        monthly = pd.DataFrame(scores, columns=MODEL_COLUMNS).assign(
+            average_toxicity_score=scores.mean(axis=1)).groupby(months).mean()
+        error = (monthly - true_monthly).abs()
+        skipped = 1 - escalate.mean()
+        results.append({
+            'threshold': threshold,
+            'skipped': round(float(skipped), 4),
+            'speedup': round(float(1 / max(1 - skipped, 1e-9)), 2),
+            'skipped_mae': round(float(np.abs(scores - truth)[~escalate].mean()), 5) if (~escalate).any() else 0.0,
+            'monthly_mean_error': round(float(error['average_toxicity_score'].mean()), 5),
+            'monthly_max_error': round(float(error['average_toxicity_score'].max()), 5),
+            'monthly_max_model_error': round(float(error[MODEL_COLUMNS].to_numpy().max()), 5),
+            # Skipped comments the transformers consider toxic
+            'missed_toxic': int(((truth.mean(axis=1) >= 0.5) & ~escalate).sum()),
+        })
+    results = pd.DataFrame(results)
+    results['stage1_comments_per_sec'] = round(stage1_rate, 1)
+    print(results.to_string(index=False))
+    return results
+
+
+def tune_threshold(results, max_monthly_error=0.002, min_skipped=None):
+    """
+    Highest threshold of `evaluate_cascade` whose monthly means stay within `max_monthly_error`.
+
+    With `min_skipped` (a throughput target), the lowest threshold skipping at
+    least that fraction is returned instead, with its error, so the trade-off is
+    visible; None if no threshold qualifies.
+    """
+    if min_skipped is not None:
+        meets = results[results['skipped'] >= min_skipped].sort_values('threshold')
+    else:
+        meets = results[results['monthly_max_error'] <= max_monthly_error].sort_values('threshold', ascending=False)
+    if meets.empty:
+        return None
+    best = meets.iloc[0]
+    print(f"Threshold {best['threshold']}: skips {best['skipped']:.1%} of comments "
+          f"(speedup {best['speedup']}x), monthly mean error up to {best['monthly_max_error']}")
+    return float(best['threshold'])
+
+
+def train_cascade(scores_path='data/combined_data_scores', cascade_path='data/scoring_cascade.pkl',
+                  sample_rows=500_000, max_monthly_error=0.002):
+    """
+    Fit the first stage on the existing scores, evaluate it on held-out comments and
+    save it with the highest threshold within `max_monthly_error`.
+    """
+    train_df, test_df = split_comments(read_scored_comments(scores_path, sample_rows))
+    cascade = ScoringCascade().fit(train_df['text'], train_df)
+    results = evaluate_cascade(cascade, test_df)
+    threshold = tune_threshold(results, max_monthly_error)
+    if threshold is not None:
+        cascade.threshold = threshold
+    cascade.save(cascade_path)
+    print(f"Cascade saved to {cascade_path} (threshold {cascade.threshold})")
+    return cascade, results
+
+
+if __name__ == "__main__":
+    # Run from the project root directory
+    train_cascade('data/combined_data_scores', 'data/scoring_cascade.pkl')
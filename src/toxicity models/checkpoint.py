@@ -0,0 +1,145 @@
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+
+def chunk_hash(chunk):
+    """Content hash of a chunk of input rows (every column and the row order)"""
+    row_hashes = pd.util.hash_pandas_object(chunk, index=False).values
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()
+
+
+def atomic_write_csv(df, path):
+    """Write a CSV to a temporary file and rename it into place"""
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def read_manifest_log(path):
+    """Entries of a JSONL manifest log as {model: {digest: entry}}; later lines win"""
+    models = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partly written last line of an interrupted run
+                continue
+            model, digest = record.pop('model'), record.pop('digest')
+            models.setdefault(model, {})[digest] = record
+    return models
+
+
+def default_checkpoint_dir(output_csv):
+    """Checkpoint directory kept next to the output file"""
+    return f"{output_csv}.checkpoint"
+
+
+class ScoreCheckpoint:
+    """
+    Checkpoint manifest of scored input chunks, per model.
+
+    Every scored chunk is stored as its own part file (`<model>/<chunk hash>.csv`
+    with `index,toxicity_score`), written atomically before it is recorded in the
+    manifest. A chunk is only reused if its content hash matches, so restarting a
+    run, or re-running after the raw dump is refreshed, skips exactly the chunks
+    whose rows have not changed.
+
+    The manifest is an append-only JSONL log (`<writer>.jsonl`, one
+    `{"model", "digest", "first_index", "last_index", "rows"}` line per recorded
+    chunk), so recording a chunk costs the same however many are already recorded.
+    `compact` rewrites it without superseded lines once a run is done. Parallel
+    workers each append to their own log (`writer`); lookups see the entries of
+    every manifest in the directory.
+    """
+
+    def __init__(self, directory, writer='manifest'):
+        self.directory = directory
+        self.path = os.path.join(directory, f'{writer}.jsonl')
+        os.makedirs(directory, exist_ok=True)
+
+        self.entries = {}
+        self.own_entries = {}
+        for path in sorted(glob.glob(os.path.join(directory, 'manifest*.json*'))):
+            if path.endswith('.json'):
+                # Manifest written by earlier versions as a single JSON document
+                with open(path) as f:
+                    models = json.load(f)['models']
+            elif path.endswith('.jsonl'):
+                models = read_manifest_log(path)
+            else:
+                continue
+            for model, chunks in models.items():
+                self.entries.setdefault(model, {}).update(chunks)
+                if path in (self.path, self.legacy_path):
+                    self.own_entries.setdefault(model, {}).update(chunks)
+
+        # A crash can leave a partly written last line; start the next record on a fresh line
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    @property
+    def legacy_path(self):
+        return f"{self.path[:-len('.jsonl')]}.json"
+
+    def part_path(self, model, digest):
+        return os.path.join(self.directory, model, f'{digest}.csv')
+
+    def completed(self, model, digest):
+        """Whether the chunk with this hash has already been scored by the model"""
+        return (digest in self.entries.get(model, {})
+                and os.path.exists(self.part_path(model, digest)))
+
+    def load(self, model, digest):
+        """Load the recorded scores of a chunk"""
+        return pd.read_csv(self.part_path(model, digest))['toxicity_score'].tolist()
+
+    def record(self, model, digest, index, scores):
+        """Atomically save the scores of a chunk and add it to the manifest"""
+        path = self.part_path(model, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_csv(pd.DataFrame({'index': index.values, 'toxicity_score': scores}), path)
+
+        entry = {
+            'first_index': int(index.iloc[0]),
+            'last_index': int(index.iloc[-1]),
+            'rows': len(index)
+        }
+        self.entries.setdefault(model, {})[digest] = entry
+        self.own_entries.setdefault(model, {})[digest] = entry
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'model': model, 'digest': digest, **entry}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self):
+        """Rewrite this writer's manifest log with one line per chunk (and fold in an old JSON manifest)"""
+        if not self.own_entries:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for model, chunks in self.own_entries.items():
+                for digest, entry in chunks.items():
+                    f.write(json.dumps({'model': model, 'digest': digest, **entry}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.legacy_path):
+            os.remove(self.legacy_path)
+
+    def completed_ranges(self, model):
+        """Completed `index` ranges of a model, with adjacent chunks merged"""
+        ranges = []
+        for entry in sorted(self.entries.get(model, {}).values(), key=lambda e: e['first_index']):
+            if ranges and entry['first_index'] <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], entry['last_index'])
+            else:
+                ranges.append([entry['first_index'], entry['last_index']])
+        return [tuple(r) for r in ranges]
@@ -0,0 +1,217 @@
+import copy
+import os
+import random
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+# Models that can be exported; HateXplain's Model_Rational_Label always runs on PyTorch
+ONNX_MODELS = ('hatebert', 'toxicbert')
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# Exported models are kept next to this file and reused by later runs
+ONNX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'onnx')
+
+
+def onnx_path(name, backend, onnx_dir=ONNX_DIR):
+    """Path of the exported (and optionally quantized) model file"""
+    suffix = '-int8' if backend == 'onnx-int8' else ''
+    return os.path.join(onnx_dir, f'{name}{suffix}.onnx')
+
+
+def export_onnx(model, path, opset=17):
+    """
+    Export a Hugging Face sequence classifier to ONNX.
+
+    The batch and sequence axes are dynamic, so the exported graph accepts the
+    length-bucketed, dynamically padded batches of the scoring engine.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Export a CPU copy, so the caller's model keeps its device and mode
+    model = copy.deepcopy(model).cpu().eval()
+    dummy = torch.ones((2, 8), dtype=torch.long)
+    dynamic_axes = {
+        'input_ids': {0: 'batch', 1: 'sequence'},
+        'attention_mask': {0: 'batch', 1: 'sequence'},
+        'logits': {0: 'batch'}
+    }
+    tmp_path = f"{path}.tmp"
+    with torch.inference_mode():
+        torch.onnx.export(model, (dummy, dummy), tmp_path,
+                          input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+    os.replace(tmp_path, path)
+
+
+def quantize_int8(path, quantized_path):
+    """Dynamically quantize the weights of an exported model to INT8"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = f"{quantized_path}.tmp"
+    quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, quantized_path)
+
+
+class OnnxClassifier:
+    """
+    ONNX Runtime stand-in for a PyTorch sequence classifier.
+
+    Called like the PyTorch model (`model(input_ids=..., attention_mask=...)`) and
+    returns a `(logits,)` tuple, so `scoring.score_encoded` and everything built on
+    it work unchanged. The inference session is created on first use with the torch
+    thread count of the current process; pickling only keeps the model path, so the
+    classifier can be handed to parallel scoring workers.
+
+    Parameters:
+    - path: Exported .onnx file.
+    - config: Config of the original model (kept for `score_cache.model_revision`).
+    - backend: 'onnx' or 'onnx-int8'.
+    """
+
+    device = torch.device('cpu')
+
+    def __init__(self, path, config, backend='onnx'):
+        self.path = path
+        self.config = config
+        self.backend = backend
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        return self._session
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy().astype(np.int64),
+            'attention_mask': attention_mask.cpu().numpy().astype(np.int64)
+        })[0]
+        return (torch.from_numpy(logits),)
+
+    def __getstate__(self):
+        return {'path': self.path, 'config': self.config, 'backend': self.backend}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def to_onnx(name, model, backend='onnx', onnx_dir=ONNX_DIR):
+    """
+    Return an `OnnxClassifier` for a loaded PyTorch model, exporting it on first use.
+
+    Parameters:
+    - name: Model name (see `scoring.MODEL_NAMES`), used for the file name.
+    - model: The loaded PyTorch model.
+    - backend: 'onnx' (fp32) or 'onnx-int8' (dynamic INT8 quantization).
+    - onnx_dir: Directory of the exported models.
+    """
+    fp32_path = onnx_path(name, 'onnx', onnx_dir)
+    if not os.path.exists(fp32_path):
+        print(f"Exporting {name} to {fp32_path}...")
+        export_onnx(model, fp32_path)
+
+    path = onnx_path(name, backend, onnx_dir)
+    if not os.path.exists(path):
+        print(f"Quantizing {name} to {path}...")
+        quantize_int8(fp32_path, path)
+    return OnnxClassifier(path, model.config, backend)
+
+
+def sample_texts(input_csv, sample_rows=2000, seed=0, chunk_size=100000):
+    """Uniform random sample of comment texts from the input CSV (reservoir sampling)"""
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    with pd.read_csv(input_csv, usecols=['text'], chunksize=chunk_size) as reader:
+        for chunk in reader:
+            for text in chunk['text'].astype(str):
+                seen += 1
+                if len(sample) < sample_rows:
+                    sample.append(text)
+                else:
+                    j = rng.randrange(seen)
+                    if j < sample_rows:
+                        sample[j] = text
+    return sample
+
+
+def parity_report(input_csv, backends=('onnx', 'onnx-int8'), names=ONNX_MODELS, sample_rows=2000,
+                  batch_size=32, max_tokens=8192, seed=0, output_csv=None, models=None):
+    """
+    Compare ONNX Runtime scores and throughput against the PyTorch backend.
+
+    Scores a random sample of comments with PyTorch and with every ONNX backend and
+    reports, per model and backend, the maximum and mean absolute score difference
+    and the throughput gain. The `average_toxicity_score` rows show the resulting
+    drift of the three-model average the dashboard uses (HateXplain is unchanged).
+
+    Parameters:
+    - input_csv: combined_data.csv produced by data_processing.ipynb.
+    - backends: ONNX backends to compare.
+    - names: Models to compare (subset of `ONNX_MODELS`).
+    - sample_rows: Number of randomly sampled comments.
+    - output_csv: Optional CSV file to save the report to.
+    - models: Already loaded PyTorch CPU models, {name: (model, tokenizer)}.
+    """
+    from scoring import SCORE_COLUMNS, load_models, score_texts
+
+    texts = sample_texts(input_csv, sample_rows, seed)
+    models = models or load_models(names, device='cpu')
+
+    rows = []
+    drift = {backend: np.zeros(len(texts)) for backend in backends}
+    for name in names:
+        model, tokenizer = models[name]
+        # Warm up both backends the same way, so neither timing includes first-call overhead
+        score_texts(model, tokenizer, texts[:batch_size], batch_size, max_tokens)
+        t0 = time.time()
+        reference = np.array(score_texts(model, tokenizer, texts, batch_size, max_tokens))
+        torch_seconds = time.time() - t0
+
+        for backend in backends:
+            onnx_model = to_onnx(name, model, backend)
+            score_texts(onnx_model, tokenizer, texts[:batch_size], batch_size, max_tokens)  # warm-up
+            t0 = time.time()
+            scores = np.array(score_texts(onnx_model, tokenizer, texts, batch_size, max_tokens))
+            seconds = time.time() - t0
+
+            diff = scores - reference
+            drift[backend] += diff / len(SCORE_COLUMNS)
+            rows.append({
+                'model': name,
+                'backend': backend,
+                'max_abs_diff': np.abs(diff).max(),
+                'mean_abs_diff': np.abs(diff).mean(),
+                'torch_comments_per_sec': round(len(texts) / torch_seconds, 1),
+                'comments_per_sec': round(len(texts) / seconds, 1),
+                'speedup': round(torch_seconds / seconds, 2)
+            })
+
+    for backend in backends:
+        rows.append({
+            'model': 'average_toxicity_score',
+            'backend': backend,
+            'max_abs_diff': np.abs(drift[backend]).max(),
+            'mean_abs_diff': np.abs(drift[backend]).mean()
+        })
+
+    report = pd.DataFrame(rows)
+    print(f"\nParity against PyTorch on {len(texts)} sampled comments:")
+    print(report.to_string(index=False))
+    if output_csv:
+        report.to_csv(output_csv, index=False)
+    return report
+
+
+if __name__ == "__main__":
+    # Run from the project root directory
+    parity_report('data/combined_data.csv', output_csv='data/onnx_parity_report.csv')
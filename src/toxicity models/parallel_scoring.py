@@ -0,0 +1,222 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import torch
+import torch.multiprocessing as mp
+
+from checkpoint import ScoreCheckpoint, default_checkpoint_dir
+from score_cache import ScoreCache
+from scoring import add_score_columns, group_by_tokenizer, load_models, score_chunk_resumable
+
+# Models of the current worker process, set once by `_init_worker`
+_WORKER_MODELS = None
+
+
+def count_rows(input_csv, chunk_size=100000):
+    """Count the data rows of a CSV (comments can contain newlines, so lines are not rows)"""
+    return sum(len(chunk) for chunk in pd.read_csv(input_csv, usecols=['index'], chunksize=chunk_size))
+
+
+def shard_ranges(n_rows, n_shards, align=1):
+    """
+    Split rows [0, n_rows) into at most n_shards contiguous (start, stop) ranges.
+
+    Shard boundaries fall on multiples of `align` (the chunk size), so every shard
+    reads the same chunks as a sequential run and checkpointed chunks are reused
+    whatever the number of workers.
+    """
+    n_chunks = -(-n_rows // align)
+    bounds = [min(n_rows, align * (n_chunks * i // n_shards)) for i in range(n_shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(n_shards) if bounds[i] < bounds[i + 1]]
+
+
+def shard_path(output_csv, shard_id):
+    """Path of the file a worker writes its shard to, next to the final output"""
+    root, ext = os.path.splitext(output_csv)
+    return f"{root}.shard-{shard_id:03d}{ext}"
+
+
+def default_threads(n_workers):
+    """Split the machine's cores evenly between workers"""
+    return max(1, (os.cpu_count() or 1) // n_workers)
+
+
+def _init_worker(threads, models, backend='torch'):
+    """Pin the intra-op thread count and load (or attach to shared) models once per worker"""
+    global _WORKER_MODELS
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    torch.set_num_threads(threads)
+    _WORKER_MODELS = models if models is not None else load_models(device='cpu', backend=backend)
+
+
+def _score_shard(shard_id, start, stop, input_csv, output_csv, chunk_size, batch_size, max_tokens,
+                 checkpoint_dir, cache_path):
+    """Score rows [start, stop) of the input CSV and write them to the shard's own file"""
+    groups = group_by_tokenizer(_WORKER_MODELS)
+    checkpoint = ScoreCheckpoint(checkpoint_dir, writer=f'manifest-shard-{shard_id:03d}')
+    cache = ScoreCache(cache_path) if cache_path else None
+    path = shard_path(output_csv, shard_id)
+    tmp_path = f"{path}.tmp"
+    t0 = time.time()
+
+    reader = pd.read_csv(input_csv, chunksize=chunk_size, nrows=stop - start,
+                         skiprows=lambda i: 0 < i <= start)
+    with reader:
+        for chunk_idx, chunk in enumerate(reader):
+            scores = score_chunk_resumable(_WORKER_MODELS, chunk, checkpoint, batch_size, max_tokens,
+                                           groups, cache)
+            chunk = add_score_columns(chunk, scores)
+            if chunk_idx == 0:
+                chunk.to_csv(tmp_path, index=False, mode='w')
+            else:
+                chunk.to_csv(tmp_path, index=False, mode='a', header=False)
+    os.replace(tmp_path, path)
+    checkpoint.compact()
+
+    print(f"Shard {shard_id} (rows {start}-{stop - 1}) scored in {time.time() - t0:.1f}s")
+    if cache is not None:
+        cache.report()
+        cache.close()
+    return path
+
+
+def merge_shards(shard_paths, output_csv):
+    """
+    Merge shard files into one CSV ordered by `index`.
+
+    Shards cover contiguous row ranges of an input that is already ordered by
+    `index`, so ordering the shards by their first index and appending them gives
+    the final order without loading the scores into memory. If the shards do
+    overlap, fall back to sorting the full frame.
+    """
+    first_last = []
+    for path in shard_paths:
+        index = pd.read_csv(path, usecols=['index'])['index']
+        if not index.is_monotonic_increasing:
+            first_last = None
+            break
+        first_last.append((index.iloc[0], index.iloc[-1], path))
+
+    ordered = sorted(first_last) if first_last is not None else None
+    if ordered is None or any(prev[1] >= cur[0] for prev, cur in zip(ordered, ordered[1:])):
+        print("Shards overlap, sorting the merged output by index...")
+        merged = pd.concat(pd.read_csv(path) for path in shard_paths)
+        merged.sort_values('index').to_csv(output_csv, index=False)
+        return
+
+    with open(output_csv, 'w', encoding='utf-8', newline='') as out:
+        for shard_idx, (_, _, path) in enumerate(ordered):
+            with open(path, encoding='utf-8', newline='') as f:
+                header = f.readline()
+                if shard_idx == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+
+
+def score_corpus_parallel(input_csv, output_csv, n_workers=4, threads_per_worker=None, chunk_size=500,
+                          batch_size=32, max_tokens=8192, share_models=True, models=None,
+                          keep_shards=False, checkpoint_dir=None, cache_path=None, backend='torch'):
+    """
+    Score the corpus with all three models using several CPU worker processes.
+
+    The input is split into `n_workers` contiguous row-range shards. Each worker
+    pins its intra-op thread count, scores its shard and writes its own shard file,
+    and the shards are merged in `index` order into `output_csv` (same layout as
+    `scoring.score_corpus`). Scored chunks go to the same checkpoint as the
+    sequential scorer, so an interrupted run resumes in either mode.
+
+    Parameters:
+    - input_csv: combined_data.csv produced by data_processing.ipynb.
+    - output_csv: The output CSV file (combined_data_scores.csv).
+    - n_workers: Number of worker processes.
+    - threads_per_worker: torch intra-op threads per worker (default: cores / workers).
+    - share_models: Load the models once in this process and hand them to the workers
+      through shared memory instead of loading a copy per worker.
+    - models: Already loaded CPU models to share (loaded here if not given).
+    - keep_shards: Keep the per-worker shard files after merging.
+    - checkpoint_dir: Checkpoint directory (default: `<output_csv>.checkpoint`).
+    - cache_path: Optional SQLite score cache shared by all workers (see `score_cache.ScoreCache`).
+    - backend: Inference backend, 'torch', 'onnx' or 'onnx-int8' (see `scoring.load_model`).
+      ONNX Runtime sessions are not shared; every worker opens its own on the exported file.
+    """
+    threads_per_worker = threads_per_worker or default_threads(n_workers)
+    n_rows = count_rows(input_csv)
+    ranges = shard_ranges(n_rows, n_workers, align=chunk_size)
+    checkpoint_dir = checkpoint_dir or default_checkpoint_dir(output_csv)
+    print(f"Scoring {n_rows} rows in {len(ranges)} shards "
+          f"({threads_per_worker} threads per worker)...")
+
+    if share_models:
+        models = models or load_models(device='cpu', backend=backend)
+        for model, _ in models.values():
+            if isinstance(model, torch.nn.Module):
+                model.share_memory()
+    else:
+        models = None
+
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=ctx, initializer=_init_worker,
+                             initargs=(threads_per_worker, models, backend)) as executor:
+        futures = [executor.submit(_score_shard, shard_id, start, stop, input_csv, output_csv,
+                                   chunk_size, batch_size, max_tokens, checkpoint_dir, cache_path)
+                   for shard_id, (start, stop) in enumerate(ranges)]
+        paths = [future.result() for future in futures]
+
+    print("Merging shards...")
+    tmp_csv = f"{output_csv}.tmp"
+    merge_shards(paths, tmp_csv)
+    os.replace(tmp_csv, output_csv)
+    if not keep_shards:
+        for path in paths:
+            os.remove(path)
+    print(f"Scores saved to {output_csv}")
+    return n_rows
+
+
+def benchmark_workers(input_csv, worker_counts=(1, 2, 4, 8), sample_rows=2000, **kwargs):
+    """
+    Report scoring throughput (comments/sec) for different worker counts.
+
+    Scores the first `sample_rows` rows of the input once per worker count, so the
+    right `n_workers` can be picked per machine. Models are loaded once up front so
+    the timings cover worker start-up and scoring only. Extra keyword arguments are
+    passed to `score_corpus_parallel`.
+    """
+    if kwargs.get('share_models', True):
+        kwargs['models'] = kwargs.get('models') or load_models(device='cpu',
+                                                               backend=kwargs.get('backend', 'torch'))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample_csv = os.path.join(tmp_dir, 'sample.csv')
+        pd.read_csv(input_csv, nrows=sample_rows).to_csv(sample_csv, index=False)
+
+        for n_workers in worker_counts:
+            t0 = time.time()
+            # Fresh checkpoint per run, so no run reuses another run's scores
+            n_rows = score_corpus_parallel(sample_csv, os.path.join(tmp_dir, 'scores.csv'),
+                                           n_workers=n_workers,
+                                           checkpoint_dir=os.path.join(tmp_dir, f'checkpoint-{n_workers}'),
+                                           **kwargs)
+            seconds = time.time() - t0
+            results.append({
+                'workers': n_workers,
+                'threads_per_worker': kwargs.get('threads_per_worker') or default_threads(n_workers),
+                'rows': n_rows,
+                'seconds': round(seconds, 2),
+                'comments_per_sec': round(n_rows / seconds, 1)
+            })
+
+    results = pd.DataFrame(results)
+    print("\nThroughput by worker count:")
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == "__main__":
+    # Run from the project root directory
+    benchmark_workers('data/combined_data.csv')
@@ -0,0 +1,144 @@
+import hashlib
+import sqlite3
+import time
+
+
+def normalize_text(text):
+    """Collapse whitespace, which the BERT tokenizers ignore anyway"""
+    return ' '.join(str(text).split())
+
+
+def text_key(text):
+    """Hash of the normalized text, used as the cache key"""
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).digest()
+
+
+def model_revision(model):
+    """
+    Hub commit the model weights were loaded from (falls back to the model path).
+
+    ONNX Runtime models get their backend appended, so quantized scores are never
+    mixed up with the scores of the original weights.
+    """
+    config = getattr(model, 'config', None)
+    revision = (getattr(config, '_commit_hash', None)
+                or getattr(config, 'name_or_path', None)
+                or 'unknown')
+    backend = getattr(model, 'backend', None)
+    return f"{revision}+{backend}" if backend else revision
+
+
+class ScoreCache:
+    """
+    Persistent cache of toxicity scores keyed by (model name, model revision, text hash).
+
+    Scores are stored in a local SQLite database, so exact-duplicate comments (bot
+    replies, copypasta, quoted lines) and comments already scored by a previous run
+    skip the transformer forward pass. The cache holds at most `max_entries` scores;
+    beyond that the least recently used entries are evicted.
+
+    Parameters:
+    - path: SQLite database file (e.g. data/score_cache.sqlite).
+    - max_entries: Maximum number of cached scores across all models.
+    """
+
+    # SQLite limits the number of bound parameters per statement
+    _BATCH = 500
+
+    def __init__(self, path, max_entries=20_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # Parallel scoring workers share the file, so wait on locks instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                model TEXT NOT NULL,
+                revision TEXT NOT NULL,
+                text_hash BLOB NOT NULL,
+                score REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, revision, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self.conn.commit()
+        self._entries = self.conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def lookup(self, model, revision, keys):
+        """Return {key: score} for the keys that are cached, marking them as recently used"""
+        found = {}
+        now = time.time()
+        for start in range(0, len(keys), self._BATCH):
+            batch = keys[start:start + self._BATCH]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT text_hash, score FROM scores "
+                f"WHERE model = ? AND revision = ? AND text_hash IN ({placeholders})",
+                (model, revision, *batch)).fetchall()
+            found.update(rows)
+            if rows:
+                hit_keys = [row[0] for row in rows]
+                self.conn.execute(
+                    f"UPDATE scores SET last_used = ? "
+                    f"WHERE model = ? AND revision = ? AND text_hash IN ({','.join('?' * len(hit_keys))})",
+                    (now, model, revision, *hit_keys))
+        self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, model, revision, scores):
+        """Add {key: score} to the cache and evict old entries if it grew too large"""
+        now = time.time()
+        changes = self.conn.total_changes
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO scores (model, revision, text_hash, score, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(model, revision, key, score, now) for key, score in scores.items()])
+        inserted = self.conn.total_changes - changes
+        if inserted < len(scores):
+            # Keys that were already cached: replace their score (the rows inserted above already have `now`)
+            self.conn.executemany(
+                "UPDATE scores SET score = ?, last_used = ? "
+                "WHERE model = ? AND revision = ? AND text_hash = ? AND last_used <> ?",
+                [(score, now, model, revision, key, now) for key, score in scores.items()])
+        self.conn.commit()
+        self._entries += inserted
+        if self._entries > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries down to 90% of `max_entries`"""
+        self._entries = self.conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        excess = self._entries - int(self.max_entries * 0.9)
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM scores WHERE (model, revision, text_hash) IN "
+                "(SELECT model, revision, text_hash FROM scores ORDER BY last_used LIMIT ?)",
+                (excess,))
+            self.conn.commit()
+            self._entries -= excess
+            print(f"Evicted {excess} least recently used scores from the cache")
+
+    def stats(self):
+        """Lookup statistics since this cache was opened"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': self._entries
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(f"Score cache: {stats['hits']:,} hits, {stats['misses']:,} misses "
+              f"(hit rate {stats['hit_rate']:.1%}), {stats['entries']:,} cached scores")
+
+    def close(self):
+        self.conn.close()
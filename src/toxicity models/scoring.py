@@ -0,0 +1,369 @@
+import hashlib
+import os
+import torch
+import pandas as pd
+
+from checkpoint import ScoreCheckpoint, chunk_hash, default_checkpoint_dir
+from onnx_backend import BACKENDS, ONNX_MODELS, to_onnx
+from score_cache import ScoreCache, model_revision, text_key
+
+MODEL_NAMES = {
+    'hatebert': "Hate-speech-CNERG/dehatebert-mono-english",
+    'hateXplain': "Hate-speech-CNERG/bert-base-uncased-hatexplain-rationale-two",
+    'toxicbert': "unitary/toxic-bert",
+}
+
+# Output column of each model in combined_data_scores.csv
+SCORE_COLUMNS = {
+    'hatebert': 'hatebert_toxicity_score',
+    'hateXplain': 'hateXplain_toxicity_score',
+    'toxicbert': 'toxicbert_toxicity_score',
+}
+# Output column marking the comments whose scores are `cascade.ScoringCascade` predictions (written with a cascade)
+CASCADE_COLUMN = 'cascade_skipped'
+
+
+def load_model(name, device=None, backend='torch'):
+    """
+    Load one of the three toxicity models (see `MODEL_NAMES`) and its tokenizer.
+
+    With `backend='onnx'` or `'onnx-int8'`, HateBERT and ToxicBERT run on ONNX Runtime
+    (CPU, optionally with dynamically quantized INT8 weights) instead of PyTorch;
+    HateXplain always runs on PyTorch.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    from transformers import (AutoModelForSequenceClassification, AutoTokenizer,
+                              BertForSequenceClassification, BertTokenizer)
+
+    model_name = MODEL_NAMES[name]
+    if name == 'hateXplain':
+        # Model class shipped with the HateXplain model card (models.py)
+        from models import Model_Rational_Label
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = Model_Rational_Label.from_pretrained(model_name, attn_implementation="eager")
+    elif name == 'toxicbert':
+        tokenizer = BertTokenizer.from_pretrained(model_name)
+        model = BertForSequenceClassification.from_pretrained(model_name)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+
+    if backend != 'torch' and name in ONNX_MODELS:
+        model.eval()
+        return to_onnx(name, model, backend), tokenizer
+
+    # Check if CUDA is available for GPU acceleration
+    device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model.to(device)
+    model.eval()
+    return model, tokenizer
+
+
+def load_models(names=tuple(MODEL_NAMES), device=None, backend='torch'):
+    """Load several toxicity models, returning {name: (model, tokenizer)}"""
+    return {name: load_model(name, device, backend) for name in names}
+
+
+def get_device(model):
+    """Return the device the model's weights live on"""
+    if not isinstance(model, torch.nn.Module):
+        # ONNX Runtime models (onnx_backend.OnnxClassifier) always run on the CPU
+        return model.device
+    return next(model.parameters()).device
+
+
+def forward_logits(model, input_ids, attention_mask):
+    """Run a forward pass and return the classification logits.
+
+    HateXplain's `Model_Rational_Label` returns a `(logits, attentions)` tuple,
+    while the Hugging Face classifiers return an output object with `.logits`.
+    """
+    outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+    if isinstance(outputs, tuple):
+        return outputs[0]
+    return outputs.logits
+
+
+def length_buckets(lengths, batch_size=32, max_tokens=8192):
+    """
+    Group positions into mini-batches of similar token length.
+
+    Positions are sorted by length so each batch only needs to be padded to its own
+    longest sequence. A batch is closed once it holds `batch_size` texts or once
+    adding the next text would exceed `max_tokens` padded tokens.
+
+    Parameters:
+    - lengths: Token length of every text.
+    - batch_size: Maximum number of texts per batch.
+    - max_tokens: Maximum number of padded tokens (texts x longest length) per batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batch = []
+    for i in order:
+        # Sorted ascending, so the current text sets the padded length of the batch
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * lengths[i] > max_tokens):
+            yield batch
+            batch = []
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def encode_texts(tokenizer, texts):
+    """Tokenize texts without padding, truncated to the model's maximum length"""
+    return tokenizer(list(texts), truncation=True)['input_ids']
+
+
+def tokenizer_key(tokenizer):
+    """
+    Fingerprint of everything that decides the token ids a tokenizer produces.
+
+    Tokenizers with the same key (e.g. the uncased BERT vocabulary shared by
+    HateXplain and ToxicBERT) produce identical `input_ids`, so texts only need to
+    be tokenized once for all of them.
+    """
+    vocab = sorted(tokenizer.get_vocab().items())
+    digest = hashlib.sha1(repr(vocab).encode('utf-8')).hexdigest()
+    return (digest,
+            getattr(tokenizer, 'do_lower_case', None),
+            tokenizer.model_max_length,
+            tokenizer.pad_token_id)
+
+
+def group_by_tokenizer(models):
+    """Group model names whose tokenizers produce identical token ids"""
+    groups = {}
+    for name, (_, tokenizer) in models.items():
+        groups.setdefault(tokenizer_key(tokenizer), []).append(name)
+    return list(groups.values())
+
+
+def score_encoded(model, tokenizer, input_ids, batch_size=32, max_tokens=8192, device=None):
+    """
+    Score already tokenized texts with length-bucketed, dynamically padded mini-batches.
+
+    Returns the probability of class 1 ("toxic") for every text, in input order.
+    """
+    device = device or get_device(model)
+    scores = [0.0] * len(input_ids)
+    lengths = [len(ids) for ids in input_ids]
+
+    with torch.inference_mode():
+        for batch in length_buckets(lengths, batch_size, max_tokens):
+            inputs = tokenizer.pad({'input_ids': [input_ids[i] for i in batch]}, return_tensors='pt')
+            logits = forward_logits(model,
+                                    inputs['input_ids'].to(device),
+                                    inputs['attention_mask'].to(device))
+            # Apply softmax to get probabilities for each class
+            probs = torch.nn.functional.softmax(logits, dim=-1)
+            # We assume class 1 is "toxic" and class 0 is "non-toxic"
+            for i, score in zip(batch, probs[:, 1].tolist()):
+                scores[i] = score
+    return scores
+
+
+def score_texts(model, tokenizer, texts, batch_size=32, max_tokens=8192, device=None):
+    """Tokenize and score a sequence of texts, returning toxicity scores in input order"""
+    input_ids = encode_texts(tokenizer, texts)
+    return score_encoded(model, tokenizer, input_ids, batch_size, max_tokens, device)
+
+
+def process_in_batches(input_csv, output_csv, model, tokenizer, model_name, chunk_size=1000,
+                       batch_size=32, max_tokens=8192, checkpoint_dir=None, cache=None):
+    """
+    Score every comment of the input CSV and write `index,toxicity_score` to the output CSV.
+
+    Scored chunks are recorded in a checkpoint manifest, so re-running after a crash
+    (or after the input is refreshed) only scores the chunks that are not already done.
+
+    Parameters:
+    - input_csv: CSV with at least the `index` and `text` columns (e.g. combined_data.csv).
+    - output_csv: The output CSV file to save the scores.
+    - model, tokenizer: The loaded toxicity model and its tokenizer.
+    - model_name: Name the model's scores are recorded under in the checkpoint (e.g. 'hatebert').
+    - chunk_size: Number of rows read from the input CSV at a time.
+    - batch_size: Maximum number of texts per forward pass.
+    - max_tokens: Maximum number of padded tokens per forward pass.
+    - checkpoint_dir: Checkpoint directory (default: `<output_csv>.checkpoint`).
+    - cache: Optional `ScoreCache` of previously scored texts.
+    """
+    models = {model_name: (model, tokenizer)}
+    checkpoint = ScoreCheckpoint(checkpoint_dir or default_checkpoint_dir(output_csv))
+    tmp_csv = f"{output_csv}.tmp"
+
+    with pd.read_csv(input_csv, chunksize=chunk_size) as reader:
+        for chunk_idx, chunk in enumerate(reader):
+            print(f'Processing batch {chunk_idx + 1}...')
+
+            # Score the whole chunk in length-bucketed mini-batches (or reuse the checkpoint)
+            scores = score_chunk_resumable(models, chunk, checkpoint, batch_size, max_tokens, cache=cache)
+            chunk['toxicity_score'] = scores[model_name]
+
+            # Save only the 'index' and 'toxicity_score' columns
+            scores_df = chunk[['index', 'toxicity_score']]
+
+            # Write the result to a temporary file, renamed into place once complete
+            if chunk_idx == 0:
+                scores_df.to_csv(tmp_csv, index=False, mode='w')  # Write header for the first batch
+            else:
+                scores_df.to_csv(tmp_csv, index=False, mode='a', header=False)  # Append mode without header
+            print(f'Batch {chunk_idx + 1} processed and saved.')
+
+    os.replace(tmp_csv, output_csv)
+    checkpoint.compact()
+    if cache is not None:
+        cache.report()
+
+
+def score_chunk(models, texts, batch_size=32, max_tokens=8192, groups=None, cache=None):
+    """
+    Score the same texts with several models, tokenizing once per distinct vocabulary.
+
+    Duplicate texts within the chunk are only scored once, and texts found in the
+    score cache are not scored at all: only the remaining texts are tokenized and
+    batched for inference, and their scores are added to the cache.
+
+    Parameters:
+    - models: Dict of {name: (model, tokenizer)}, as returned by `load_models`.
+    - texts: Sequence of comment texts.
+    - groups: Model names grouped by shared tokenizer (computed if not given).
+    - cache: Optional `ScoreCache` consulted before inference.
+
+    Returns a dict of {name: list of toxicity scores in input order}.
+    """
+    texts = list(texts)
+    groups = groups or group_by_tokenizer(models)
+
+    # Position of the first occurrence of every distinct (normalized) text
+    keys = [text_key(text) for text in texts]
+    first_seen = {}
+    for i, key in enumerate(keys):
+        first_seen.setdefault(key, i)
+    unique_keys = list(first_seen)
+
+    scores = {}
+    for names in groups:
+        known = {}
+        for name in names:
+            known[name] = (cache.lookup(name, model_revision(models[name][0]), unique_keys)
+                           if cache is not None else {})
+
+        # Tokenize each text once for every model of the group that still needs it
+        pending = [key for key in unique_keys if any(key not in known[name] for name in names)]
+        input_ids = encode_texts(models[names[0]][1], [texts[first_seen[key]] for key in pending])
+
+        for name in names:
+            model, tokenizer = models[name]
+            todo = [j for j, key in enumerate(pending) if key not in known[name]]
+            fresh = score_encoded(model, tokenizer, [input_ids[j] for j in todo], batch_size, max_tokens)
+            fresh = {pending[j]: score for j, score in zip(todo, fresh)}
+            if cache is not None and fresh:
+                cache.store(name, model_revision(model), fresh)
+            known[name].update(fresh)
+            scores[name] = [known[name][key] for key in keys]
+    return scores
+
+
+def score_chunk_resumable(models, chunk, checkpoint=None, batch_size=32, max_tokens=8192, groups=None,
+                          cache=None):
+    """
+    Score a chunk of input rows, reusing the scores already recorded in the checkpoint.
+
+    Only the models that have not scored a chunk with the same content hash are run,
+    and their fresh scores are recorded before returning.
+    """
+    if checkpoint is None:
+        return score_chunk(models, chunk['text'], batch_size, max_tokens, groups, cache)
+
+    digest = chunk_hash(chunk)
+    scores = {name: checkpoint.load(name, digest)
+              for name in models if checkpoint.completed(name, digest)}
+
+    pending = {name: models[name] for name in models if name not in scores}
+    if pending:
+        if groups:
+            groups = [[name for name in names if name in pending] for names in groups]
+            groups = [names for names in groups if names]
+        fresh = score_chunk(pending, chunk['text'], batch_size, max_tokens, groups, cache)
+        for name, model_scores in fresh.items():
+            checkpoint.record(name, digest, chunk['index'], model_scores)
+        scores.update(fresh)
+    return scores
+
+
+def add_score_columns(chunk, scores):
+    """Attach per-model scores and their average (and the cascade marker, if any) to a chunk of combined_data"""
+    for name, column in SCORE_COLUMNS.items():
+        chunk[column] = scores[name]
+    chunk['average_toxicity_score'] = chunk[list(SCORE_COLUMNS.values())].mean(axis=1)
+    if CASCADE_COLUMN in scores:
+        chunk[CASCADE_COLUMN] = scores[CASCADE_COLUMN]
+    return chunk
+
+
+def score_corpus(input_csv, output_csv, models, chunk_size=1000, batch_size=32, max_tokens=8192,
+                 checkpoint_dir=None, cache=None, cascade=None):
+    """
+    Score the corpus with all three models in a single pass and write combined_data_scores.csv.
+
+    Every chunk of combined_data.csv is read once, tokenized once per distinct
+    vocabulary and fed to all models. The output keeps every input column and adds
+    `hatebert_toxicity_score`, `hateXplain_toxicity_score`, `toxicbert_toxicity_score`
+    and `average_toxicity_score`, so no merge on `index` is needed afterwards.
+    Scored chunks are recorded per model in a checkpoint manifest, so an interrupted
+    run resumes where it stopped.
+
+    Parameters:
+    - input_csv: combined_data.csv produced by data_processing.ipynb.
+    - output_csv: The output CSV file (combined_data_scores.csv).
+    - models: Dict of {name: (model, tokenizer)} for all names in `SCORE_COLUMNS`.
+    - chunk_size: Number of rows read from the input CSV at a time.
+    - batch_size, max_tokens: Mini-batch limits passed to the scoring engine.
+    - checkpoint_dir: Checkpoint directory (default: `<output_csv>.checkpoint`).
+    - cache: Optional `ScoreCache` of previously scored texts.
+    - cascade: Optional `cascade.ScoringCascade`; comments it predicts as clearly benign keep
+      its predicted scores and skip the three models. The output then has a
+      `cascade_skipped` column marking them.
+    """
+    groups = group_by_tokenizer(models)
+    print(f"Tokenizer groups: {groups}")
+    checkpoint = ScoreCheckpoint(checkpoint_dir or default_checkpoint_dir(output_csv))
+    tmp_csv = f"{output_csv}.tmp"
+    if cascade is not None:
+        cascade.reset()
+
+    with pd.read_csv(input_csv, chunksize=chunk_size) as reader:
+        for chunk_idx, chunk in enumerate(reader):
+            print(f'Processing batch {chunk_idx + 1}...')
+            score = cascade.score_chunk_resumable if cascade is not None else score_chunk_resumable
+            scores = score(models, chunk, checkpoint, batch_size, max_tokens, groups, cache)
+            chunk = add_score_columns(chunk, scores)
+
+            if chunk_idx == 0:
+                chunk.to_csv(tmp_csv, index=False, mode='w')  # Write header for the first batch
+            else:
+                chunk.to_csv(tmp_csv, index=False, mode='a', header=False)  # Append mode without header
+            print(f'Batch {chunk_idx + 1} processed and saved.')
+
+    os.replace(tmp_csv, output_csv)
+    checkpoint.compact()
+    for name in models:
+        print(f"{name}: completed index ranges {checkpoint.completed_ranges(name)}")
+    if cascade is not None:
+        # The checkpointed chunks are the escalated rows only; their ranges span the skipped rows too
+        print(f"The index ranges above only cover the {cascade.escalated} of {cascade.screened} comments the "
+              f"cascade sent to the models; the others have predicted scores ({CASCADE_COLUMN})")
+    if cache is not None:
+        cache.report()
+    if cascade is not None:
+        cascade.report()
+
+
+if __name__ == "__main__":
+    # Run from the project root directory
+    models = load_models()
+    cache = ScoreCache('data/score_cache.sqlite')
+    score_corpus('data/combined_data.csv', 'data/combined_data_scores.csv', models, chunk_size=500,
+                 cache=cache)
+    print("Scoring completed successfully!")
@@ -0,0 +1,406 @@
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from score_cache import ScoreCache
+from scoring import SCORE_COLUMNS, group_by_tokenizer, load_models, score_chunk
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def score_rows(scores, n_texts):
+    """Per-text rows of the per-model scores of `score_chunk` and their average (the combined_data_scores columns)"""
+    rows = []
+    for i in range(n_texts):
+        row = {SCORE_COLUMNS[name]: model_scores[i] for name, model_scores in scores.items()}
+        row['average_toxicity_score'] = sum(row.values()) / len(row)
+        rows.append(row)
+    return rows
+
+
+def model_scorer(models, batch_size=32, max_tokens=8192, cache_path=None):
+    """
+    Function scoring a list of texts with all models, as used by the service.
+
+    It runs in the service's single inference thread; the optional score cache
+    (a SQLite connection, which belongs to the thread that opened it) is opened
+    there on first use.
+    """
+    groups = group_by_tokenizer(models)
+    state = {}
+
+    def score(texts):
+        if cache_path and 'cache' not in state:
+            state['cache'] = ScoreCache(cache_path)
+        scores = score_chunk(models, texts, batch_size, max_tokens, groups, state.get('cache'))
+        return score_rows(scores, len(texts))
+
+    return score
+
+
+def percentiles(values, qs=(50, 90, 99)):
+    """Percentiles of a sequence of seconds, in milliseconds"""
+    if not len(values):
+        return {f"p{q}": None for q in qs}
+    return {f"p{q}": round(float(np.percentile(values, q)) * 1000, 2) for q in qs}
+
+
+class MicroBatcher:
+    """
+    Collects concurrent scoring requests in an asyncio queue and scores them in dynamic micro-batches.
+
+    A batch is flushed as soon as it holds `max_batch_size` texts or `max_wait_ms`
+    after its first text arrived, whichever comes first. Batches run one at a
+    time in a single inference thread, so the event loop keeps accepting
+    requests (which queue up for the next batch) while the models run. If a
+    batch fails, the texts of each of its requests are scored again on their
+    own, so only the requests whose texts fail get the error.
+
+    Parameters:
+    - score_fn: Function scoring a list of texts and returning one dict of scores per text (see `model_scorer`).
+    - max_batch_size: Maximum number of texts per batch.
+    - max_wait_ms: Longest time the first text of a batch waits for more texts.
+    - history: Number of recent requests and batches the latency and queue metrics are computed over.
+    """
+
+    def __init__(self, score_fn, max_batch_size=64, max_wait_ms=10, history=10_000):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self._task = None
+
+        self.started = time.time()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.errors = 0
+        self.max_queue_depth = 0
+        self.latencies = deque(maxlen=history)         # Seconds from request to response
+        self.batch_sizes = deque(maxlen=history)
+        self.inference_seconds = deque(maxlen=history)
+        self.queue_depths = deque(maxlen=history)      # Texts left in the queue when a batch is flushed
+
+    def start(self):
+        """Create the queue and the batching task (on the running event loop)"""
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def score(self, texts):
+        """Score a list of texts, returning one dict of scores per text"""
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        request = object()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.queue.put_nowait((text, future, request))
+            futures.append(future)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        rows = await asyncio.gather(*futures, return_exceptions=True)
+        for row in rows:
+            if isinstance(row, BaseException):
+                self.errors += 1
+                raise row
+        self.requests += 1
+        self.texts += len(texts)
+        self.latencies.append(time.perf_counter() - t0)
+        return rows
+
+    async def _next_batch(self):
+        """Wait for a first text, then collect texts until the batch is full or its deadline passes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # Texts that queued up during the previous batch are taken without waiting
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _score_batch(self, batch):
+        """Score a batch in the inference thread and resolve its futures (raises if scoring fails)"""
+        t0 = time.perf_counter()
+        rows = await asyncio.get_running_loop().run_in_executor(self.executor, self.score_fn,
+                                                                [text for text, _, _ in batch])
+        self.batches += 1
+        self.batch_sizes.append(len(batch))
+        self.inference_seconds.append(time.perf_counter() - t0)
+        for (_, future, _), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            self.queue_depths.append(self.queue.qsize())
+            try:
+                await self._score_batch(batch)
+            except Exception:
+                # Score the texts of every request on their own, so only the requests whose texts fail get the error
+                requests = {}
+                for item in batch:
+                    requests.setdefault(item[2], []).append(item)
+                for items in requests.values():
+                    try:
+                        await self._score_batch(items)
+                    except Exception as e:
+                        for _, future, _ in items:
+                            if not future.done():
+                                future.set_exception(e)
+
+    def metrics(self):
+        """Request, batch, latency and queue-depth metrics (latencies in ms, over the recent history)"""
+        return {
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'requests': self.requests,
+            'texts': self.texts,
+            'batches': self.batches,
+            'errors': self.errors,
+            'mean_batch_size': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else None,
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'max_queue_depth': self.max_queue_depth,
+            'queue_depth_at_flush': {'mean': round(float(np.mean(self.queue_depths)), 2) if self.queue_depths else None,
+                                     'max': max(self.queue_depths, default=None)},
+            'latency_ms': percentiles(self.latencies),
+            'inference_ms': percentiles(self.inference_seconds),
+        }
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request: (method, path, headers, body), or None when the client closed the connection"""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, version = request_line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if version == 'HTTP/1.0' and 'connection' not in headers:
+        headers['connection'] = 'close'
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, headers, body
+
+
+def http_response(status, payload, keep_alive=True):
+    """Bytes of a JSON HTTP response"""
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+class ScoringService:
+    """
+    Local HTTP API of a `MicroBatcher`.
+
+    - `POST /score` with `{"texts": [...]}` (or `{"text": "..."}`) returns
+      `{"scores": [...]}`: per text, the score of every model and
+      `average_toxicity_score`, under the combined_data_scores.csv column names.
+    - `GET /metrics` returns `MicroBatcher.metrics()`.
+    - `GET /health` returns `{"status": "ok"}`.
+
+    Parameters:
+    - batcher: The micro-batcher scoring the texts.
+    - max_request_texts: Maximum number of texts per request.
+    """
+
+    def __init__(self, batcher, max_request_texts=1000):
+        self.batcher = batcher
+        self.max_request_texts = max_request_texts
+
+    async def route(self, method, path, body):
+        """(status, payload) of one request"""
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.batcher.metrics()
+        if path != '/score':
+            return 404, {'error': f"Unknown path {path}"}
+        if method != 'POST':
+            return 405, {'error': "Use POST /score"}
+        try:
+            request = json.loads(body)
+            texts = request['texts'] if 'texts' in request else [request['text']]
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'Expected a JSON object with "texts" (a list of strings) or "text"'}
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 400, {'error': '"texts" must be a list of strings'}
+        if len(texts) > self.max_request_texts:
+            return 413, {'error': f"At most {self.max_request_texts} texts per request"}
+        return 200, {'scores': await self.batcher.score(texts)}
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one (keep-alive) connection"""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(http_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start_service(score_fn, host='127.0.0.1', port=8765, max_batch_size=64, max_wait_ms=10):
+    """Start the batcher and the HTTP server on the running event loop, returning (server, batcher)"""
+    batcher = MicroBatcher(score_fn, max_batch_size, max_wait_ms)
+    batcher.start()
+    service = ScoringService(batcher)
+    server = await asyncio.start_server(service.handle, host, port)
+    return server, batcher
+
+
+def serve(models, host='127.0.0.1', port=8765, max_batch_size=64, max_wait_ms=10, batch_size=32,
+          max_tokens=8192, cache_path=None):
+    """
+    Run the scoring service until interrupted.
+
+    Parameters:
+    - models: Dict of {name: (model, tokenizer)}, loaded once (see `load_models`).
+    - host, port: Address the HTTP API listens on.
+    - max_batch_size, max_wait_ms: Micro-batch limits (see `MicroBatcher`).
+    - batch_size, max_tokens: Mini-batch limits of the scoring engine within a micro-batch.
+    - cache_path: Optional score cache (e.g. data/score_cache.sqlite).
+    """
+    async def main():
+        score_fn = model_scorer(models, batch_size, max_tokens, cache_path)
+        server, _ = await start_service(score_fn, host, port, max_batch_size, max_wait_ms)
+        print(f"Scoring service listening on http://{host}:{port} (POST /score, GET /metrics)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Scoring service stopped")
+
+
+async def http_request(reader, writer, method, path, payload=None):
+    """Send one request over an open keep-alive connection and return (status, JSON payload)"""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+
+async def generate_load(host, port, texts, n_requests=1000, concurrency=32, texts_per_request=1):
+    """
+    Send `n_requests` scoring requests from `concurrency` clients, each on its own keep-alive connection.
+
+    Returns the throughput and the client-side latency percentiles.
+    """
+    latencies = []
+    counter = iter(range(n_requests))
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in counter:
+            start = i * texts_per_request
+            batch = [texts[(start + j) % len(texts)] for j in range(texts_per_request)]
+            t0 = time.perf_counter()
+            status, _ = await http_request(reader, writer, 'POST', '/score', {'texts': batch})
+            if status != 200:
+                raise RuntimeError(f"POST /score returned {status}")
+            latencies.append(time.perf_counter() - t0)
+        writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    seconds = time.perf_counter() - t0
+    return {'requests_per_second': round(n_requests / seconds, 1),
+            'texts_per_second': round(n_requests * texts_per_request / seconds, 1),
+            **{f"latency_{name}_ms": value for name, value in percentiles(latencies).items()}}
+
+
+def benchmark_service(score_fn, texts, configs=((1, 0), (64, 10)), concurrency=(1, 8, 32, 64), n_requests=500):
+    """
+    Load-test local service instances and compare micro-batch settings.
+
+    Every (max_batch_size, max_wait_ms) configuration is served on a free local
+    port and loaded by the load generator at each concurrency; a max_batch_size
+    of 1 scores every request on its own (no micro-batching). The service's own
+    mean batch size and queue depth are read from GET /metrics.
+    """
+    async def run():
+        results = []
+        for max_batch_size, max_wait_ms in configs:
+            for clients in concurrency:
+                server, batcher = await start_service(score_fn, '127.0.0.1', 0, max_batch_size, max_wait_ms)
+                port = server.sockets[0].getsockname()[1]
+                load = await generate_load('127.0.0.1', port, texts, n_requests, clients)
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                _, metrics = await http_request(reader, writer, 'GET', '/metrics')
+                writer.close()
+                server.close()
+                await server.wait_closed()
+                await batcher.stop()
+                results.append({'max_batch_size': max_batch_size, 'max_wait_ms': max_wait_ms,
+                                'concurrency': clients, **load, 'mean_batch_size': metrics['mean_batch_size'],
+                                'max_queue_depth': metrics['max_queue_depth'],
+                                'server_p99_ms': metrics['latency_ms']['p99']})
+        return pd.DataFrame(results)
+
+    results = asyncio.run(run())
+    print(results.to_string(index=False))
+    return results
+
+
+if __name__ == "__main__":
+    # Run from the project root directory: `python "src/toxicity models/scoring_service.py"` serves the
+    # three models on port 8765, `... benchmark` load-tests local instances with comments of combined_data.csv
+    models = load_models()
+    if sys.argv[1:] == ['benchmark']:
+        texts = pd.read_csv('data/combined_data.csv', usecols=['text'], nrows=2000)['text'].astype(str).tolist()
+        benchmark_service(model_scorer(models), texts)
+    else:
+        serve(models, cache_path='data/score_cache.sqlite')